@@ -7,6 +7,8 @@ from models.annotation import AnnotationError
 from .user import api as ns_user
 from .annotation import api as ns_annotation
 from .collection import api as ns_collection
+from .iiif import api as ns_iiif
+from .changes import api as ns_changes
 
 blueprint = Blueprint('api', __name__)
 api = Api(blueprint,
@@ -20,6 +22,8 @@ api = Api(blueprint,
 api.add_namespace(ns_user)
 api.add_namespace(ns_annotation)
 api.add_namespace(ns_collection)
+api.add_namespace(ns_iiif)
+api.add_namespace(ns_changes)
 
 
 @api.errorhandler(InvalidUsage)
@@ -1,10 +1,20 @@
+import gzip
+import json
+import threading
+import time
+from functools import partial, wraps
 from typing import Dict, Union
-from flask import request, abort, jsonify, make_response, g
+from flask import request, abort, jsonify, make_response, g, Response, stream_with_context
 from flask_restx import Namespace, Resource, fields
-from parse.headers_params import get_params
+from parse.headers_params import get_params, get_non_negative_int, encode_cursor
 from models.annotation_store import AnnotationStore
 from models.user_store import UserStore
-from models.annotation_container import AnnotationContainer
+from models.annotation_container import AnnotationContainer, default_page_size, update_url
+from models.change_log import default_settle_time, make_activity
+from models.error import InvalidUsage
+from models.event_dispatcher import EventDispatcher
+from models.query_cache import LocalCacheBackend, SharedGeneration
+from models.response_cache import PublicResponseCache, make_etag, varying_headers
 from settings import server_config
 from flask_httpauth import HTTPBasicAuth
 
@@ -14,6 +24,31 @@ annotation_store = AnnotationStore(server_config["Elasticsearch"])
 user_store = UserStore(server_config["Elasticsearch"])
 api = Namespace(namespace, description='Annotation related operations')
 auth = HTTPBasicAuth()
+es_config = server_config["Elasticsearch"]
+swa_config = server_config["SWAServer"]
+event_poll_interval = swa_config["event_poll_interval"] if "event_poll_interval" in swa_config else 1
+event_keepalive = swa_config["event_keepalive"] if "event_keepalive" in swa_config else 15
+event_stream_timeout = swa_config["event_stream_timeout"] if "event_stream_timeout" in swa_config else 60
+max_event_streams = swa_config["max_event_streams"] if "max_event_streams" in swa_config else 1
+# an event stream of the WSGI app holds a server thread, so the streams per process are limited and
+# end after event_stream_timeout seconds, after which clients reconnect with the id of their last event
+event_streams = threading.BoundedSemaphore(max_event_streams)
+change_settle_time = es_config["change_settle_time"] if "change_settle_time" in es_config else default_settle_time
+# one dispatcher per server process follows the change log for all event subscribers
+event_dispatcher = EventDispatcher(annotation_store.get_all_changes_es, annotation_store.get_last_change_sequence,
+                                   poll_interval=event_poll_interval, settle_time=change_settle_time)
+public_cache_size = swa_config["public_cache_size"] if "public_cache_size" in swa_config else 1000
+public_cache_max_age = swa_config["public_cache_max_age"] if "public_cache_max_age" in swa_config else 10
+public_cache_check_interval = swa_config["public_cache_check_interval"] \
+    if "public_cache_check_interval" in swa_config else 1
+# responses to anonymous requests are the same for everyone, so they are served from one cache, which
+# follows the change log to see writes through other server processes
+public_response_cache = PublicResponseCache(
+    LocalCacheBackend(max_size=public_cache_size, ttl=public_cache_max_age), max_age=public_cache_max_age,
+    shared_generation=SharedGeneration(annotation_store.get_last_change_sequence,
+                                       check_interval=public_cache_check_interval)) if public_cache_size else None
+if public_response_cache:
+    annotation_store.add_write_listener(public_response_cache.invalidate)
 
 # generic response model
 response_model = api.model("Response", {
@@ -118,6 +153,28 @@ collection_list_model = api.model("AnnotationCollectionListResponse", {
     "collections": fields.List(fields.Nested(annotation_collection_model), description="List of annotation collections")
 })
 
+stats_model = api.model("AnnotationStats", {
+    "total": fields.Integer(description="Total number of annotations and collections the user can see"),
+    "types": fields.Raw(description="Number of annotations and collections per type"),
+    "access_status": fields.Raw(description="Number of annotations and collections per access status"),
+})
+
+target_search_model = api.model("AnnotationTargetSearch", {
+    "target_ids": fields.List(fields.String(description="Target ID"), required=True,
+                              description="IDs of the targets to get annotations for"),
+})
+
+target_search_response = api.model("AnnotationTargetSearchResponse", {
+    "total": fields.Integer(description="Number of distinct annotations on the targets"),
+    "targets": fields.Raw(description="Annotations per target ID"),
+})
+
+text_search_response = api.model("AnnotationTextSearchResponse", {
+    "total": fields.Integer(description="Number of annotations matching the query"),
+    "items": fields.Raw(description="Matching annotations with their highlighted snippets, most relevant first"),
+    "next": fields.String(description="URL of the next page of results, if any"),
+})
+
 
 @auth.verify_password
 def verify_password(token_or_username, password):
@@ -150,6 +207,31 @@ def configure_store(config: Dict[str, Union[str, int]]):
     user_store.configure(config)
 
 
+def cache_public_response(get):
+    """Serve GET requests of anonymous users from the public response cache, as gzipped JSON that
+    proxies can cache too. Responses to other users can include private annotations, so proxies
+    are told not to share them."""
+    @wraps(get)
+    def wrapper(*args, **kwargs):
+        if g.user is not None or not public_response_cache:
+            data = get(*args, **kwargs)
+            if not isinstance(data, (dict, list)):
+                return data
+            return data, 200, {"Cache-Control": "private", "Vary": ", ".join(varying_headers)}
+        key = public_response_cache.make_key(request.base_url, request.args.to_dict(flat=False),
+                                             request.headers.get("Prefer"))
+        body, _ = public_response_cache.get_or_make(key, lambda: get(*args, **kwargs))
+        headers = {}
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+        else:
+            body = gzip.decompress(body)
+        headers.update(public_response_cache.get_headers(etag=make_etag(body)))
+        response = Response(body, mimetype="application/json", headers=headers)
+        return response.make_conditional(request)
+    return wrapper
+
+
 def make_external_id(annotation_id: str) -> str:
     """Turn a full external id with API URL into an internal id without API URL."""
     return f"{api_url}/{namespace}/{annotation_id}"
@@ -165,9 +247,16 @@ def make_internal_id(annotation_id: str) -> str:
 
 annotation_parameters = {
     'iris': 'Integer: 0 (show full annotations) or 1 (show only IRIs)',
+    'page': 'Integer: number of the annotation page to show, starting at 0',
+    'page_size': 'Integer: number of annotations per page, bounded by the configured maximum',
     'access_status': 'access and permission status: "private", "public"',
     'target_id': 'annotation target id: only retrieve annotations targeting a specific id',
-    'target_type': 'annotation target type: only retrieve annotations targeting a specific type'
+    'target_type': 'annotation target type: only retrieve annotations targeting a specific type',
+    'descendants_of': 'resource id: only retrieve annotations on resources inside this resource',
+    'ancestors_of': 'resource id: only retrieve annotations on resources containing this resource',
+    'region': 'x,y,w,h: only retrieve annotations on image regions overlapping this region',
+    'text_range': 'start,end: only retrieve annotations on character ranges overlapping this range',
+    'time_range': 'start,end: only retrieve annotations on media time ranges (seconds) overlapping this range'
 }
 
 
@@ -178,14 +267,20 @@ class AnnotationsAPI(Resource):
     @auth.login_required
     @api.response(200, 'Success', container_model)
     @api.response(404, 'Annotation Error', response_model)
+    @cache_public_response
     def get(self):
         params = get_params(request)
-        data = annotation_store.get_annotations_es(params)
-        # print('ANNOTATION API - request.url:', request.url)
-        # print('ANNOTATION API - request.base_url:', request.base_url)
-        # print('ANNOTATION API - request.url_root:', request.url_root)
-        container = AnnotationContainer(request.base_url, data["annotations"],
-                                        view=params["view"], total=data["total"])
+        # only the page that is shown is fetched from the store
+        fetch_page = partial(annotation_store.get_annotations_page_es, params)
+        page_size = params["page_size"] if "page_size" in params else default_page_size
+        base_url = request.base_url
+        if "page_size" in params:
+            # keep the requested page size in the page references
+            base_url = update_url(base_url, {"page_size": page_size})
+        container = AnnotationContainer(base_url, fetch_page, page_size=page_size,
+                                        view=params["view"], total=annotation_store.count_annotations_es(params))
+        if request.args.get("page") is not None:
+            return container.view_page(params["page"])
         return container.view()
 
     @auth.login_required
@@ -201,6 +296,140 @@ class AnnotationsAPI(Resource):
         return annotation, 201
 
 
+@api.doc(params={'access_status': annotation_parameters['access_status']}, required=False)
+@api.route("/stats", endpoint='annotation_stats')
+class AnnotationStatsAPI(Resource):
+
+    @auth.login_required
+    @api.response(200, 'Success', stats_model)
+    def get(self):
+        params = get_params(request)
+        return annotation_store.get_stats_es(params)
+
+
+@api.doc(params={'access_status': annotation_parameters['access_status']}, required=False)
+@api.route("/search", endpoint='annotation_search')
+class AnnotationSearchAPI(Resource):
+
+    @auth.login_required
+    @api.doc(params={
+        'q': 'text to search for in annotation bodies',
+        'cursor': 'cursor of the next page, taken from the previous page',
+        'page_size': annotation_parameters['page_size']
+    })
+    @api.response(200, 'Success', text_search_response)
+    @api.response(400, 'Invalid search', response_model)
+    def get(self):
+        params = get_params(request)
+        if "q" not in params:
+            raise InvalidUsage("search should have a 'q' parameter with the text to search for")
+        params["page_size"] = params["page_size"] if "page_size" in params else default_page_size
+        data = annotation_store.search_annotations_es(params["q"], params)
+        for item in data["items"]:
+            item["annotation"]["id"] = make_external_id(item["annotation"]["id"])
+        cursor = data.pop("cursor")
+        if cursor is not None:
+            data["next"] = update_url(request.url, {"cursor": encode_cursor(cursor)})
+        return data
+
+    @auth.login_required
+    @api.response(200, 'Success', target_search_response)
+    @api.response(400, 'Invalid search', response_model)
+    @api.expect(target_search_model)
+    def post(self):
+        params = get_params(request)
+        # target ids are sent in the body, as large sets of ids don't fit in a URL
+        search = request.get_json(silent=True)
+        if not search or not isinstance(search.get("target_ids"), list) or \
+                not all(isinstance(target_id, str) for target_id in search["target_ids"]):
+            raise InvalidUsage("search body should have a 'target_ids' list of target IDs")
+        data = annotation_store.get_annotations_by_targets_es(search["target_ids"], params)
+        converted = set()
+        for annotations in data["targets"].values():
+            for annotation in annotations:
+                # annotations on multiple targets are the same object, so only update their id once
+                if id(annotation) not in converted:
+                    annotation["id"] = make_external_id(annotation["id"])
+                    converted.add(id(annotation))
+        return data
+
+
+def format_event(change: dict) -> str:
+    activity = make_activity(change, lambda object_id, _object_type: make_external_id(object_id))
+    return "id: {s}\nevent: {t}\ndata: {d}\n\n".format(s=change["seq"], t=change["type"], d=json.dumps(activity))
+
+
+def stream_events(subscription, backlog, since=None):
+    """Send the missed changes, then the changes of the subscription as they come, until the stream
+    times out. Comments keep the connection open while there are no changes."""
+    last_seq = since or 0
+    end_time = time.monotonic() + event_stream_timeout
+    try:
+        for change in backlog:
+            last_seq = change["seq"]
+            yield format_event(change)
+        # a subscriber that doesn't keep up is dropped, and reconnects from the last event it got
+        while not subscription.overflowed and time.monotonic() < end_time:
+            change = subscription.get(timeout=min(event_keepalive, max(end_time - time.monotonic(), 0)))
+            if change is None:
+                yield ": keep-alive\n\n"
+            elif change["seq"] > last_seq:
+                last_seq = change["seq"]
+                yield format_event(change)
+    finally:
+        event_dispatcher.unsubscribe(subscription)
+
+
+def close_event_stream(subscription):
+    # also called when the client is gone before the stream started
+    event_dispatcher.unsubscribe(subscription)
+    event_streams.release()
+
+
+@api.doc(params={
+    'target_id': 'comma-separated ids of the targets to get create, update and delete events for',
+    'access_status': annotation_parameters['access_status']
+})
+@api.route("/events", endpoint='annotation_events')
+class AnnotationEventsAPI(Resource):
+
+    @auth.login_required
+    @api.response(200, 'Stream of server-sent events')
+    @api.response(400, 'Invalid subscription', response_model)
+    @api.response(503, 'Too many event subscribers', response_model)
+    def get(self):
+        params = get_params(request)
+        if "filter" not in params or "target_id" not in params["filter"]:
+            raise InvalidUsage("events subscription should have a 'target_id' parameter")
+        since = None
+        if request.headers.get("Last-Event-ID"):
+            since = get_non_negative_int(request.headers.get("Last-Event-ID"), "Last-Event-ID")
+        if not event_streams.acquire(blocking=False):
+            raise InvalidUsage("too many event subscribers, try again later", status_code=503)
+        subscription = None
+        try:
+            # subscribe before getting missed changes, the changes dispatched before are in the backlog
+            subscription = event_dispatcher.subscribe(params["filter"]["target_id"], params["username"])
+            backlog = []
+            if since is not None:
+                # the client reconnects, send the changes it missed
+                backlog = [change for change in annotation_store.get_missed_changes_es(
+                    since, subscription.start_seq, subscription.target_ids, params) if subscription.matches(change)]
+        except Exception:
+            # without a stream, nothing else releases the stream slot
+            if subscription:
+                event_dispatcher.unsubscribe(subscription)
+            event_streams.release()
+            raise
+        response = Response(stream_with_context(stream_events(subscription, backlog, since)),
+                            mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        # don't let proxies buffer the stream
+        response.headers["X-Accel-Buffering"] = "no"
+        response.call_on_close(partial(close_event_stream, subscription))
+        return response
+
+
 @api.doc(params={'annotation_id': '<annotation_uuid>'}, required=False)
 @api.route('/<annotation_id>', endpoint='annotation')
 class AnnotationAPI(Resource):
@@ -209,6 +438,7 @@ class AnnotationAPI(Resource):
     @api.response(200, 'Success', annotation_model)
     @api.response(403, 'Invalid Annotation Error', response_model)
     @api.response(404, 'Annotation does not exist', response_model)
+    @cache_public_response
     def get(self, annotation_id):
         params = get_params(request)
         try:
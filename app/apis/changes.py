@@ -0,0 +1,51 @@
+from flask import request
+from flask_restx import Namespace, Resource, fields
+from parse.headers_params import get_params, get_non_negative_int
+from apis.annotation import annotation_store, annotation_parameters, auth
+from models.annotation_container import default_page_size, update_url
+from models.change_log import make_change_page
+from settings import server_config
+
+namespace = 'changes'
+api_url = server_config['SWAServer']['url'] + server_config['SWAServer']['api_prefix']
+# the annotation store and authentication are shared with the annotations namespace
+api = Namespace(namespace, description='Change log of annotations and collections')
+
+change_page_model = api.model("ChangePage", {
+    "@context": fields.String(description="ActivityStreams context", required=True),
+    "id": fields.String(description="URL of this page of changes"),
+    "type": fields.String(description="Page type", enum=["OrderedCollectionPage"]),
+    "orderedItems": fields.Raw(description="Create, Update and Delete activities in the order they happened"),
+    "next": fields.String(description="URL of the changes after this page, present if this page has changes"),
+})
+
+
+def make_object_id(object_id: str, object_type: str) -> str:
+    object_namespace = "collections" if object_type == "AnnotationCollection" else "annotations"
+    return f"{api_url}/{object_namespace}/{object_id}"
+
+
+"""--------------- Change log endpoints ------------------"""
+
+
+@api.doc(params={
+    'since': 'Integer: sequence number of the last change that was seen, 0 to start at the first change',
+    'page_size': annotation_parameters['page_size'],
+    'access_status': annotation_parameters['access_status']
+})
+@api.route("/", endpoint='changes')
+class ChangesAPI(Resource):
+
+    @auth.login_required
+    @api.response(200, 'Success', change_page_model)
+    @api.response(400, 'Invalid parameters')
+    def get(self):
+        params = get_params(request)
+        since = get_non_negative_int(request.args.get("since", "0"), "since")
+        params["page_size"] = params["page_size"] if "page_size" in params else default_page_size
+        changes = annotation_store.get_changes_es(since, params)
+        # a mirror follows the next links to keep in sync, a page without changes has no next link
+        # and is polled again later
+        next_page_id = update_url(request.url, {"since": changes[-1]["seq"]}) if changes else None
+        collection_id = f"{api_url}/{namespace}/"
+        return make_change_page(request.url, collection_id, changes, make_object_id, next_page_id)
@@ -1,14 +1,35 @@
-from flask import request, abort
+from functools import partial
+from flask import request, abort, Response, stream_with_context
 from flask_restx import Namespace, Resource, fields
-from models.annotation_store import AnnotationStore
-from models.iiif_manifest import Manifest
+from parse.headers_params import get_params, encode_cursor
+from apis.annotation import annotation_store, annotation_parameters, auth, cache_public_response, make_external_id
+from models.annotation_container import default_page_size, update_url
+from models.content_search import autocomplete_sample_size, count_matching_terms, make_scope_id, \
+    make_search_page, make_search_service, make_term_page, parse_scope_id
+from models.annotation import Annotation
+from models.error import InvalidUsage, PermissionError
+from models.iiif_manifest import Manifest, ManifestCache
+from models.query_cache import SharedGeneration
 import models.iiif_manifest as iiif_manifest
+import models.iiif_import as iiif_import
 from settings import server_config
-from flask_httpauth import HTTPBasicAuth
 
-annotation_store = AnnotationStore(server_config["Elasticsearch"])
-api = Namespace('annotations', description='Annotation related operations')
-auth = HTTPBasicAuth()
+namespace = 'iiif'
+api_url = server_config['SWAServer']['url'] + server_config['SWAServer']['api_prefix']
+# the annotation store and authentication are shared with the annotations namespace
+api = Namespace(namespace, description='IIIF related operations')
+swa_config = server_config['SWAServer']
+manifest_cache_size = swa_config['manifest_cache_size'] if 'manifest_cache_size' in swa_config else 1000
+manifest_cache_ttl = swa_config['manifest_cache_ttl'] if 'manifest_cache_ttl' in swa_config else 60
+manifest_cache_check_interval = swa_config['manifest_cache_check_interval'] \
+    if 'manifest_cache_check_interval' in swa_config else 1
+# generated manifests are cached per process and dropped when an annotation on their target is written,
+# or when the change log shows a write through another process
+manifest_cache = ManifestCache(max_size=manifest_cache_size, ttl=manifest_cache_ttl,
+                               shared_generation=SharedGeneration(annotation_store.get_last_change_sequence,
+                                                                  check_interval=manifest_cache_check_interval))
+annotation_store.add_write_listener(manifest_cache.invalidate)
+
 # generic response model
 response_model = api.model("Response", {
     "status": fields.String(description="Status", required=True, enum=["success", "error"]),
@@ -112,30 +133,126 @@ collection_list_model = api.model("AnnotationCollectionListResponse", {
     "collections": fields.List(fields.Nested(annotation_collection_model), description="List of annotation collections")
 })
 
+search_page_model = api.model("SearchAnnotationPage", {
+    "@context": fields.String(description="IIIF Content Search context", required=True),
+    "id": fields.String(description="URL of this page of search results"),
+    "type": fields.String(description="Page type", enum=["AnnotationPage"]),
+    "items": fields.List(fields.Nested(annotation_model), description="Matching annotations"),
+    "annotations": fields.Raw(description="Highlighting annotations that show where the annotations matched"),
+    "next": fields.String(description="URL of the next page of search results, if any"),
+})
+
+term_page_model = api.model("TermPage", {
+    "@context": fields.String(description="IIIF Content Search context", required=True),
+    "id": fields.String(description="URL of this autocomplete response"),
+    "type": fields.String(description="Page type", enum=["TermPage"]),
+    "items": fields.Raw(description="Completed terms with the number of annotations they occur in"),
+})
+
+
+def make_search_url(resource_id: str) -> str:
+    return f"{api_url}/{namespace}/search/{make_scope_id(resource_id)}"
+
+
+def make_autocomplete_url(resource_id: str) -> str:
+    return f"{api_url}/{namespace}/autocomplete/{make_scope_id(resource_id)}"
+
+
+def get_scoped_params(scope_id: str) -> dict:
+    """Get the request parameters, limited to annotations on the manifest or canvas of the scope
+    and the resources inside it."""
+    params = get_params(request)
+    if "q" not in params:
+        raise InvalidUsage("search should have a 'q' parameter with the text to search for")
+    target_filter = params["filter"] if "filter" in params else {}
+    params["filter"] = dict(target_filter, scope=[parse_scope_id(scope_id)])
+    return params
+
+
+def add_search_service(manifest_json: dict) -> dict:
+    # announce the search services, so viewers can search the annotations server-side
+    manifest_json['service'] = make_search_service(make_search_url(manifest_json['id']),
+                                                   make_autocomplete_url(manifest_json['id']))
+    return manifest_json
+
+
+def make_resource_manifest_json(resource_id: str, params: dict) -> dict:
+    data = annotation_store.get_annotations_by_targets_es([resource_id], params)
+    annotations = [Annotation.from_store(dict(annotation, id=make_external_id(annotation['id'])))
+                   for annotation in data['targets'][resource_id]]
+    return add_search_service(iiif_manifest.make_target_manifest(resource_id, annotations).to_json())
+
+
 """--------------- IIIF endpoints ------------------"""
 
 
-@api.route("/iiif_exchange/manifest/<resource_id>")
+import_response = api.model("ManifestImportResponse", {
+    "total": fields.Integer(description="Number of valid annotations in the manifest"),
+    "indexed": fields.Integer(description="Number of annotations that were stored"),
+    "errors": fields.Raw(description="Annotations that are invalid or could not be stored"),
+})
+
+
+@api.doc(params={'persist': 'true: store the annotations of the manifest instead of returning them'})
+@api.route("/iiif_exchange/manifest/<path:resource_id>")
 class IIIFExchangeManifestApi(Resource):
 
     @auth.login_required
-    @api.response(200, 'Success', annotation_list_response)
+    @api.response(200, 'Success')
+    @cache_public_response
+    def get(self, resource_id):
+        """Get a manifest with the annotations on a resource that the user can see."""
+        params = get_params(request)
+        # the annotations that can be seen only depend on the user and the requested access status
+        scope = (params["username"], tuple(params["access_status"] or []))
+        manifest_json = manifest_cache.get(resource_id, scope)
+        if manifest_json is None:
+            generation = manifest_cache.get_generation()
+            manifest_json = make_resource_manifest_json(resource_id, params)
+            manifest_cache.set(resource_id, scope, manifest_json, generation)
+        return manifest_json
+
+    @auth.login_required
+    @api.response(200, 'Success', import_response)
     @api.response(400, 'Invalid IIIF Exchange Manifest')
-    def post(self, _resource_id):
-        manifest = request.get_json()
-        annotations = iiif_manifest.web_anno_from_manifest(manifest)
-        return annotations, 200
+    def post(self, resource_id):
+        # the manifest is parsed from the request stream, without loading it as a whole
+        if request.args.get("persist") == "true":
+            params = get_params(request, anon_allowed=False)
+            store_batch = partial(annotation_store.add_annotations_bulk_es, params=params)
+            return iiif_import.import_manifest_annotations(request.stream, store_batch)
+        return Response(stream_with_context(iiif_import.stream_validated_annotations(request.stream)),
+                        mimetype="application/json")
 
 
-@api.route("/iiif_exchange/resource/<resource_id>")
+@api.doc(params={
+    'resource_id': 'id of the canvas or other resource',
+    'cursor': 'cursor of the next page, taken from the previous page',
+    'page_size': annotation_parameters['page_size']
+})
+@api.route("/iiif_exchange/resource/<path:resource_id>")
 class IIIFExchangeResourceApi(Resource):
 
     @auth.login_required
-    @api.response(200, 'Success', annotation_list_response)
-    @api.response(400, 'Invalid IIIF Exchange Manifest')
+    @api.response(200, 'Success', annotation_page_model)
+    @api.response(400, 'Invalid page request')
+    def get(self, resource_id):
+        params = get_params(request)
+        params["page_size"] = params["page_size"] if "page_size" in params else default_page_size
+        data = annotation_store.get_annotations_by_target_page_es(resource_id, params)
+        next_page_id = None
+        if data["cursor"] is not None:
+            next_page_id = update_url(request.url, {"cursor": encode_cursor(data["cursor"])})
+        page = iiif_manifest.make_target_annotation_page(request.url, resource_id, data["total"], next_page_id)
+        items = (dict(annotation, id=make_external_id(annotation["id"])) for annotation in data["annotations"])
+        return Response(stream_with_context(iiif_manifest.stream_annotation_page(page, items)),
+                        mimetype="application/json")
+
+    @auth.login_required
+    @api.response(200, 'Success', annotation_page_model)
+    @api.response(400, 'Invalid page request')
     def post(self, resource_id):
-        annotations = annotation_store.get_from_index_by_target(resource_id)
-        return annotations, 200
+        return self.get(resource_id)
 
 
 @api.route("/iiif_exchange/annotation/<annotation_id>")
@@ -145,26 +262,65 @@ class IIIFExchangeAnnotationApi(Resource):
     @api.response(200, 'Success', annotation_response)
     @api.response(404, 'Annotation does not exists')
     def get(self, annotation_id):
+        params = get_params(request)
         try:
-            annotation = annotation_store.get_from_index_by_id(annotation_id, "Annotation")
-            annotation['id'] = 'http://localhost:3000/api/annotations/' + annotation['id']
-            del annotation['target_list']
-            annotation.pop('permissions', None)
-            manifests = iiif_manifest.web_anno_to_manifest([annotation])
-            print('manifests received')
-            if isinstance(manifests, Manifest):
-                response_data = manifests.to_json()
-            else:
-                response_data = [manifest.to_json() for manifest in manifests]
-            print('manifests serialized')
-            return response_data
+            # the stored annotation has its target list, so it is grouped by target without validating it again
+            annotation = annotation_store.get_from_index_if_allowed(annotation_id, username=params["username"],
+                                                                    action="see", annotation_type="Annotation")
         except PermissionError:
             return abort(404)
+        annotation.data['id'] = make_external_id(annotation.id)
+        manifests = iiif_manifest.web_anno_to_manifest([annotation])
+        api.logger.debug('manifests generated for annotation %s', annotation_id)
+        if isinstance(manifests, Manifest):
+            return add_search_service(manifests.to_json())
+        return [add_search_service(manifest.to_json()) for manifest in manifests]
 
     @auth.login_required
     @api.response(200, 'Success', annotation_list_response)
     @api.response(400, 'Invalid IIIF Exchange Manifest')
-    def post(self, _resource_id):
+    def post(self, annotation_id):
         manifest = request.get_json()
         annotations = iiif_manifest.web_anno_from_manifest(manifest)
         return annotations, 200
+
+
+@api.doc(params={
+    'scope_id': 'encoded id of the manifest or canvas to search in',
+    'q': 'text to search for in annotation bodies',
+    'cursor': 'cursor of the next page, taken from the previous page',
+    'page_size': annotation_parameters['page_size']
+})
+@api.route("/search/<scope_id>", endpoint='iiif_search')
+class IIIFContentSearchApi(Resource):
+
+    @auth.login_required
+    @api.response(200, 'Success', search_page_model)
+    @api.response(400, 'Invalid search')
+    def get(self, scope_id):
+        params = get_scoped_params(scope_id)
+        params["page_size"] = params["page_size"] if "page_size" in params else default_page_size
+        data = annotation_store.search_annotations_es(params["q"], params)
+        for item in data["items"]:
+            item["annotation"]["id"] = make_external_id(item["annotation"]["id"])
+        next_url = None
+        if data["cursor"] is not None:
+            next_url = update_url(request.url, {"cursor": encode_cursor(data["cursor"])})
+        return make_search_page(request.url, data["items"], next_url)
+
+
+@api.doc(params={
+    'scope_id': 'encoded id of the manifest or canvas to search in',
+    'q': 'start of the term to complete'
+})
+@api.route("/autocomplete/<scope_id>", endpoint='iiif_autocomplete')
+class IIIFAutocompleteApi(Resource):
+
+    @auth.login_required
+    @api.response(200, 'Success', term_page_model)
+    @api.response(400, 'Invalid autocomplete request')
+    def get(self, scope_id):
+        params = get_scoped_params(scope_id)
+        body_texts = annotation_store.get_body_texts_by_prefix_es(params["q"], params, autocomplete_sample_size)
+        search_url = f"{api_url}/{namespace}/search/{scope_id}"
+        return make_term_page(request.url, count_matching_terms(body_texts, params["q"]), search_url)
@@ -0,0 +1,272 @@
+"""ASGI entry point: serves the read endpoints from an event loop with an async Elasticsearch
+client, and hands every other request to the existing Flask (WSGI) app.
+
+Run with an ASGI server, e.g.:
+
+    uvicorn asgi_server:app --host 0.0.0.0 --port 3000 --workers 4
+"""
+import base64
+import gzip
+from contextlib import asynccontextmanager
+from functools import partial
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import server
+from apis.annotation import annotation_store as wsgi_annotation_store, event_dispatcher, event_keepalive, \
+    format_event, make_external_id as make_external_annotation_id, public_response_cache
+from apis.collection import make_external_id as make_external_collection_id
+from models.annotation import AnnotationError
+from models.annotation_container import AnnotationContainer, default_page_size, update_url
+from models.async_store import AsyncAnnotationStore, AsyncUserStore, make_async_client
+import models.backend_calls as backend_calls
+from models.error import InvalidUsage, PermissionError, UserError
+from models.response_cache import make_etag, varying_headers
+from parse.headers_params import get_non_negative_int, get_request_params
+from settings import server_config
+
+api_prefix = server_config['SWAServer']['api_prefix']
+es = make_async_client(server_config["Elasticsearch"])
+# writes go through the WSGI app in this process, so its store invalidates the cached results of both
+annotation_store = AsyncAnnotationStore(server_config["Elasticsearch"], es=es,
+                                        query_cache=wsgi_annotation_store.query_cache)
+user_store = AsyncUserStore(server_config["Elasticsearch"], es=es)
+
+
+class RequestArgs(object):
+    """Expose a Starlette request with the 'headers' and 'args' attributes the parameter parser expects."""
+
+    def __init__(self, request):
+        self.headers = request.headers
+        self.args = request.query_params
+
+
+def unauthorized():
+    # return 403 instead of 401 to prevent browsers from displaying the default auth dialog
+    return JSONResponse({'message': 'Unauthorized access'}, status_code=403)
+
+
+async def authenticate(request):
+    """Mirror of verify_password in the Flask APIs. Returns a tuple (allowed, user)."""
+    authorization = request.headers.get("Authorization")
+    if not authorization:
+        # anonymous user
+        return True, None
+    scheme, _, credentials = authorization.partition(" ")
+    if scheme.lower() != "basic":
+        return False, None
+    try:
+        token_or_username, _, password = base64.b64decode(credentials).decode("utf-8").partition(":")
+    except (ValueError, UnicodeDecodeError):
+        return False, None
+    if not token_or_username and not password:
+        return True, None
+    try:
+        # First try to authenticate by token
+        user = await user_store.verify_auth_token(token_or_username)
+        if not user:
+            user = await user_store.verify_user(token_or_username, password)
+    except UserError:
+        return False, None
+    return (True, user) if user else (False, None)
+
+
+def read_endpoint(handler=None, cache_public=False):
+    """Serve a read endpoint, with its backend calls accounted and logged like those of the WSGI
+    app. With cache_public, responses to anonymous users come from the public response cache of
+    the WSGI app."""
+    if handler is None:
+        return partial(read_endpoint, cache_public=cache_public)
+
+    async def endpoint(request):
+        token = backend_calls.start_request(record_queries=bool(server.slow_request_threshold))
+        try:
+            response = await respond(request, handler, cache_public)
+            calls = backend_calls.get_current_calls()
+            response.headers["Server-Timing"] = calls.get_server_timing()
+            backend_calls.log_request(request.method, request.url.path, response.status_code, calls,
+                                      server.slow_request_threshold,
+                                      query_cache=annotation_store.get_query_cache_metrics())
+        finally:
+            backend_calls.end_request(token)
+        if "origin" in request.headers:
+            # same policy as flask_cors on the WSGI app, preflight requests are answered by the WSGI app
+            response.headers["Access-Control-Allow-Origin"] = "*"
+        return response
+    return endpoint
+
+
+async def respond(request, handler, cache_public):
+    allowed, user = await authenticate(request)
+    if not allowed:
+        return unauthorized()
+    try:
+        params = get_request_params(RequestArgs(request), user.username if user else None)
+        if not cache_public:
+            return JSONResponse(await handler(request, params))
+        if user is None and public_response_cache:
+            return await respond_from_public_cache(request, handler, params)
+        return JSONResponse(await handler(request, params),
+                            headers={"Cache-Control": "private", "Vary": ", ".join(varying_headers)})
+    except (AnnotationError, InvalidUsage) as error:
+        return JSONResponse(error.to_dict(), status_code=error.status_code)
+    except PermissionError:
+        return unauthorized()
+
+
+async def respond_from_public_cache(request, handler, params):
+    """Async version of cache_public_response of the WSGI app."""
+    # the shared generation is read here, so making the key doesn't block the loop reading it
+    if await annotation_store.follow_shared_generation(public_response_cache.shared_generation):
+        public_response_cache.invalidate()
+    args = {name: request.query_params.getlist(name) for name in request.query_params.keys()}
+    key = public_response_cache.make_current_key(get_base_url(request), args, request.headers.get("Prefer"))
+    body = public_response_cache.get(key)
+    if body is None:
+        body = public_response_cache.set(key, await handler(request, params))
+    headers = {}
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+    else:
+        body = gzip.decompress(body)
+    headers.update(public_response_cache.get_headers(etag=make_etag(body)))
+    if_none_match = request.headers.get("If-None-Match", "")
+    if headers["ETag"] in [etag.strip() for etag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def get_base_url(request):
+    return str(request.url.replace(query=""))
+
+
+"""--------------- Read endpoints ------------------"""
+
+
+@read_endpoint(cache_public=True)
+async def get_annotations(request, params):
+    page_size = params["page_size"] if "page_size" in params else default_page_size
+    if params["view"] == "PreferMinimalContainer":
+        # the minimal view only refers to pages, so counting is enough
+        total = await annotation_store.count_annotations_es(params)
+        pages = {}
+    else:
+        # the container can't await the store, so the single page it shows is fetched up front
+        data = await annotation_store.get_annotations_es(dict(params, page_size=page_size))
+        total = data["total"]
+        pages = {params["page"]: data["annotations"]}
+    base_url = get_base_url(request)
+    if "page_size" in params:
+        # keep the requested page size in the page references
+        base_url = update_url(base_url, {"page_size": page_size})
+    container = AnnotationContainer(base_url, lambda page_num, _page_size: pages[page_num],
+                                    page_size=page_size, view=params["view"], total=total)
+    if request.query_params.get("page") is not None:
+        return container.view_page(params["page"])
+    return container.view()
+
+
+@read_endpoint(cache_public=True)
+async def get_annotation(request, params):
+    annotation = await annotation_store.get_annotation_es(request.path_params["annotation_id"], params)
+    annotation['id'] = make_external_annotation_id(annotation['id'])
+    return annotation
+
+
+@read_endpoint
+async def get_annotation_stats(request, params):
+    return await annotation_store.get_stats_es(params)
+
+
+@read_endpoint
+async def get_collection(request, params):
+    collection = await annotation_store.get_collection_es(request.path_params["collection_id"], params)
+    collection['id'] = make_external_collection_id(collection['id'])
+    if params["view"] == "PreferContainedDescriptions":
+        collection["items"] = await annotation_store.get_annotations_by_id_es(collection["items"], params)
+    container = AnnotationContainer(get_base_url(request), collection, view=params["view"])
+    return container.view()
+
+
+"""--------------- Server-sent events ------------------"""
+
+
+async def stream_events(subscription, backlog, since=None):
+    """Async version of the event stream of the WSGI app. Waiting for changes doesn't hold a
+    thread, so a worker can serve many subscribers."""
+    last_seq = since or 0
+    try:
+        for change in backlog:
+            last_seq = change["seq"]
+            yield format_event(change)
+        # a subscriber that doesn't keep up is dropped, and reconnects from the last event it got
+        while not subscription.overflowed:
+            change = await subscription.get(timeout=event_keepalive)
+            if change is None:
+                yield ": keep-alive\n\n"
+            elif change["seq"] > last_seq:
+                last_seq = change["seq"]
+                yield format_event(change)
+    finally:
+        event_dispatcher.unsubscribe(subscription)
+
+
+async def get_annotation_events(request):
+    allowed, user = await authenticate(request)
+    if not allowed:
+        return unauthorized()
+    try:
+        params = get_request_params(RequestArgs(request), user.username if user else None)
+        if "filter" not in params or "target_id" not in params["filter"]:
+            raise InvalidUsage("events subscription should have a 'target_id' parameter")
+        since = None
+        if request.headers.get("Last-Event-ID"):
+            since = get_non_negative_int(request.headers.get("Last-Event-ID"), "Last-Event-ID")
+    except (AnnotationError, InvalidUsage) as error:
+        return JSONResponse(error.to_dict(), status_code=error.status_code)
+    except PermissionError:
+        return unauthorized()
+    # subscribe before getting missed changes, the changes dispatched before are in the backlog
+    subscription = event_dispatcher.subscribe_async(params["filter"]["target_id"], params["username"])
+    backlog = []
+    if since is not None:
+        # the client reconnects, send the changes it missed
+        try:
+            backlog = [change for change in await annotation_store.get_missed_changes_es(
+                since, subscription.start_seq, subscription.target_ids, params) if subscription.matches(change)]
+        except Exception:
+            event_dispatcher.unsubscribe(subscription)
+            raise
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if "origin" in request.headers:
+        headers["Access-Control-Allow-Origin"] = "*"
+    return StreamingResponse(stream_events(subscription, backlog, since), media_type="text/event-stream",
+                             headers=headers)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    yield
+    await es.close()
+
+
+wsgi_app = WSGIMiddleware(server.app)
+
+# other paths next to the annotation ids that the WSGI app serves, routed before the annotation id route
+wsgi_annotation_paths = ["/annotations/search"]
+
+# Routes only match GET, requests with other methods on the same paths fall through to the WSGI app.
+routes = [
+    Route(api_prefix + "/annotations/", get_annotations, methods=["GET"]),
+    Route(api_prefix + "/annotations/stats", get_annotation_stats, methods=["GET"]),
+    Route(api_prefix + "/annotations/events", get_annotation_events, methods=["GET"]),
+    *[Route(api_prefix + path, wsgi_app) for path in wsgi_annotation_paths],
+    Route(api_prefix + "/annotations/{annotation_id}", get_annotation, methods=["GET"]),
+    Route(api_prefix + "/collections/{collection_id}", get_collection, methods=["GET"]),
+    Mount("/", app=wsgi_app),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan)
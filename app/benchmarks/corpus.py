@@ -0,0 +1,145 @@
+"""Deterministic synthetic annotations for benchmarks, built from the shapes in annotation_examples.py.
+
+The same arguments always give the same annotations, ids included, so results of different runs
+are comparable.
+"""
+import copy
+import random
+import uuid
+from typing import Dict, List
+
+from annotation_examples import annotation_collections, annotations as examples
+from models.annotation import Annotation
+from models.permissions import add_permissions
+
+access_statuses = ["private", "shared", "public"]
+
+
+def make_annotation_id(index: int) -> str:
+    return uuid.UUID(int=index + 1).urn
+
+
+def make_collection_id(index: int) -> str:
+    # outside the range of the annotation ids
+    return uuid.UUID(int=(1 << 64) + index + 1).urn
+
+
+def make_username(index: int) -> str:
+    # a single word, users are looked up by a match on the analyzed username
+    return "benchuser%d" % index
+
+
+def make_target_id(index: int) -> str:
+    return "urn:swa:bench:resource:%d" % index
+
+
+def make_annotation(index: int, target_id: str) -> dict:
+    """An annotation with a single target, like the "vincent" example."""
+    annotation = copy.deepcopy(examples["vincent"])
+    annotation["id"] = make_annotation_id(index)
+    annotation["created"] = "2020-01-01T00:00:00+00:00"
+    annotation["target"][0]["id"] = target_id
+    annotation["body"][0]["value"] = "Annotation %d on %s" % (index, target_id)
+    return annotation
+
+
+def make_subresource_annotation(index: int, target_id: str, depth: int) -> dict:
+    """An annotation on a resource nested depth levels deep in its source, like the
+    "vincent-subresource" example."""
+    annotation = copy.deepcopy(examples["vincent-subresource"])
+    annotation["id"] = make_annotation_id(index)
+    annotation["created"] = "2020-01-01T00:00:00+00:00"
+    annotation["target"][0]["source"] = target_id
+    subresource = None
+    for level in reversed(range(depth)):
+        nested = {"id": "%s.part%d" % (target_id, level), "type": ["Text"], "property": "hasPart"}
+        if subresource:
+            nested["subresource"] = subresource
+        subresource = nested
+    annotation["target"][0]["selector"]["value"]["subresource"] = subresource
+    return annotation
+
+
+def make_reply(index: int, annotation_id: str) -> dict:
+    """An annotation on another annotation, the next link of a reply chain."""
+    annotation = make_annotation(index, annotation_id)
+    annotation["target"] = [{"id": annotation_id, "type": "Annotation"}]
+    annotation["motivation"] = "replying"
+    return annotation
+
+
+def make_permission_params(username: str, access_status: str, can_see: List[str] = None) -> dict:
+    params = {"username": username, "access_status": [access_status]}
+    if access_status == "shared":
+        params["can_see"] = can_see if can_see else []
+        params["can_edit"] = []
+    return params
+
+
+def make_stored_annotation(index: int, target_id: str, username: str, access_status: str) -> Annotation:
+    """An annotation with the permissions and target list it gets from the store."""
+    annotation = Annotation(make_annotation(index, target_id))
+    add_permissions(annotation, make_permission_params(username, access_status, can_see=["user0"]))
+    annotation.target_list = annotation.get_targets_info()
+    return annotation
+
+
+def make_annotations(size: int, num_targets: int = None) -> List[dict]:
+    num_targets = num_targets if num_targets else max(1, size // 10)
+    return [make_annotation(index, make_target_id(index % num_targets)) for index in range(size)]
+
+
+def make_collection(index: int, creator: str) -> dict:
+    collection = copy.deepcopy(annotation_collections["empty_collection"])
+    collection["id"] = make_collection_id(index)
+    collection["created"] = "2020-01-01T00:00:00+00:00"
+    collection["label"] = "Collection %d" % index
+    collection["creator"] = creator
+    return collection
+
+
+def make_corpus(num_users: int, num_targets: int, num_annotations: int, num_chains: int, chain_depth: int,
+                num_collections: int, collection_size: int, access_mix: Dict[str, int], seed: int = 0) -> dict:
+    """A corpus of annotations of several users, on num_targets targets. Of the annotations,
+    num_chains are the start of a reply chain of chain_depth replies by the same user. Access
+    statuses are drawn with the weights of access_mix, shared annotations can be seen by one other
+    user. Collections hold collection_size annotations their owner can see."""
+    rng = random.Random(seed)
+    usernames = [make_username(index) for index in range(num_users)]
+    statuses = list(access_mix)
+    weights = [access_mix[status] for status in statuses]
+    items = []
+    chains = []
+
+    def add_item(annotation: dict, owner: str, access_status: str) -> None:
+        can_see = [rng.choice(usernames)] if access_status == "shared" else []
+        items.append({"annotation": annotation, "owner": owner, "access_status": access_status, "can_see": can_see})
+
+    for index in range(num_annotations):
+        owner = rng.choice(usernames)
+        access_status = rng.choices(statuses, weights=weights)[0]
+        add_item(make_annotation(len(items), make_target_id(rng.randrange(num_targets))), owner, access_status)
+        if index >= num_chains:
+            continue
+        chain = [items[-1]["annotation"]["id"]]
+        for _ in range(chain_depth):
+            add_item(make_reply(len(items), chain[-1]), owner, access_status)
+            chain.append(items[-1]["annotation"]["id"])
+        chains.append(chain)
+    collections = []
+    for index in range(num_collections):
+        owner = rng.choice(usernames)
+        visible = [item["annotation"]["id"] for item in items
+                   if item["owner"] == owner or item["access_status"] == "public"]
+        collections.append({
+            "collection": make_collection(index, owner),
+            "owner": owner,
+            "items": rng.sample(visible, min(collection_size, len(visible)))
+        })
+    return {
+        "usernames": usernames,
+        "target_ids": [make_target_id(index) for index in range(num_targets)],
+        "annotations": items,
+        "chains": chains,
+        "collections": collections
+    }
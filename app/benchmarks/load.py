@@ -0,0 +1,333 @@
+"""Load test of the server in-process, on a synthetic corpus seeded for the test.
+
+Run from the app directory, against an in-memory stand-in of Elasticsearch:
+
+    python -m benchmarks.load
+    python -m benchmarks.load --annotations 5000 --chain-depth 5 --requests 5000 --threads 8
+
+or against the Elasticsearch of settings.py, in indices of their own that are deleted afterwards:
+
+    python -m benchmarks.load --backend elasticsearch
+
+Requests go through the Flask test client from several threads, so the timings include the server
+code and the backend, not the network or the WSGI server. benchmarks.throughput measures those.
+The in-memory stand-in scans every document for each search, so with large corpora its searches
+dominate the timings, use Elasticsearch for capacity planning of those.
+"""
+import argparse
+import base64
+import copy
+import json
+import random
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.corpus import access_statuses, make_annotation, make_corpus
+from benchmarks.throughput import percentile
+from settings import server_config
+
+user_password = "bench-password"
+# tokens outlive the longest runs, so requests never fail on expired tokens
+token_expiration = 24 * 3600
+
+# relative weights of the operations in the replayed mix
+default_mix = {
+    "get_annotation": 30,
+    "get_public_annotation": 15,
+    "list_by_target": 20,
+    "target_manifest": 10,
+    "create_annotation": 10,
+    "update_chain": 5,
+    "append_to_collection": 10,
+}
+
+
+def parse_weights(value: str) -> Dict[str, int]:
+    """Parse weights like 'private=1,shared=1,public=2'."""
+    weights = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if not weight.isdigit():
+            raise argparse.ArgumentTypeError("weights should be name=integer pairs separated by commas")
+        weights[name.strip()] = int(weight)
+    return weights
+
+
+def parse_access_mix(value: str) -> Dict[str, int]:
+    access_mix = parse_weights(value)
+    if any(status not in access_statuses for status in access_mix) or not sum(access_mix.values()):
+        raise argparse.ArgumentTypeError("access statuses should be private, shared or public, with a positive weight")
+    return access_mix
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    mix = parse_weights(value)
+    if any(operation not in operations for operation in mix) or not sum(mix.values()):
+        raise argparse.ArgumentTypeError("operations should be in %s, with a positive weight" % ", ".join(operations))
+    return mix
+
+
+def make_load_config(es_config: dict, index_prefix: str) -> dict:
+    """The Elasticsearch settings of the server, with indices of the load test."""
+    return dict(es_config, annotation_index=index_prefix, user_index=index_prefix + "_user",
+                changes_index=index_prefix + "_changes", routing_index=index_prefix + "_routing")
+
+
+def use_memory_backend() -> None:
+    # the stores create their clients from the Elasticsearch class of their module
+    from benchmarks.memory_es import InMemoryElasticsearch
+    import models.annotation_store
+    import models.user_store
+    models.annotation_store.Elasticsearch = InMemoryElasticsearch
+    models.user_store.Elasticsearch = InMemoryElasticsearch
+
+
+def make_seed_params(item: dict) -> dict:
+    params = {"username": item["owner"], "access_status": [item["access_status"]]}
+    if item["access_status"] == "shared":
+        params["can_see"] = item["can_see"]
+        params["can_edit"] = []
+    return params
+
+
+def seed_corpus(corpus: dict) -> Dict[str, dict]:
+    """Store the users, annotations and collections of the corpus, and return the auth headers of the users."""
+    from apis.annotation import annotation_store, user_store
+    headers = {}
+    for username in corpus["usernames"]:
+        if user_store.username_available(username):
+            user_store.register_user(username, user_password)
+        user = user_store.get_user(username)
+        token = user_store.generate_auth_token(user.user_id, expiration=token_expiration)
+        credentials = token + b":" + user_password.encode("ascii")
+        headers[username] = {"Authorization": "Basic " + base64.b64encode(credentials).decode("ascii")}
+    for item in corpus["annotations"]:
+        # a copy, the store adds its own fields to the annotation
+        annotation_store.add_annotation_es(copy.deepcopy(item["annotation"]), make_seed_params(item))
+    for collection in corpus["collections"]:
+        params = {"username": collection["owner"], "access_status": ["private"]}
+        annotation_store.create_collection_es(copy.deepcopy(collection["collection"]), params)
+        for annotation_id in collection["items"]:
+            annotation_store.add_annotation_to_collection_es(annotation_id, collection["collection"]["id"], params)
+    return headers
+
+
+class LoadState(object):
+    """The corpus and the annotations added during the run, shared by the worker threads."""
+
+    def __init__(self, corpus: dict, headers: Dict[str, dict], api_prefix: str, access_mix: Dict[str, int]):
+        self.corpus = corpus
+        self.headers = headers
+        self.api_prefix = api_prefix
+        self.access_mix = access_mix
+        self.annotations = list(corpus["annotations"])
+        self.public_ids = [item["annotation"]["id"] for item in self.annotations if item["access_status"] == "public"]
+        root_ids = {chain[0] for chain in corpus["chains"]}
+        self.chain_roots = [item for item in self.annotations if item["annotation"]["id"] in root_ids]
+        self.next_index = len(self.annotations) + 1000000
+        self.lock = threading.Lock()
+
+    def take_index(self) -> int:
+        with self.lock:
+            self.next_index += 1
+            return self.next_index
+
+    def add_annotation(self, item: dict) -> None:
+        with self.lock:
+            self.annotations.append(item)
+
+
+def get_annotation(client, state: LoadState, rng: random.Random):
+    item = rng.choice(state.annotations)
+    return client.get("%s/annotations/%s" % (state.api_prefix, item["annotation"]["id"]),
+                      headers=state.headers[item["owner"]])
+
+
+def get_public_annotation(client, state: LoadState, rng: random.Random):
+    if not state.public_ids:
+        return get_annotation(client, state, rng)
+    return client.get("%s/annotations/%s" % (state.api_prefix, rng.choice(state.public_ids)))
+
+
+def list_by_target(client, state: LoadState, rng: random.Random):
+    query_string = {"target_id": rng.choice(state.corpus["target_ids"]), "access_status": ",".join(access_statuses)}
+    return client.get("%s/annotations/" % state.api_prefix, query_string=query_string,
+                      headers=state.headers[rng.choice(state.corpus["usernames"])])
+
+
+def target_manifest(client, state: LoadState, rng: random.Random):
+    return client.get("%s/iiif/iiif_exchange/manifest/%s" % (state.api_prefix, rng.choice(state.corpus["target_ids"])),
+                      query_string={"access_status": ",".join(access_statuses)},
+                      headers=state.headers[rng.choice(state.corpus["usernames"])])
+
+
+def create_annotation(client, state: LoadState, rng: random.Random):
+    username = rng.choice(state.corpus["usernames"])
+    access_status = rng.choices(list(state.access_mix), weights=list(state.access_mix.values()))[0]
+    annotation = make_annotation(state.take_index(), rng.choice(state.corpus["target_ids"]))
+    response = client.post("%s/annotations/" % state.api_prefix, data=json.dumps(annotation),
+                           query_string={"access_status": access_status}, content_type="application/json",
+                           headers=state.headers[username])
+    if response.status_code == 201:
+        state.add_annotation({"annotation": annotation, "owner": username, "access_status": access_status,
+                              "can_see": []})
+    return response
+
+
+def update_chain(client, state: LoadState, rng: random.Random):
+    """Move the root of a reply chain to another target, which updates the target lists of all replies."""
+    if not state.chain_roots:
+        return create_annotation(client, state, rng)
+    item = rng.choice(state.chain_roots)
+    annotation = copy.deepcopy(item["annotation"])
+    annotation["target"][0]["id"] = rng.choice(state.corpus["target_ids"])
+    return client.put("%s/annotations/%s" % (state.api_prefix, annotation["id"]), data=json.dumps(annotation),
+                      content_type="application/json", headers=state.headers[item["owner"]])
+
+
+def append_to_collection(client, state: LoadState, rng: random.Random):
+    if not state.corpus["collections"]:
+        return create_annotation(client, state, rng)
+    collection = rng.choice(state.corpus["collections"])
+    annotation = make_annotation(state.take_index(), rng.choice(state.corpus["target_ids"]))
+    del annotation["id"]
+    return client.post("%s/collections/%s/annotations/" % (state.api_prefix, collection["collection"]["id"]),
+                       data=json.dumps(annotation), content_type="application/json",
+                       headers=state.headers[collection["owner"]])
+
+
+operations = {
+    "get_annotation": get_annotation,
+    "get_public_annotation": get_public_annotation,
+    "list_by_target": list_by_target,
+    "target_manifest": target_manifest,
+    "create_annotation": create_annotation,
+    "update_chain": update_chain,
+    "append_to_collection": append_to_collection,
+}
+
+
+def run_worker(app, state: LoadState, mix: Dict[str, int], num_requests: Callable[[], bool], seed: int,
+               results: List[Tuple[str, float, int]]) -> None:
+    client = app.test_client()
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    timings = []
+    while num_requests():
+        name = rng.choices(names, weights=weights)[0]
+        start = time.perf_counter()
+        response = operations[name](client, state, rng)
+        timings.append((name, time.perf_counter() - start, response.status_code))
+    results.extend(timings)
+
+
+def run_load(app, state: LoadState, mix: Dict[str, int], num_requests: int, num_threads: int,
+             seed: int) -> Tuple[List[Tuple[str, float, int]], float]:
+    remaining = [num_requests]
+    lock = threading.Lock()
+
+    def take_request() -> bool:
+        with lock:
+            remaining[0] -= 1
+            return remaining[0] >= 0
+
+    results = []
+    threads = [threading.Thread(target=run_worker, args=(app, state, mix, take_request, seed + index, results))
+               for index in range(num_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def summarize(results: List[Tuple[str, float, int]], elapsed: float) -> Dict[str, dict]:
+    """Throughput and latency percentiles per operation, and of all operations together."""
+    latencies = {}
+    errors = {}
+    for name, latency, status_code in results:
+        latencies.setdefault(name, []).append(latency)
+        errors[name] = errors.get(name, 0) + (1 if status_code >= 400 else 0)
+    latencies["total"] = [latency for _, latency, _ in results]
+    errors["total"] = sum(errors.values())
+    return {name: {
+        "requests": len(values),
+        "errors": errors[name],
+        "requests_per_second": len(values) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+    } for name, values in latencies.items()}
+
+
+def print_summary(summary: Dict[str, dict]) -> None:
+    print(f"{'operation':<24} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name in sorted(summary, key=lambda name: (name == "total", name)):
+        result = summary[name]
+        print(f"{name:<24} {result['requests']:>9} {result['errors']:>7} {result['requests_per_second']:>9.1f} "
+              f"{result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test of the server on a synthetic corpus")
+    parser.add_argument("--backend", choices=["memory", "elasticsearch"], default="memory",
+                        help="in-memory stand-in, or the Elasticsearch of settings.py (default: memory)")
+    parser.add_argument("--index-prefix", default="swa_load", help="name prefix of the indices of the load test")
+    parser.add_argument("--keep-indices", action="store_true", help="don't delete the indices after the run")
+    parser.add_argument("--users", type=int, default=10, help="number of users")
+    parser.add_argument("--targets", type=int, default=100, help="number of annotated resources")
+    parser.add_argument("--annotations", type=int, default=1000, help="number of annotations on resources")
+    parser.add_argument("--chains", type=int, default=20, help="number of annotations that start a reply chain")
+    parser.add_argument("--chain-depth", type=int, default=3, help="number of replies in a reply chain")
+    parser.add_argument("--collections", type=int, default=10, help="number of collections")
+    parser.add_argument("--collection-size", type=int, default=20, help="number of annotations per collection")
+    parser.add_argument("--access-mix", type=parse_access_mix, default="private=1,shared=1,public=2",
+                        help="weights of the access statuses of annotations (default: private=1,shared=1,public=2)")
+    parser.add_argument("--mix", type=parse_mix, default=None,
+                        help="weights of the operations, e.g. get_annotation=3,create_annotation=1 (default: %s)"
+                             % ",".join("%s=%d" % item for item in default_mix.items()))
+    parser.add_argument("--requests", type=int, default=2000, help="number of requests")
+    parser.add_argument("--threads", type=int, default=4, help="number of concurrent clients")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the corpus and the request mix")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    if args.backend == "memory":
+        use_memory_backend()
+    # the stores of the server are created on import, so the backend is chosen before
+    import server
+    load_config = make_load_config(server_config["Elasticsearch"], args.index_prefix)
+    server.configure_stores(load_config)
+    from apis.annotation import annotation_store
+    if annotation_store.es.count(index=load_config["annotation_index"])["count"] > 0:
+        print("index %s is not empty, remove it or choose another --index-prefix" % load_config["annotation_index"],
+              file=sys.stderr)
+        return 1
+    corpus = make_corpus(args.users, args.targets, args.annotations, args.chains, args.chain_depth,
+                         args.collections, args.collection_size, args.access_mix, seed=args.seed)
+    try:
+        start = time.perf_counter()
+        headers = seed_corpus(corpus)
+        print("seeded %d annotations and %d collections in %.1fs" % (len(corpus["annotations"]),
+                                                                     len(corpus["collections"]),
+                                                                     time.perf_counter() - start), file=sys.stderr)
+        state = LoadState(corpus, headers, server_config["SWAServer"]["api_prefix"], args.access_mix)
+        results, elapsed = run_load(server.app, state, args.mix or default_mix, args.requests, args.threads,
+                                    args.seed)
+    finally:
+        if args.backend == "elasticsearch" and not args.keep_indices:
+            for index_key in ["annotation_index", "user_index", "changes_index", "routing_index"]:
+                annotation_store.es.indices.delete(index=load_config[index_key], ignore=404)
+    summary = summarize(results, elapsed)
+    if args.json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    else:
+        print_summary(summary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
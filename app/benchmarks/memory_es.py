@@ -0,0 +1,543 @@
+"""In-memory stand-in for the Elasticsearch client, for running the server without a cluster.
+
+It covers the client calls and the query subset of the stores: bool, match, term(s), ids, range,
+exists and multi_match queries, sorting with search_after, terms aggregations, bulk and scroll.
+Text matching is a plain match on lowercased words, not the analysis of the index, and routing is
+accepted but not needed, as there is a single shard. Use it for load tests of the server code,
+not to measure the search performance of Elasticsearch.
+
+All clients share the indices of the default cluster, like clients of the same real cluster.
+"""
+import copy
+import fnmatch
+import json
+import re
+import threading
+from types import SimpleNamespace
+from typing import Dict, List, Union
+
+from elasticsearch import NotFoundError, RequestError
+from elasticsearch.serializer import JSONSerializer
+
+es_version = "7.10.0"
+
+
+class InMemoryCluster(object):
+
+    def __init__(self):
+        # index name -> document id -> {"_type", "_source", "_routing"}
+        self.indices = {}
+        # alias name -> set of index names
+        self.aliases = {}
+        self.templates = {}
+        self.lock = threading.RLock()
+
+    def resolve(self, index: str) -> List[str]:
+        """Get the names of the indices that an index, alias, wildcard or comma-separated list refers to."""
+        names = []
+        for name in index.split(","):
+            if name in self.indices:
+                names.append(name)
+            elif name in self.aliases:
+                names += sorted(self.aliases[name])
+            elif "*" in name:
+                names += sorted(fnmatch.filter(self.indices, name))
+            else:
+                raise NotFoundError(404, "index_not_found_exception", {"index": name})
+        return names
+
+
+default_cluster = InMemoryCluster()
+
+
+def tokenize(value) -> List[str]:
+    return re.findall(r"\w+", str(value).lower())
+
+
+def get_field_values(source: dict, field: str) -> list:
+    """Get the values of a dotted field path, flattening lists like Elasticsearch does. The keyword
+    subfield of dynamically mapped text fields holds the same values."""
+    if field.endswith(".keyword"):
+        field = field[:-len(".keyword")]
+    values = [source]
+    for part in field.split("."):
+        next_values = []
+        for value in values:
+            if isinstance(value, dict) and part in value:
+                next_values.append(value[part])
+            elif isinstance(value, dict) and part == "*":
+                next_values += list(value.values())
+        values = []
+        for value in next_values:
+            values += value if isinstance(value, list) else [value]
+    return [value for value in values if value is not None]
+
+
+def get_doc_values(doc: dict, field: str) -> list:
+    if field == "_id":
+        return [doc["_id"]]
+    if field == "_type":
+        return [doc["_type"]]
+    return get_field_values(doc["_source"], field)
+
+
+def is_keyword_field(field: str) -> bool:
+    return field.endswith(".keyword") or field.startswith("_")
+
+
+def get_query_value(clause: Union[str, int, dict], key: str):
+    return clause[key] if isinstance(clause, dict) else clause
+
+
+def match_text(query_text: str, values: list, phrase_prefix: bool = False) -> bool:
+    query_tokens = tokenize(query_text)
+    value_tokens = {token for value in values for token in tokenize(value)}
+    if not phrase_prefix:
+        return any(token in value_tokens for token in query_tokens)
+    if not query_tokens:
+        return False
+    *words, prefix = query_tokens
+    return all(word in value_tokens for word in words) and any(token.startswith(prefix) for token in value_tokens)
+
+
+def match_range(bounds: dict, values: list) -> bool:
+    checks = {
+        "gt": lambda value, bound: value > bound,
+        "gte": lambda value, bound: value >= bound,
+        "lt": lambda value, bound: value < bound,
+        "lte": lambda value, bound: value <= bound
+    }
+    for value in values:
+        try:
+            if all(checks[op](value, bound) for op, bound in bounds.items() if op in checks):
+                return True
+        except TypeError:
+            continue
+    return False
+
+
+def get_clauses(bool_query: dict, occur: str) -> List[dict]:
+    clauses = bool_query[occur] if occur in bool_query else []
+    return [clauses] if isinstance(clauses, dict) else clauses
+
+
+def matches(query: dict, doc: dict) -> bool:
+    query_type, clause = next(iter(query.items()))
+    if query_type == "match_all":
+        return True
+    if query_type == "bool":
+        must = get_clauses(clause, "must") + get_clauses(clause, "filter")
+        if not all(matches(sub_query, doc) for sub_query in must):
+            return False
+        if any(matches(sub_query, doc) for sub_query in get_clauses(clause, "must_not")):
+            return False
+        should = get_clauses(clause, "should")
+        # without must or filter clauses, at least one should clause has to match
+        if should and not must:
+            return any(matches(sub_query, doc) for sub_query in should)
+        return True
+    if query_type in ["match", "term"]:
+        field, value = next(iter(clause.items()))
+        value = get_query_value(value, "query" if query_type == "match" else "value")
+        values = get_doc_values(doc, field)
+        if query_type == "term" or is_keyword_field(field):
+            return value in values
+        return match_text(value, values)
+    if query_type == "terms":
+        field, terms = next(iter(clause.items()))
+        values = get_doc_values(doc, field)
+        return any(term in values for term in terms)
+    if query_type == "ids":
+        return doc["_id"] in clause["values"]
+    if query_type == "range":
+        field, bounds = next(iter(clause.items()))
+        return match_range(bounds, get_doc_values(doc, field))
+    if query_type == "exists":
+        return len(get_doc_values(doc, clause["field"])) > 0
+    if query_type == "nested":
+        # each object under the path is matched on its own, like a nested document
+        return any(matches(clause["query"], dict(doc, _source={clause["path"]: value}))
+                   for value in get_field_values(doc["_source"], clause["path"]))
+    if query_type == "multi_match":
+        values = [value for field in clause["fields"] for value in get_doc_values(doc, field)]
+        return match_text(clause["query"], values, phrase_prefix=clause.get("type") == "phrase_prefix")
+    raise NotImplementedError("%s queries are not supported by the in-memory stand-in" % query_type)
+
+
+def parse_sort(sort: list) -> List[tuple]:
+    fields = []
+    for sort_field in sort:
+        if isinstance(sort_field, str):
+            fields.append((sort_field, "desc" if sort_field == "_score" else "asc"))
+            continue
+        field, order = next(iter(sort_field.items()))
+        fields.append((field, order["order"] if isinstance(order, dict) else order))
+    return fields
+
+
+def get_sort_value(doc: dict, field: str):
+    if field == "_score":
+        # all matches score the same, text relevance isn't modelled
+        return 1.0
+    values = get_doc_values(doc, field)
+    return min(values) if values else None
+
+
+def is_after(sort_values: list, cursor: list, sort_fields: List[tuple]) -> bool:
+    for value, cursor_value, (_, order) in zip(sort_values, cursor, sort_fields):
+        if value == cursor_value or value is None or cursor_value is None:
+            continue
+        return value > cursor_value if order == "asc" else value < cursor_value
+    return False
+
+
+def sort_docs(docs: List[dict], sort_fields: List[tuple]) -> List[dict]:
+    # stable sorts from the last sort field to the first, missing values sort last
+    for field, order in reversed(sort_fields):
+        if order == "asc":
+            docs = sorted(docs, key=lambda doc: (get_sort_value(doc, field) is None, get_sort_value(doc, field)))
+        else:
+            docs = sorted(docs, key=lambda doc: (get_sort_value(doc, field) is not None, get_sort_value(doc, field)),
+                          reverse=True)
+    return docs
+
+
+def aggregate_terms(docs: List[dict], field: str, size: int = 10) -> dict:
+    counts = {}
+    for doc in docs:
+        for value in set(get_doc_values(doc, field)):
+            counts[value] = counts.get(value, 0) + 1
+    buckets = sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))[:size]
+    return {"buckets": [{"key": key, "doc_count": count} for key, count in buckets]}
+
+
+def filter_source(source: dict, includes: Union[None, str, List[str]]) -> dict:
+    if not includes:
+        return source
+    includes = includes.split(",") if isinstance(includes, str) else includes
+    return {field: value for field, value in source.items() if field in includes}
+
+
+def make_hit(index: str, doc: dict, source_includes=None) -> dict:
+    hit = {
+        "_index": index,
+        "_type": doc["_type"],
+        "_id": doc["_id"],
+        "_score": 1.0,
+        "_source": filter_source(copy.deepcopy(doc["_source"]), source_includes)
+    }
+    if doc["_routing"]:
+        hit["_routing"] = doc["_routing"]
+    return hit
+
+
+def make_body(body: Union[None, dict], kwargs: dict) -> dict:
+    # the helpers of the client pass the parts of the request body as keyword arguments
+    body = dict(body) if body else {}
+    for key in ["query", "sort", "aggs", "aggregations", "search_after", "_source"]:
+        if key in kwargs:
+            body[key] = kwargs[key]
+    if "from_" in kwargs:
+        body["from"] = kwargs["from_"]
+    return body
+
+
+def copy_source(source: Union[str, dict]) -> dict:
+    # documents are stored serialized and parsed again, so callers never share them with the index
+    return json.loads(source) if isinstance(source, str) else json.loads(json.dumps(source))
+
+
+class InMemoryIndices(object):
+
+    def __init__(self, cluster: InMemoryCluster):
+        self.cluster = cluster
+
+    def exists(self, index: str, **kwargs) -> bool:
+        with self.cluster.lock:
+            return all(name in self.cluster.indices or name in self.cluster.aliases for name in index.split(","))
+
+    def create(self, index: str, body: dict = None, **kwargs) -> dict:
+        with self.cluster.lock:
+            if index in self.cluster.indices or index in self.cluster.aliases:
+                raise RequestError(400, "resource_already_exists_exception", {"index": index})
+            self.cluster.indices[index] = {}
+            aliases = body["aliases"] if body and "aliases" in body else {}
+            for alias in aliases:
+                self.cluster.aliases.setdefault(alias, set()).add(index)
+            return {"acknowledged": True, "index": index}
+
+    def delete(self, index: str, ignore=None, **kwargs) -> dict:
+        with self.cluster.lock:
+            try:
+                names = self.cluster.resolve(index)
+            except NotFoundError:
+                if ignore == 404 or (isinstance(ignore, (list, tuple)) and 404 in ignore):
+                    return {"acknowledged": False}
+                raise
+            for name in names:
+                del self.cluster.indices[name]
+                for indices in self.cluster.aliases.values():
+                    indices.discard(name)
+            self.cluster.aliases = {alias: indices for alias, indices in self.cluster.aliases.items() if indices}
+            return {"acknowledged": True}
+
+    def get(self, index: str, **kwargs) -> dict:
+        with self.cluster.lock:
+            return {name: {"aliases": {alias: {} for alias, indices in self.cluster.aliases.items() if name in indices},
+                           "mappings": {}, "settings": {}} for name in self.cluster.resolve(index)}
+
+    def refresh(self, index: str = None, **kwargs) -> dict:
+        # documents are searchable as soon as they are written
+        return {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    def put_template(self, name: str, body: dict, **kwargs) -> dict:
+        with self.cluster.lock:
+            self.cluster.templates[name] = body
+            return {"acknowledged": True}
+
+    def exists_alias(self, name: str, index: str = None, **kwargs) -> bool:
+        with self.cluster.lock:
+            return name in self.cluster.aliases and (index is None or index in self.cluster.aliases[name])
+
+    def get_alias(self, name: str = None, index: str = None, **kwargs) -> dict:
+        with self.cluster.lock:
+            if name and name not in self.cluster.aliases:
+                raise NotFoundError(404, "aliases_not_found_exception", {"alias": name})
+            names = self.cluster.resolve(index) if index else sorted(self.cluster.indices)
+            return {index_name: {"aliases": {alias: {} for alias, indices in self.cluster.aliases.items()
+                                             if index_name in indices and (not name or alias == name)}}
+                    for index_name in names if not name or index_name in self.cluster.aliases[name]}
+
+    def put_alias(self, index: str, name: str, **kwargs) -> dict:
+        with self.cluster.lock:
+            for index_name in self.cluster.resolve(index):
+                self.cluster.aliases.setdefault(name, set()).add(index_name)
+            return {"acknowledged": True}
+
+    def update_aliases(self, body: dict, **kwargs) -> dict:
+        # the actions are applied under one lock, so they are atomic like in Elasticsearch
+        with self.cluster.lock:
+            for action in body["actions"]:
+                action_type, details = next(iter(action.items()))
+                if action_type == "add":
+                    self.cluster.aliases.setdefault(details["alias"], set()).add(details["index"])
+                elif action_type == "remove":
+                    self.cluster.aliases.get(details["alias"], set()).discard(details["index"])
+                elif action_type == "remove_index":
+                    self.cluster.indices.pop(details["index"], None)
+            self.cluster.aliases = {alias: indices for alias, indices in self.cluster.aliases.items() if indices}
+            return {"acknowledged": True}
+
+
+class InMemoryElasticsearch(object):
+    """Drop-in for the Elasticsearch client of the stores. Takes the same constructor arguments,
+    which are ignored, as all clients use the default cluster."""
+
+    def __init__(self, hosts=None, cluster: InMemoryCluster = None, **kwargs):
+        self.cluster = cluster if cluster else default_cluster
+        self.indices = InMemoryIndices(self.cluster)
+        # the bulk helper serializes the actions with the serializer of the transport
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+
+    def info(self, **kwargs) -> dict:
+        return {"version": {"number": es_version}, "tagline": "You Know, for Search"}
+
+    def get_write_index(self, index: str) -> str:
+        if index in self.cluster.aliases:
+            return sorted(self.cluster.aliases[index])[0]
+        if index not in self.cluster.indices:
+            # indices are created on the first write, like with the default auto_create_index setting
+            self.cluster.indices[index] = {}
+        return index
+
+    def find_document(self, index: str, id: str, doc_type: str = None) -> Union[None, tuple]:
+        for name in self.cluster.resolve(index):
+            doc = self.cluster.indices[name].get(str(id))
+            if doc and doc_type in [None, "_all", "_doc", doc["_type"]]:
+                return name, doc
+        return None
+
+    def index(self, index: str, body: Union[str, dict], id: str = None, doc_type: str = "_doc", routing: str = None,
+              **kwargs) -> dict:
+        with self.cluster.lock:
+            name = self.get_write_index(index)
+            documents = self.cluster.indices[name]
+            result = "updated" if str(id) in documents else "created"
+            documents[str(id)] = {"_id": str(id), "_type": doc_type, "_source": copy_source(body), "_routing": routing}
+            return {"_index": name, "_type": doc_type, "_id": str(id), "result": result}
+
+    def create(self, index: str, id: str, body: Union[str, dict], doc_type: str = "_doc", **kwargs) -> dict:
+        with self.cluster.lock:
+            if self.exists(index, id, doc_type=doc_type):
+                raise RequestError(409, "version_conflict_engine_exception", {"_id": id})
+            return self.index(index, body, id=id, doc_type=doc_type, **kwargs)
+
+    def get(self, index: str, id: str, doc_type: str = None, _source_includes=None, ignore=None, **kwargs) -> dict:
+        with self.cluster.lock:
+            found = self.find_document(index, id, doc_type)
+            if not found:
+                if ignore == 404 or (isinstance(ignore, (list, tuple)) and 404 in ignore):
+                    return {"_index": index, "_type": doc_type, "_id": str(id), "found": False}
+                raise NotFoundError(404, "not_found", {"_id": id, "found": False})
+            name, doc = found
+            return dict(make_hit(name, doc, _source_includes), found=True)
+
+    def exists(self, index: str, id: str, doc_type: str = None, **kwargs) -> bool:
+        with self.cluster.lock:
+            return self.find_document(index, id, doc_type) is not None
+
+    def delete(self, index: str, id: str, doc_type: str = None, ignore=None, **kwargs) -> dict:
+        with self.cluster.lock:
+            found = self.find_document(index, id, doc_type)
+            if not found:
+                if ignore == 404 or (isinstance(ignore, (list, tuple)) and 404 in ignore):
+                    return {"_index": index, "_id": str(id), "result": "not_found"}
+                raise NotFoundError(404, "not_found", {"_id": id, "result": "not_found"})
+            name, doc = found
+            del self.cluster.indices[name][doc["_id"]]
+            return {"_index": name, "_type": doc["_type"], "_id": doc["_id"], "result": "deleted"}
+
+    def mget(self, body: dict, index: str, doc_type: str = None, **kwargs) -> dict:
+        ids = body["ids"] if "ids" in body else [doc["_id"] for doc in body["docs"]]
+        return {"docs": [self.get(index, id, doc_type=doc_type, ignore=404) for id in ids]}
+
+    def update(self, index: str, id: str, body: dict, doc_type: str = "_doc", _source=None, **kwargs) -> dict:
+        """Partial updates with a doc, or a script that increments a field, like the sequence counter
+        of the change log, or that adds a value to a list, like the routing keys of a target."""
+        with self.cluster.lock:
+            found = self.find_document(index, id, doc_type)
+            if not found:
+                if "upsert" not in body:
+                    raise NotFoundError(404, "document_missing_exception", {"_id": id})
+                source = copy_source(body["upsert"])
+            else:
+                source = copy.deepcopy(found[1]["_source"])
+                if "doc" in body:
+                    source.update(copy_source(body["doc"]))
+                if "script" in body:
+                    increment = re.fullmatch(r"ctx\._source\.(\w+)\s*\+=\s*(?:(\d+)|params\.(\w+))",
+                                             body["script"]["source"].strip())
+                    addition = re.search(r"ctx\._source\.(\w+)\.add\(params\.(\w+)\)", body["script"]["source"])
+                    if increment:
+                        amount = increment.group(2) or body["script"]["params"][increment.group(3)]
+                        source[increment.group(1)] += int(amount)
+                    elif addition:
+                        value = body["script"]["params"][addition.group(2)]
+                        if value not in source[addition.group(1)]:
+                            source[addition.group(1)].append(value)
+                    else:
+                        raise NotImplementedError("only increment and add scripts are supported by the in-memory "
+                                                  "stand-in")
+            response = self.index(index, source, id=id, doc_type=doc_type)
+            if _source:
+                response["get"] = {"_source": filter_source(copy.deepcopy(source), _source)}
+            return response
+
+    def search_docs(self, index: str, query: dict) -> List[tuple]:
+        return [(name, doc) for name in self.cluster.resolve(index)
+                for doc in self.cluster.indices[name].values() if matches(query, doc)]
+
+    def search(self, body: dict = None, index: str = "_all", scroll: str = None, size: int = None, **kwargs) -> dict:
+        body = make_body(body, kwargs)
+        with self.cluster.lock:
+            if index == "_all":
+                index = ",".join(self.cluster.indices)
+            found = self.search_docs(index, body.get("query", {"match_all": {}}))
+            docs = [doc for _, doc in found]
+            sort_fields = parse_sort(body["sort"]) if "sort" in body else []
+            if sort_fields:
+                docs = sort_docs(docs, sort_fields)
+            if "search_after" in body:
+                docs = [doc for doc in docs if is_after([get_sort_value(doc, field) for field, _ in sort_fields],
+                                                       body["search_after"], sort_fields)]
+            index_names = {doc["_id"] + doc["_type"]: name for name, doc in found}
+            response = {
+                "took": 0,
+                "timed_out": False,
+                "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+                "hits": {"total": {"value": len(docs), "relation": "eq"}, "max_score": 1.0}
+            }
+            if "aggs" in body or "aggregations" in body:
+                aggs = body["aggs"] if "aggs" in body else body["aggregations"]
+                response["aggregations"] = {
+                    name: aggregate_terms(docs, agg["terms"]["field"], agg["terms"].get("size", 10))
+                    for name, agg in aggs.items()
+                }
+            if scroll:
+                # the first page of a scroll has all hits, so the next scroll call is empty
+                page = docs
+                response["_scroll_id"] = "in-memory"
+            else:
+                start = body.get("from", 0)
+                page = docs[start: start + body.get("size", size if size is not None else 10)]
+            hits = []
+            for doc in page:
+                hit = make_hit(index_names[doc["_id"] + doc["_type"]], doc, body.get("_source"))
+                if sort_fields:
+                    hit["sort"] = [get_sort_value(doc, field) for field, _ in sort_fields]
+                hits.append(hit)
+            response["hits"]["hits"] = hits
+            return response
+
+    def scroll(self, scroll_id: str = None, body: dict = None, **kwargs) -> dict:
+        return {"_scroll_id": scroll_id, "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+                "hits": {"total": {"value": 0, "relation": "eq"}, "hits": []}}
+
+    def clear_scroll(self, **kwargs) -> dict:
+        return {"succeeded": True}
+
+    def count(self, body: dict = None, index: str = "_all", **kwargs) -> dict:
+        body = make_body(body, kwargs)
+        with self.cluster.lock:
+            if index == "_all":
+                index = ",".join(self.cluster.indices)
+            query = body["query"] if body and "query" in body else {"match_all": {}}
+            return {"count": len(self.search_docs(index, query))}
+
+    def delete_by_query(self, index: str, body: dict, **kwargs) -> dict:
+        with self.cluster.lock:
+            found = self.search_docs(index, body["query"])
+            for name, doc in found:
+                del self.cluster.indices[name][doc["_id"]]
+            return {"deleted": len(found), "failures": []}
+
+    def bulk(self, body: Union[str, list], index: str = None, doc_type: str = None, **kwargs) -> dict:
+        lines = [line for line in body.splitlines() if line.strip()] if isinstance(body, str) else body
+        lines = [json.loads(line) if isinstance(line, str) else line for line in lines]
+        items = []
+        position = 0
+        with self.cluster.lock:
+            while position < len(lines):
+                op_type, meta = next(iter(lines[position].items()))
+                position += 1
+                item = {"_index": meta.get("_index", index), "_type": meta.get("_type", doc_type),
+                        "_id": meta.get("_id")}
+                try:
+                    if op_type == "delete":
+                        self.delete(item["_index"], item["_id"], doc_type=item["_type"])
+                        item["status"] = 200
+                    else:
+                        source = lines[position]
+                        position += 1
+                        if op_type == "create":
+                            self.create(item["_index"], item["_id"], source, doc_type=item["_type"],
+                                        routing=meta.get("_routing", meta.get("routing")))
+                            item["status"] = 201
+                        elif op_type == "index":
+                            self.index(item["_index"], source, id=item["_id"], doc_type=item["_type"],
+                                       routing=meta.get("_routing", meta.get("routing")))
+                            item["status"] = 201
+                        else:
+                            self.update(item["_index"], item["_id"], source, doc_type=item["_type"])
+                            item["status"] = 200
+                except (NotFoundError, RequestError) as err:
+                    item["status"] = err.status_code
+                    item["error"] = {"type": err.error, "reason": str(err.info)}
+                items.append({op_type: item})
+        return {"took": 0, "errors": any("error" in item[op] for item in items for op in item), "items": items}
+
+
+def get_index_sizes(cluster: InMemoryCluster = None) -> Dict[str, int]:
+    cluster = cluster if cluster else default_cluster
+    with cluster.lock:
+        return {name: len(documents) for name, documents in cluster.indices.items()}
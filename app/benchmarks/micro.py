@@ -0,0 +1,186 @@
+"""Microbenchmarks of the model, permission and query hot paths, on generated data of several sizes.
+
+Run from the app directory:
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --save benchmarks/baselines/micro.json
+    python -m benchmarks.micro --compare benchmarks/baselines/micro.json
+
+Results are the median and minimum time per call over several samples. Baselines are JSON with
+sorted keys, so a changed baseline shows up as a readable diff in review. Compare runs on the same
+machine, timings of different machines don't compare.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+from benchmarks.corpus import access_statuses, make_annotations, make_permission_params, make_stored_annotation, \
+    make_subresource_annotation, make_target_id
+from models.annotation import Annotation
+from models.annotation_container import AnnotationContainer
+from models.iiif_manifest import web_anno_to_manifest
+import models.permissions as permissions
+import models.queries as query_helper
+
+default_sizes = [10, 100, 1000]
+# depth of the nested SubresourceSelectors of the target benchmarks
+subresource_depth = 5
+
+
+def setup_annotation_construction(size: int) -> Callable[[], None]:
+    annotations = make_annotations(size)
+
+    def run():
+        # the annotations have ids and creation times, so construction doesn't modify them
+        for annotation in annotations:
+            Annotation(annotation)
+    return run
+
+
+def setup_target_info(size: int) -> Callable[[], None]:
+    annotations = [Annotation(make_subresource_annotation(index, make_target_id(index), subresource_depth))
+                   for index in range(size)]
+
+    def run():
+        for annotation in annotations:
+            annotation.get_targets_info()
+            annotation.get_target_ids()
+    return run
+
+
+def setup_permission_check(size: int) -> Callable[[], None]:
+    annotations = [make_stored_annotation(index, make_target_id(index), "user%d" % (index % 3),
+                                          access_statuses[index % len(access_statuses)]) for index in range(size)]
+
+    def run():
+        for annotation in annotations:
+            for username in [None, "user0", "user1"]:
+                permissions.is_allowed_action(username, "see", annotation)
+                permissions.is_allowed_action(username, "edit", annotation)
+    return run
+
+
+def setup_permission_query(size: int) -> Callable[[], None]:
+    params_list = [make_permission_params("user%d" % index, access_status)
+                   for index in range(size) for access_status in access_statuses]
+    params_list += [dict(params, access_status=access_statuses) for params in params_list[:size]]
+
+    def run():
+        for params in params_list:
+            query_helper.make_permission_see_query(params)
+    return run
+
+
+def setup_container_page(size: int) -> Callable[[], None]:
+    annotations = [Annotation(annotation) for annotation in make_annotations(size)]
+    base_url = "http://localhost:3000/api/v1/annotations/"
+
+    def run():
+        container = AnnotationContainer(base_url, annotations, page_size=100, view="PreferContainedDescriptions")
+        for page in range(container.num_pages):
+            container.view_page(page)
+    return run
+
+
+def setup_manifest(size: int) -> Callable[[], None]:
+    annotations = make_annotations(size)
+
+    def run():
+        web_anno_to_manifest(annotations)
+    return run
+
+
+benchmarks = {
+    "annotation_construction": setup_annotation_construction,
+    "target_info": setup_target_info,
+    "permission_check": setup_permission_check,
+    "permission_query": setup_permission_query,
+    "container_page": setup_container_page,
+    "web_anno_to_manifest": setup_manifest,
+}
+
+
+def measure(run: Callable[[], None], samples: int, min_sample_time: float) -> Dict[str, float]:
+    # calibrate the number of calls per sample, so short calls aren't dominated by timer resolution
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            run()
+        if time.perf_counter() - start >= min_sample_time:
+            break
+        calls *= 2
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        for _ in range(calls):
+            run()
+        timings.append((time.perf_counter() - start) / calls)
+    return {"median_us": round(statistics.median(timings) * 1e6, 1), "min_us": round(min(timings) * 1e6, 1)}
+
+
+def run_benchmarks(names: List[str], sizes: List[int], samples: int, min_sample_time: float) -> Dict[str, dict]:
+    results = {}
+    for name in names:
+        for size in sizes:
+            results["%s[%d]" % (name, size)] = measure(benchmarks[name](size), samples, min_sample_time)
+    return results
+
+
+def compare_results(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Print the results next to the baseline and return the benchmarks that are slower than the
+    baseline by more than the threshold factor."""
+    regressions = []
+    print(f"{'benchmark':<34} {'median us':>12} {'baseline us':>12} {'ratio':>7}")
+    for key, result in results.items():
+        if key not in baseline:
+            print(f"{key:<34} {result['median_us']:>12.1f} {'-':>12} {'-':>7}")
+            continue
+        ratio = result["median_us"] / baseline[key]["median_us"] if baseline[key]["median_us"] else 1.0
+        flag = " <- slower" if ratio > threshold else ""
+        print(f"{key:<34} {result['median_us']:>12.1f} {baseline[key]['median_us']:>12.1f} {ratio:>7.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(key)
+    return regressions
+
+
+def print_results(results: Dict[str, dict]) -> None:
+    print(f"{'benchmark':<34} {'median us':>12} {'min us':>12}")
+    for key, result in results.items():
+        print(f"{key:<34} {result['median_us']:>12.1f} {result['min_us']:>12.1f}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Microbenchmarks of model and validation hot paths")
+    parser.add_argument("--benchmark", action="append", choices=sorted(benchmarks),
+                        help="benchmark to run (repeatable, default: all)")
+    parser.add_argument("--size", type=int, action="append", help="number of generated items (repeatable)")
+    parser.add_argument("--samples", type=int, default=7, help="number of timed samples per benchmark")
+    parser.add_argument("--min-sample-time", type=float, default=0.05, help="minimum seconds per sample")
+    parser.add_argument("--save", help="write the results as JSON baseline to this file")
+    parser.add_argument("--compare", help="compare the results to the JSON baseline in this file")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="report benchmarks slower than the baseline by this factor")
+    args = parser.parse_args()
+    names = args.benchmark or list(benchmarks)
+    results = run_benchmarks(names, args.size or default_sizes, args.samples, args.min_sample_time)
+    if args.save:
+        baseline = {"python": platform.python_version(), "machine": platform.machine(), "results": results}
+        with open(args.save, "wt") as fh:
+            json.dump(baseline, fh, indent=2, sort_keys=True)
+            fh.write("\n")
+    if not args.compare:
+        print_results(results)
+        return 0
+    with open(args.compare, "rt") as fh:
+        baseline = json.load(fh)
+    regressions = compare_results(results, baseline["results"], args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
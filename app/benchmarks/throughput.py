@@ -0,0 +1,106 @@
+"""Compare read throughput of the WSGI server (uwsgi) and the ASGI server (uvicorn).
+
+Start both servers against the same Elasticsearch index, e.g.:
+
+    uwsgi --http :3000 --module server --callable app --processes 4 --threads 2
+    uvicorn asgi_server:app --port 3001 --workers 4
+
+and run from the app directory:
+
+    python -m benchmarks.throughput --wsgi http://localhost:3000 --asgi http://localhost:3001
+"""
+import argparse
+import asyncio
+import math
+import time
+from typing import Dict, List
+
+import aiohttp
+
+default_paths = [
+    "/api/v1/annotations/",
+    "/api/v1/annotations/stats",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(math.ceil(pct / 100 * len(ordered))) - 1)
+    return ordered[max(index, 0)]
+
+
+async def run_load(base_url: str, path: str, num_requests: int, concurrency: int,
+                   headers: Dict[str, str]) -> Dict[str, float]:
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(num_requests):
+        queue.put_nowait(None)
+
+    async def worker(session):
+        nonlocal errors
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                async with session.get(base_url + path, headers=headers) as response:
+                    await response.read()
+                    if response.status >= 400:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return {
+        "requests_per_second": num_requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "errors": errors,
+    }
+
+
+async def compare(servers: Dict[str, str], paths: List[str], num_requests: int, concurrency_levels: List[int],
+                  headers: Dict[str, str]) -> List[dict]:
+    results = []
+    for path in paths:
+        for concurrency in concurrency_levels:
+            for name, base_url in servers.items():
+                result = await run_load(base_url, path, num_requests, concurrency, headers)
+                result.update({"server": name, "path": path, "concurrency": concurrency})
+                results.append(result)
+    return results
+
+
+def print_results(results: List[dict]) -> None:
+    print(f"{'path':<30} {'conc':>5} {'server':<6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7}")
+    for result in results:
+        print(f"{result['path']:<30} {result['concurrency']:>5} {result['server']:<6} "
+              f"{result['requests_per_second']:>9.1f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+              f"{result['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare read throughput of the WSGI and ASGI servers")
+    parser.add_argument("--wsgi", default="http://localhost:3000", help="base URL of the WSGI server")
+    parser.add_argument("--asgi", default="http://localhost:3001", help="base URL of the ASGI server")
+    parser.add_argument("--path", action="append", help="API path to request (repeatable)")
+    parser.add_argument("--requests", type=int, default=2000, help="number of requests per run")
+    parser.add_argument("--concurrency", type=int, action="append", help="number of concurrent clients (repeatable)")
+    parser.add_argument("--auth", help="Authorization header value, e.g. 'Basic dXNlcjE6cGFzczE='")
+    args = parser.parse_args()
+    headers = {"Authorization": args.auth} if args.auth else {}
+    servers = {"wsgi": args.wsgi, "asgi": args.asgi}
+    results = asyncio.run(compare(servers, args.path or default_paths, args.requests,
+                                  args.concurrency or [8, 64, 256], headers))
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
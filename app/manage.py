@@ -0,0 +1,151 @@
+"""Maintenance commands for the annotation index. Run from the app directory, e.g.:
+
+    python manage.py purge-tombstones --retention-days 30
+    python manage.py reindex --delete-original
+
+Commands that are meant to run regularly, like purging tombstones, can be scheduled with cron.
+"""
+import argparse
+import sys
+import time
+from typing import Union
+
+from models.annotation_store import AnnotationStore, default_dual_write_check_interval
+from settings import server_config
+
+
+def purge_tombstones(store: AnnotationStore, args: argparse.Namespace) -> None:
+    count = store.purge_tombstones_es(retention_days=args.retention_days, include_undated=args.include_undated,
+                                      dry_run=args.dry_run)
+    if args.dry_run:
+        print("%d tombstones can be purged" % count)
+    else:
+        print("purged %d tombstones" % count)
+
+
+def list_indices(store: AnnotationStore, args: argparse.Namespace) -> None:
+    aliased_indices = store.get_aliased_indices()
+    if not aliased_indices:
+        print("%s is a concrete index without alias" % store.es_index)
+    for index in store.get_index_versions():
+        print("%s%s" % (index, " <- %s" % store.es_index if index in aliased_indices else ""))
+
+
+def wait_for_reindex(store: AnnotationStore, task_id: str, poll_interval: float) -> None:
+    while True:
+        task = store.get_reindex_task(task_id)
+        status = task["task"]["status"]
+        print("copied %d of %d documents" % (status["created"] + status["version_conflicts"], status["total"]))
+        if task["completed"]:
+            if "error" in task or task["response"]["failures"]:
+                raise RuntimeError("reindex failed, the alias is not switched: %s"
+                                   % (task["error"] if "error" in task else task["response"]["failures"][:10]))
+            return
+        time.sleep(poll_interval)
+
+
+def reindex(store: AnnotationStore, args: argparse.Namespace) -> None:
+    """Copy the annotation index into a new version without taking the server offline. Servers
+    write to both indices from the start of the copy, so the new index is complete when the copy
+    is done and the alias can be switched."""
+    if store.es.indices.exists_alias(name=store.es_index + "_next"):
+        raise RuntimeError("servers already write to a new index, finish that reindex with switch-alias first")
+    if not args.no_switch and not args.delete_original and not store.get_aliased_indices():
+        # checked before copying, switching would fail at the end
+        raise RuntimeError("%s is a concrete index, which the alias replaces by deleting it. Confirm with "
+                           "--delete-original, or use --no-switch and switch later" % store.es_index)
+    new_index = store.create_index_version()
+    print("created %s" % new_index)
+    store.start_dual_write(new_index)
+    check_interval = store.es_config["dual_write_check_interval"] \
+        if "dual_write_check_interval" in store.es_config else default_dual_write_check_interval
+    print("waiting %ds for the servers to write to %s too" % (2 * check_interval, new_index))
+    time.sleep(2 * check_interval)
+    if args.reroute:
+        slices = args.slices if args.slices != "auto" else 4
+        print("copied %d documents" % store.copy_to_index(new_index, slices=slices))
+    else:
+        wait_for_reindex(store, store.start_reindex(new_index, slices=args.slices), args.poll_interval)
+    if args.no_switch:
+        print("servers keep writing to %s, switch the alias with: switch-alias %s" % (new_index, new_index))
+        return
+    switch_alias(store, argparse.Namespace(index=new_index, delete_old=args.delete_old,
+                                           delete_original=args.delete_original))
+
+
+def switch_alias(store: AnnotationStore, args: argparse.Namespace) -> None:
+    was_concrete = not store.get_aliased_indices()
+    old_indices = store.switch_alias(args.index, delete_original=args.delete_original)
+    if was_concrete:
+        print("deleted index %s and replaced it by an alias" % store.es_index)
+    print("%s now points to %s" % (store.es_index, args.index))
+    for index in old_indices:
+        if args.delete_old:
+            store.es.indices.delete(index=index)
+            print("deleted %s" % index)
+        else:
+            print("kept %s, switch back with: switch-alias %s" % (index, index))
+
+
+def parse_slices(value: str) -> Union[str, int]:
+    if value == "auto":
+        return value
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError("slices should be 'auto' or a positive integer")
+    return int(value)
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Maintenance of the annotation index")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    purge_parser = subparsers.add_parser("purge-tombstones",
+                                         help="delete the stubs of annotations and collections deleted long ago")
+    purge_parser.add_argument("--retention-days", type=int, default=None,
+                              help="keep tombstones of this many days (default: tombstone_retention_days setting)")
+    purge_parser.add_argument("--include-undated", action="store_true",
+                              help="also purge tombstones without deletion time, written by older versions")
+    purge_parser.add_argument("--dry-run", action="store_true", help="only count the tombstones that can be purged")
+    purge_parser.set_defaults(handler=purge_tombstones)
+    list_parser = subparsers.add_parser("list-indices", help="show the versions of the annotation index")
+    list_parser.set_defaults(handler=list_indices)
+    reindex_parser = subparsers.add_parser("reindex",
+                                           help="copy the annotation index into a new version with the current "
+                                                "mapping and shard settings, and switch the alias to it")
+    reindex_parser.add_argument("--slices", type=parse_slices, default="auto",
+                                help="number of slices copied in parallel (default: auto)")
+    reindex_parser.add_argument("--reroute", action="store_true",
+                                help="route annotations by the current target_routing setting instead of keeping "
+                                     "their routing, copied by this command instead of by Elasticsearch")
+    reindex_parser.add_argument("--poll-interval", type=float, default=10, help="seconds between progress reports")
+    reindex_parser.add_argument("--no-switch", action="store_true",
+                                help="keep dual writes going and leave switching the alias for later")
+    reindex_parser.add_argument("--delete-old", action="store_true", help="delete the old index after switching")
+    reindex_parser.add_argument("--delete-original", action="store_true",
+                                help="confirm deleting the original concrete index at the first switch")
+    reindex_parser.set_defaults(handler=reindex)
+    switch_parser = subparsers.add_parser("switch-alias", help="point the annotation index alias to an index version")
+    switch_parser.add_argument("index", help="name of the index version")
+    switch_parser.add_argument("--delete-old", action="store_true", help="delete the old index after switching")
+    switch_parser.add_argument("--delete-original", action="store_true",
+                               help="confirm deleting the original concrete index at the first switch")
+    switch_parser.set_defaults(handler=switch_alias)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = make_parser().parse_args(argv)
+    if getattr(args, "retention_days", None) is not None and args.retention_days < 0:
+        print("retention days should be a non-negative integer", file=sys.stderr)
+        return 2
+    store = AnnotationStore(server_config["Elasticsearch"])
+    try:
+        args.handler(store, args)
+    except RuntimeError as err:
+        print(err, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
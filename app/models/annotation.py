@@ -3,8 +3,34 @@ import datetime
 import pytz
 import uuid
 import copy
-from rfc3987 import parse as parse_iri
+from functools import lru_cache
+from rfc3987 import get_compiled_pattern
 from typing import List, Union
+from models.region import get_region_source, get_target_regions
+from models.target_range import get_target_ranges
+
+# compiled once, matching skips the sub-component parsing done by rfc3987.parse
+iri_pattern = get_compiled_pattern('^%(IRI)s$')
+
+
+@lru_cache(maxsize=65536)
+def is_valid_iri(iri: str) -> bool:
+    """Annotations on the same resources share target IRIs, so each IRI is only matched once."""
+    return iri_pattern.match(iri) is not None
+
+
+def make_target_path(resource_ids: List[str]) -> dict:
+    """A target path is the targeted resource with its ancestors, ordered from root to parent."""
+    return {"id": resource_ids[-1], "ancestors": resource_ids[:-1]}
+
+
+def get_ancestors_from_hierarchy(target_hierarchy: List[dict], resource_id: str) -> List[str]:
+    for target_path in target_hierarchy:
+        if target_path["id"] == resource_id:
+            return target_path["ancestors"]
+        if resource_id in target_path["ancestors"]:
+            return target_path["ancestors"][:target_path["ancestors"].index(resource_id)]
+    return []
 
 
 def validate_generic(annotation: dict) -> None:
@@ -42,10 +68,8 @@ def validate_annotation(annotation: dict):
         else:
             # there is no identifier for the target
             raise AnnotationError(message='External annotation target MUST have an IRI identifier')
-        try:
-            # id must be an IRI
-            parse_iri(target_id, rule="IRI")
-        except ValueError:
+        # id must be an IRI
+        if not isinstance(target_id, str) or not is_valid_iri(target_id):
             raise AnnotationError(message='annotation target id MUST be an IRI')
 
 
@@ -110,14 +134,22 @@ class WebAnnotationValidator(object):
         return types[0]
 
 
+# validators hold no per-annotation state, so a single instance is shared by all annotations
+web_annotation_validator = WebAnnotationValidator()
+
+
 class Annotation(object):
 
+    __slots__ = ("data", "type", "id", "motivation", "in_collection", "permissions", "target_list",
+                 "target_hierarchy", "target_regions", "target_ranges", "body_text")
+
+    validator = web_annotation_validator
+
     def __init__(self, annotation: dict):
         if 'id' not in annotation:
             annotation['id'] = uuid.uuid4().urn
         if 'created' not in annotation:
             annotation['created'] = datetime.datetime.now(pytz.utc).isoformat()
-        self.validator = WebAnnotationValidator()
         self.validator.validate(annotation)
         self.data = annotation
         self.type = "Annotation"
@@ -126,8 +158,35 @@ class Annotation(object):
         self.in_collection = []
         self.permissions = None
         self.target_list = None
+        self.target_hierarchy = None
+        self.target_regions = None
+        self.target_ranges = None
+        self.body_text = None
         self.set_permissions()
         self.set_target_list()
+        self.set_target_hierarchy()
+        self.set_target_regions()
+        self.set_target_ranges()
+        self.set_body_text()
+
+    @classmethod
+    def from_store(cls, source: dict) -> "Annotation":
+        """Trusted constructor for documents read from the store. They were validated and given an
+        id and timestamp when they were written, so validation is skipped and the source dict is
+        used as is instead of copied. Permissions and target list are moved out of the source."""
+        annotation = cls.__new__(cls)
+        annotation.data = source
+        annotation.type = "Annotation"
+        annotation.id = source['id']
+        annotation.motivation = source['motivation'] if 'motivation' in source else None
+        annotation.in_collection = []
+        annotation.set_permissions()
+        annotation.set_target_list()
+        annotation.set_target_hierarchy()
+        annotation.set_target_regions()
+        annotation.set_target_ranges()
+        annotation.set_body_text()
+        return annotation
 
     def set_permissions(self) -> None:
         if "permissions" in self.data:
@@ -143,10 +202,46 @@ class Annotation(object):
         else:
             self.target_list = None
 
+    def set_target_hierarchy(self) -> None:
+        if "target_hierarchy" in self.data:
+            self.target_hierarchy = self.data["target_hierarchy"]
+            del self.data["target_hierarchy"]
+        else:
+            self.target_hierarchy = None
+
+    def set_target_regions(self) -> None:
+        if "target_regions" in self.data:
+            self.target_regions = self.data["target_regions"]
+            del self.data["target_regions"]
+        else:
+            self.target_regions = None
+
+    def set_target_ranges(self) -> None:
+        if "target_ranges" in self.data:
+            self.target_ranges = self.data["target_ranges"]
+            del self.data["target_ranges"]
+        else:
+            self.target_ranges = None
+
+    def set_body_text(self) -> None:
+        if "body_text" in self.data:
+            self.body_text = self.data["body_text"]
+            del self.data["body_text"]
+        else:
+            self.body_text = None
+
     def to_json(self) -> dict:
         annotation_json = copy.copy(self.data)
         annotation_json["permissions"] = self.permissions
         annotation_json["target_list"] = self.target_list
+        if self.target_hierarchy is not None:
+            annotation_json["target_hierarchy"] = self.target_hierarchy
+        if self.target_regions is not None:
+            annotation_json["target_regions"] = self.target_regions
+        if self.target_ranges is not None:
+            annotation_json["target_ranges"] = self.target_ranges
+        if self.body_text is not None:
+            annotation_json["body_text"] = self.body_text
         return annotation_json
 
     def to_clean_json(self, params) -> dict:
@@ -185,7 +280,7 @@ class Annotation(object):
 
     def get_target_info(self, target: dict) -> List[dict]:
         if type(target) == str:
-            info = [{"id": target}]
+            info = [{"id": get_region_source(target)}]
         elif "id" in target:
             if "type" not in target:
                 raise AnnotationError("target requires a type property")
@@ -217,12 +312,64 @@ class Annotation(object):
             info += self.get_subresource_info(subresource["subresource"])
         return info
 
+    def get_bodies(self) -> List[Union[str, dict]]:
+        if 'body' not in self.data:
+            return []
+        return as_list(self.data['body'])
+
+    def get_body_values(self) -> List[dict]:
+        """Return the text values of the bodies (textual bodies, tags and classifications) with
+        their language, if any. Bodies that are only an IRI have no text to search."""
+        values = []
+        if 'bodyValue' in self.data and isinstance(self.data['bodyValue'], str):
+            values += [{"language": None, "value": self.data['bodyValue']}]
+        for body in self.get_bodies():
+            if isinstance(body, dict) and isinstance(body.get('value'), str):
+                language = body['language'] if isinstance(body.get('language'), str) else None
+                values += [{"language": language, "value": body['value']}]
+        return values
+
+    def get_target_hierarchy(self) -> List[dict]:
+        """Return the path of each target, from the resources described by its SubresourceSelector
+        or NestedPIDSelector. Storing ancestors with the targets allows querying annotations inside
+        or above a resource with a single filter."""
+        return [target_path for target in self.get_targets() for target_path in self.get_target_paths(target)]
+
+    def get_target_regions(self) -> List[dict]:
+        """Return the bounding boxes of the image regions the targets select, per source."""
+        return [region for target in self.get_targets() for region in get_target_regions(target)]
+
+    def get_target_ranges(self) -> List[dict]:
+        """Return the character and time ranges the targets select, per source."""
+        return [target_range for target in self.get_targets() for target_range in get_target_ranges(target)]
+
+    def get_target_paths(self, target: Union[str, dict]) -> List[dict]:
+        if type(target) == str:
+            return [make_target_path([target])]
+        if 'id' in target:
+            return [make_target_path([target['id']])]
+        if 'source' not in target:
+            return []
+        selectors = target['selector'] if 'selector' in target else None
+        if not selectors:
+            return [make_target_path([target['source']])]
+        if type(selectors) != list:
+            selectors = [selectors]
+        target_paths = []
+        for selector in selectors:
+            if selector["type"] == "SubresourceSelector":
+                resource_ids = [target['source']] + self.get_subresource_ids(selector["value"]["subresource"])
+                target_paths += [make_target_path(resource_ids)]
+            elif selector["type"] == "NestedPIDSelector" and selector["value"]:
+                target_paths += [make_target_path([resource["id"] for resource in selector["value"]])]
+        return target_paths if target_paths else [make_target_path([target['source']])]
+
     def get_target_ids(self) -> List[str]:
         return [target_id for target in self.get_targets() for target_id in self.get_target_id(target)]
 
     def get_target_id(self, target: Union[str, dict]) -> List[str]:
         if type(target) == str:
-            return [target]
+            return [get_region_source(target)]
         if 'id' in target:
             return [target['id']]
         if 'source' in target and 'selector' in target:
@@ -3,23 +3,21 @@ import math
 import copy
 import json
 from typing import List, Union
-from rfc3987 import parse as parse_iri
 
-from models.annotation import Annotation, AnnotationError
+from models.annotation import Annotation, AnnotationError, is_valid_iri
 from models.annotation_collection import AnnotationCollection
 from settings import server_config
 
 api_url = server_config['SWAServer']['url'] + server_config['SWAServer']['api_prefix']
+default_page_size = 100
 
 
 def is_annotation_list(annotations):
     if not isinstance(annotations, list):
         return False
+    # annotations come from the store or were validated on creation, so only check their type
     for annotation in annotations:
-        try:
-            # copy to make sure annotation is not changed
-            Annotation(copy.copy(annotation))
-        except AnnotationError:
+        if not is_annotation(annotation):
             return False
     return True
 
@@ -38,7 +36,7 @@ def is_annotation_collection(data):
 def is_annotation(data):
     if isinstance(data, Annotation):
         return True
-    elif not isinstance(data, dict or "type" not in data):
+    elif not isinstance(data, dict) or "type" not in data:
         return False
     elif isinstance(data["type"], str) and data["type"] == "Annotation":
         return True
@@ -60,9 +58,36 @@ def update_url(base_url, params):
     return url_parser.urlunparse(url_parts)
 
 
+def make_page_item(item):
+    """Return the item as it appears on a page, with an external id. Source items are never changed,
+    only description items are shallow copied to set the external id."""
+    if isinstance(item, str):
+        return api_url + '/annotations/' + item
+    if isinstance(item, Annotation):
+        item = item.data
+    elif not is_annotation(item):
+        raise AnnotationError(message="container items should be Annotations or annotation ids")
+    page_item = copy.copy(item)
+    page_item['id'] = api_url + '/annotations/' + item['id']
+    return page_item
+
+
+def make_page_item_iri(item):
+    if isinstance(item, str):
+        return api_url + '/annotations/' + item
+    if isinstance(item, Annotation):
+        return api_url + '/annotations/' + item.id
+    if not is_annotation(item):
+        raise AnnotationError(message="container items should be Annotations or annotation ids")
+    return api_url + '/annotations/' + item['id']
+
+
 class AnnotationContainer(object):
 
-    def __init__(self, base_url: str, data, page_size=100, view="PreferMinimalContainer", total=None):
+    def __init__(self, base_url: str, data, page_size=default_page_size, view="PreferMinimalContainer", total=None):
+        """Data is an AnnotationCollection, a list of annotations or a function fetching a single page
+        of annotations, called with the page number and page size. When pages are fetched, total
+        is required and only the pages that are shown are fetched."""
         self.base_url = base_url
         self.context = ["http://www.w3.org/ns/ldp.jsonld", "http://www.w3.org/ns/anno.jsonld"]
         self.metadata = {}
@@ -71,6 +96,8 @@ class AnnotationContainer(object):
         self.iris = 1
         self.modified = None
         self.items = None
+        self.fetch_page = None
+        self.fetched_pages = {}
         self.page_size = 0
         self.set_view(view)
         self.set_page_size(page_size)
@@ -102,7 +129,7 @@ class AnnotationContainer(object):
             "total": total,
             "type": ["BasicContainer", "AnnotationContainer"]
         }
-        self.num_pages = int(math.ceil(len(annotations) / self.page_size))
+        self.num_pages = int(math.ceil(total / self.page_size))
 
     def set_view(self, view):
         if view == "PreferMinimalContainer":
@@ -181,29 +208,39 @@ class AnnotationContainer(object):
         return part_of
 
     def add_page_items(self, page_num):
-        start_index = self.page_size * page_num
-        items = self.items[start_index: start_index + self.page_size]
-        if len(items) > 0 and isinstance(items[0], str):
-            items = [api_url + '/annotations/' + item for item in items]
-        else:
-            for item in items:
-                item['id'] = api_url + '/annotations/' + item['id']
+        # only the items of the requested page are checked and converted
+        items = self.get_page_items(page_num)
         if self.iris:
-            if isinstance(items[0], str):
-                return items
-            else:
-                return [item["id"] for item in items]
+            return [make_page_item_iri(item) for item in items]
         else:
-            return [item for item in items]
+            return [make_page_item(item) for item in items]
+
+    def get_page_items(self, page_num):
+        if self.fetch_page is None:
+            start_index = self.page_size * page_num
+            return self.items[start_index: start_index + self.page_size]
+        if page_num not in self.fetched_pages:
+            # pages after the last one are empty, no need to ask the store
+            items = self.fetch_page(page_num, self.page_size) if page_num < self.num_pages else []
+            self.fetched_pages[page_num] = items
+        return self.fetched_pages[page_num]
 
     def set_container_content(self, data, total):
+        if callable(data):
+            if total is None:
+                raise AnnotationError(message="total is required when annotations are fetched per page")
+            self.fetch_page = data
+            self.generate_metadata_from_annotations([], total)
+            return
+        if isinstance(data, list):
+            # the list is used as is, its items are checked when their page is generated
+            self.items = data
+            self.generate_metadata_from_annotations(data, total)
+            return
         data_json = self.make_json(data)
         if is_annotation_collection(data_json):
             self.items = data_json["items"]
             self.generate_metadata_from_collection(data_json)
-        elif is_annotation_list(data_json):
-            self.items = data_json
-            self.generate_metadata_from_annotations(data_json, total)
         else:
             raise AnnotationError(message="data should be an AnnotationCollection or a list of Annotations")
 
@@ -217,8 +254,6 @@ class AnnotationContainer(object):
             return data.to_json()
         if isinstance(data, Annotation):
             return data.data
-        elif isinstance(data, list):
-            return [self.make_json(item) for item in data]
         elif isinstance(data, dict) and "type" in data:
             return data
         else:
@@ -229,7 +264,7 @@ class AnnotationPage(object):
 
     def __init__(self, page_id: str, items: Union[None, List[Union[Annotation, dict]]] = None):
         self.type = 'AnnotationPage'
-        if not parse_iri(page_id, rule="IRI"):
+        if not is_valid_iri(page_id):
             raise ValueError('AnnotationPage id MUST be an IRI')
         self.id = page_id
         if items:
@@ -1,16 +1,37 @@
 from typing import Dict, Union
+from concurrent.futures import ThreadPoolExecutor
 import copy
+import datetime
+import hashlib
 import json
-from models.annotation import Annotation, AnnotationError
+import logging
+import time
+from models.annotation import Annotation, AnnotationError, get_ancestors_from_hierarchy
 from models.annotation_collection import AnnotationCollection
+from models.backend_calls import AccountingConnection, InstrumentedClient
+from models.change_log import default_settle_time, make_change
 from models.error import PermissionError
+from models.es_mapping import annotation_mapping, body_text_analyzers, change_mapping, make_index_template, \
+    routing_mapping
+from models.query_cache import LocalCacheBackend, QueryCache, SharedGeneration
+from models.request_context import RequestContext
 import models.queries as query_helper
 import models.permissions as permissions
+import pytz
 from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import TransportError
+from elasticsearch.helpers import bulk, scan, streaming_bulk
 
 
 # from elasticsearch.exceptions import NotFoundError
 
+logger = logging.getLogger(__name__)
+
+# days that the ids of deleted annotations and collections stay taken
+default_tombstone_retention_days = 30
+# seconds between checks of a server process for a reindex that needs its writes
+default_dual_write_check_interval = 5
+
 
 def target_list_changed(list1, list2):
     ids1 = set([target["id"] for target in list1])
@@ -40,6 +61,16 @@ def should_have_target_list(annotation):
     return True
 
 
+def make_tombstone(annotation_id, annotation_type):
+    # the stub keeps the id of a deleted annotation or collection taken until it is purged
+    return {
+        "id": annotation_id,
+        "type": annotation_type,
+        "status": "deleted",
+        "deleted": datetime.datetime.now(pytz.utc).isoformat()
+    }
+
+
 def should_have_permissions(annotation):
     if "status" in annotation and annotation["status"] == "deleted":
         return False
@@ -48,13 +79,200 @@ def should_have_permissions(annotation):
     return True
 
 
+def use_target_routing(es_config):
+    return es_config["target_routing"] if "target_routing" in es_config else False
+
+
+def get_write_refresh(es_config):
+    # "wait_for" makes a write visible to search before the request returns, "false" leaves that to the
+    # refresh interval of the index, so lists may miss a write for up to that interval
+    return es_config["write_refresh"] if "write_refresh" in es_config else "wait_for"
+
+
+# queries on more targets than this search all shards instead of looking up the routing of each target
+max_routed_target_ids = 100
+# adds the routing of an annotation to the routing entry of one of its other targets
+add_routing_script = "if (!ctx._source.routing.contains(params.routing)) { ctx._source.routing.add(params.routing) } " \
+                     "else { ctx.op = 'none' }"
+
+
+def make_routing_key(target_id):
+    # a digest, because a comma in a resource IRI would split the key into several routing values
+    return hashlib.sha1(target_id.encode("utf-8")).hexdigest()[:16]
+
+
+def make_target_routing_id(target_id):
+    # the entries of targets share the routing index with the entries of annotations
+    return "target:" + hashlib.sha1(target_id.encode("utf-8")).hexdigest()
+
+
+def get_primary_target_id(annotation):
+    """The first target that is not an annotation, e.g. the canvas of a reply, or the first target
+    if all targets are annotations."""
+    primary_targets = [target for target in annotation["target_list"] if not is_annotation(target)]
+    return primary_targets[0]["id"] if primary_targets else annotation["target_list"][0]["id"]
+
+
+def get_routing(annotation):
+    """Route an annotation on its primary target, so the annotations on a resource are on a single
+    shard. Routed queries on the other targets of an annotation find it through the routing entries
+    of those targets. Collections and tombstones have no targets and keep the default routing on
+    their id."""
+    if "target_list" not in annotation or not annotation["target_list"]:
+        return None
+    return make_routing_key(get_primary_target_id(annotation))
+
+
+def get_filter_target_ids(params):
+    if "filter" not in params or "target_id" not in params["filter"]:
+        return None
+    target_ids = params["filter"]["target_id"]
+    return [target_ids] if type(target_ids) == str else target_ids
+
+
+def make_target_routing_lookup_ids(target_ids):
+    """The ids of the routing entries of the targets of a query, or None if the query isn't routed
+    because it isn't on targets, or on too many to look up."""
+    if not target_ids or len(target_ids) > max_routed_target_ids:
+        return None
+    return [make_target_routing_id(target_id) for target_id in target_ids]
+
+
+def make_read_routing(target_ids, lookups):
+    """Route a query on target ids to the shards of those targets, and to the shards of the
+    annotations that have them as secondary target, found in the routing entries of the targets.
+    Entries are only added to, so an annotation moved away from a target leaves a key that only
+    widens the query to one more shard."""
+    routing_keys = {make_routing_key(target_id) for target_id in target_ids}
+    for lookup in lookups:
+        if lookup.get("found"):
+            routing_keys.update(lookup["_source"]["routing"])
+    return ",".join(sorted(routing_keys))
+
+
 def get_objects_from_hits(hits):
     objects = []
     for hit in hits:
         if hit["_source"]["type"] == "Annotation":
-            objects += [Annotation(hit["_source"])]
+            objects += [Annotation.from_store(hit["_source"])]
         elif hit["_source"]["type"] == "AnnotationCollection":
             objects += [AnnotationCollection(hit["_source"])]
+    return objects
+
+
+def get_hits_total(response):
+    if isinstance(response['hits']['total'], dict):
+        # For Elasticsearch version 6 and higher
+        return response['hits']['total']['value']
+    else:
+        # For Elasticsearch version 5 and lower
+        return response['hits']['total']
+
+
+def get_page_size(params, es_config):
+    return params["page_size"] if "page_size" in params else es_config["page_size"]
+
+
+def get_changes_index(es_config):
+    return es_config["changes_index"] if "changes_index" in es_config else es_config["annotation_index"] + "_changes"
+
+
+def get_routing_index(es_config):
+    return es_config["routing_index"] if "routing_index" in es_config else es_config["annotation_index"] + "_routing"
+
+
+def get_existing_source(annotation_id, document, annotation_type="_all"):
+    """The source of a document that exists and is not deleted, checked on the single copy that was
+    fetched. Documents fetched without a type are checked on the type in their source."""
+    source = document.get("_source", {}) if document else None
+    if source is None or source.get("status") == "deleted" \
+            or (annotation_type != "_all" and source.get("type", annotation_type) != annotation_type):
+        raise AnnotationError(message="Annotation with id %s does not exist" % annotation_id, status_code=404)
+    return source
+
+
+def make_annotation_or_collection(annotation_json):
+    if annotation_json["type"] == "Annotation":
+        return Annotation.from_store(annotation_json)
+    return AnnotationCollection(annotation_json)
+
+
+def should_be_allowed(username, action, annotation):
+    if not permissions.is_allowed_action(username, action, annotation):
+        raise PermissionError(message="Unauthorized access - no permission to {a} annotation".format(a=action))
+
+
+def get_ancestors_from_response(response, target_id):
+    for hit in response["hits"]["hits"]:
+        return get_ancestors_from_hierarchy(hit["_source"]["target_hierarchy"], target_id)
+    return []
+
+
+def get_ancestors_of(params):
+    """The resources of an ancestors_of filter, whose ancestors have to be looked up, or None."""
+    if "filter" not in params or "ancestors_of" not in params["filter"]:
+        return None
+    return params["filter"]["ancestors_of"]
+
+
+def add_ancestor_ids(params, ancestor_ids):
+    return dict(params, filter=dict(params["filter"], ancestor_ids=ancestor_ids))
+
+
+def make_routing_lookup_docs(annotation_ids, lookups):
+    """Make the mget docs of annotations with the routing found in the routing index. Returns the
+    docs and the ids without routing."""
+    docs, unknown_ids = [], []
+    for annotation_id, lookup in zip(annotation_ids, lookups):
+        if lookup.get("found"):
+            docs += [{"_id": annotation_id, "routing": lookup["_source"]["routing"]}]
+        else:
+            unknown_ids += [annotation_id]
+    return docs, unknown_ids
+
+
+def make_changes_query(since, params, es_config, until=None, target_ids=None):
+    """Query the changes after sequence number since that the user can see. Recent changes are held
+    back for the settle time, as they may not be in sequence yet. Changes up to sequence number until
+    were dispatched already, so they are in sequence and not held back."""
+    if until is None:
+        settle_time = es_config["change_settle_time"] if "change_settle_time" in es_config else default_settle_time
+        filters = [{"range": {"seq": {"gt": since}}}, {"range": {"timestamp": {"lte": time.time() - settle_time}}}]
+    else:
+        filters = [{"range": {"seq": {"gt": since, "lte": until}}}]
+    if target_ids:
+        filters.append({"terms": {"target_ids": sorted(target_ids)}})
+    return {
+        "size": get_page_size(params, es_config),
+        "query": query_helper.bool_filter(filters + [query_helper.make_permission_see_query(params)]),
+        "sort": [{"seq": "asc"}]
+    }
+
+
+def get_body_text(annotation):
+    """Group the text values of the bodies per language field of the index. Languages without their
+    own analyzer, and values without language, go to the default field."""
+    body_text = {}
+    for body_value in annotation.get_body_values():
+        language = body_value["language"].split("-")[0].lower() if body_value["language"] else None
+        field = language if language in body_text_analyzers else "default"
+        body_text.setdefault(field, []).append(body_value["value"])
+    return body_text
+
+
+def get_highlights(hit):
+    if "highlight" not in hit:
+        return []
+    return [snippet for snippets in hit["highlight"].values() for snippet in snippets]
+
+
+def get_stats_from_response(response):
+    aggregations = response["aggregations"]
+    return {
+        "total": get_hits_total(response),
+        "types": {bucket["key"]: bucket["doc_count"] for bucket in aggregations["types"]["buckets"]},
+        "access_status": {bucket["key"]: bucket["doc_count"] for bucket in aggregations["access_status"]["buckets"]}
+    }
 
 
 class AnnotationStore(object):
@@ -62,70 +280,176 @@ class AnnotationStore(object):
     def __init__(self, es_config):
         self.es_config = es_config
         self.es_index = es_config['annotation_index']
-        self.es = Elasticsearch([{"host": es_config['host'], "port": es_config['port']}])
+        self.target_routing = use_target_routing(es_config)
+        self.write_refresh = get_write_refresh(es_config)
+        self.es = InstrumentedClient(Elasticsearch([{"host": es_config['host'], "port": es_config['port']}],
+                                                  connection_class=AccountingConnection))
+        # callbacks that get the ids of the targets of written annotations
+        self.write_listeners = []
+        self.dual_write_index = None
+        self.dual_write_checked = 0
         if not self.es.indices.exists(index=self.es_index):
-            self.es.indices.create(index=self.es_index)
-        self.needs_refresh = False
+            self.create_index()
+        self.configure_change_log()
+        self.configure_routing_lookup()
+        self.configure_query_cache()
 
     def configure(self, es_config: Dict[str, Union[str, int]]):
         self.es_config = es_config
         self.es_index = es_config['annotation_index']
-        self.es = Elasticsearch([{"host": es_config['host'], "port": es_config['port']}])
+        self.target_routing = use_target_routing(es_config)
+        self.write_refresh = get_write_refresh(es_config)
+        self.es = InstrumentedClient(Elasticsearch([{"host": es_config['host'], "port": es_config['port']}],
+                                                  connection_class=AccountingConnection))
         if not self.es.indices.exists(index=self.es_index):
-            self.es.indices.create(index=self.es_index)
-        self.needs_refresh = False
+            self.create_index()
+        self.configure_change_log()
+        self.configure_routing_lookup()
+        self.configure_query_cache()
+
+    def configure_query_cache(self, backend=None):
+        """Cache search results in the process, or in a backend shared by all processes. A
+        query_cache_size of 0 disables the cache. Writes through other processes are seen by
+        following the sequence number of the change log."""
+        cache_size = self.es_config["query_cache_size"] if "query_cache_size" in self.es_config else 1000
+        cache_ttl = self.es_config["query_cache_ttl"] if "query_cache_ttl" in self.es_config else 10
+        check_interval = self.es_config["query_cache_check_interval"] \
+            if "query_cache_check_interval" in self.es_config else 1
+        if not backend and not cache_size:
+            self.query_cache = None
+            return
+        self.query_cache = QueryCache(backend if backend else LocalCacheBackend(max_size=cache_size, ttl=cache_ttl),
+                                      shared_generation=SharedGeneration(self.get_last_change_sequence,
+                                                                         check_interval=check_interval))
+
+    def get_query_cache_metrics(self):
+        return self.query_cache.get_metrics() if self.query_cache else None
+
+    def bump_write_generation(self):
+        # results of searches before the write are not used anymore
+        if self.query_cache:
+            self.query_cache.invalidate()
+
+    def search_index(self, query, routing=None):
+        if not self.query_cache:
+            return self.es.search(index=self.es_index, body=query, routing=routing)
+        return self.query_cache.search(self.es_index, query, routing,
+                                       lambda: self.es.search(index=self.es_index, body=query, routing=routing))
+
+    def get_dual_write_index(self):
+        """Get the new index that a running reindex copies into, or None. Writes go to both
+        indices until the alias is switched to the new index. The check is cached, the reindex
+        waits for all server processes to have seen it before copying."""
+        check_interval = self.es_config["dual_write_check_interval"] \
+            if "dual_write_check_interval" in self.es_config else default_dual_write_check_interval
+        if time.time() - self.dual_write_checked > check_interval:
+            next_alias = self.es_index + "_next"
+            self.dual_write_index = None
+            if self.es.indices.exists_alias(name=next_alias):
+                self.dual_write_index = list(self.es.indices.get_alias(name=next_alias).keys())[0]
+            self.dual_write_checked = time.time()
+        return self.dual_write_index
+
+    def configure_change_log(self):
+        # the change log has its own index, so changes don't show up in annotation queries
+        self.changes_index = get_changes_index(self.es_config)
+        if not self.es.indices.exists(index=self.changes_index):
+            self.es.indices.create(index=self.changes_index, body={"mappings": change_mapping},
+                                   params=self.get_mapping_params())
+
+    def configure_routing_lookup(self):
+        # with target routing, the routing of each annotation is kept by id, so it can be fetched with
+        # a real-time get on the shard of the annotation instead of a search on all shards
+        self.routing_index = get_routing_index(self.es_config)
+        if self.target_routing and not self.es.indices.exists(index=self.routing_index):
+            self.es.indices.create(index=self.routing_index, body={"mappings": routing_mapping},
+                                   params=self.get_mapping_params())
 
-    def index_needs_refresh(self):
-        return self.needs_refresh
+    def create_index(self):
+        """Create the index with the mapping of the analyzed body text fields. Other fields are
+        mapped dynamically. The number of shards and the mapping come from the index template, which
+        also applies to new versions of the index."""
+        self.put_index_template()
+        return self.es.indices.create(index=self.es_index)
+
+    def put_index_template(self):
+        number_of_shards = self.es_config["number_of_shards"] if "number_of_shards" in self.es_config else 1
+        number_of_replicas = self.es_config["number_of_replicas"] if "number_of_replicas" in self.es_config else 1
+        body = make_index_template([self.es_index, self.es_index + "_v*"], number_of_shards, number_of_replicas)
+        return self.es.indices.put_template(name=self.es_index, body=body, params=self.get_mapping_params())
+
+    def get_mapping_params(self):
+        major_version = int(self.es.info()["version"]["number"].split(".")[0])
+        if major_version >= 7:
+            # the mappings are keyed by document type, like the documents
+            return {"include_type_name": "true"}
+        return {}
 
     def index_refresh(self):
         self.es.indices.refresh(index=self.es_index)
-        self.needs_refresh = False
 
-    def set_index_needs_refresh(self):
-        self.needs_refresh = True
+    def add_write_listener(self, listener):
+        self.write_listeners.append(listener)
 
-    def check_index_is_fresh(self):
-        # check index is up to date, refresh if needed
-        if self.index_needs_refresh():
-            self.index_refresh()
+    def notify_write(self, target_list):
+        if not self.write_listeners or not target_list:
+            return
+        target_ids = {target["id"] for target in target_list}
+        for listener in self.write_listeners:
+            listener(target_ids)
 
     def add_annotation_es(self, annotation, params):
+        context = RequestContext(params)
         # check if annotation is valid, add id and timestamp
         anno = Annotation(annotation)
         # if annotation already has ID, check if it already exists in the index
         if "id" in annotation:
             self.should_not_exist(annotation['id'], annotation['type'])
         # add permissions for access (see) and update (edit)
-        permissions.add_permissions(anno, params)
-        # create target_list for easy target-based retrieval
-        self.add_target_list(anno)
+        permissions.add_permissions(anno, context)
+        self.add_index_fields(anno)
         # index annotation
         self.add_to_index(anno.to_json(), annotation["type"])
-        # set index needs refresh before next GET
-        self.set_index_needs_refresh()
+        self.record_change("Create", anno)
         # exclude target_list and permissions when returning annotation
-        return anno.to_clean_json(params)
+        return anno.to_clean_json(context)
+
+    def add_annotations_bulk_es(self, annotations, params):
+        """Index validated annotations in a single bulk request. Annotations whose id already exists
+        are not overwritten but reported as errors, like the rest of the annotations that failed."""
+        context = RequestContext(params)
+        for annotation in annotations:
+            permissions.add_permissions(annotation, context)
+            self.add_index_fields(annotation)
+        indexed, errors = self.add_bulk_to_index([annotation.to_json() for annotation in annotations], "Annotation")
+        failed_ids = {error["create"]["_id"] for error in errors}
+        self.record_changes("Create", [annotation for annotation in annotations if annotation.id not in failed_ids])
+        return {
+            "indexed": indexed,
+            "errors": [{"id": error["create"]["_id"], "message": str(error["create"].get("error"))}
+                       for error in errors]
+        }
 
     def create_collection_es(self, collection_data, params):
+        context = RequestContext(params)
         # check if collection is valid, add id and timestamp
         collection = AnnotationCollection(collection_data)
         # if collection already has ID, check if it already exists in the index
         if "id" in collection_data:
             self.should_not_exist(collection_data['id'], collection_data['type'])
         # add permissions for access (see) and update (edit)
-        permissions.add_permissions(collection, params)
+        permissions.add_permissions(collection, context)
         # index collection
         self.add_to_index(collection.to_json(), collection.type)
-        # set index needs refresh before next GET
-        self.set_index_needs_refresh()
+        self.record_change("Create", collection)
         # return collection to caller
-        return collection.to_clean_json(params)
+        return collection.to_clean_json(context)
 
     def add_annotation_to_collection_es(self, annotation_id, collection_id, params):
+        context = RequestContext(params)
         # check that user is allowed to edit collection
         collection = self.get_from_index_if_allowed(collection_id,
-                                                    username=params["username"],
+                                                    username=context.username,
                                                     action="edit",
                                                     annotation_type="AnnotationCollection")
         # check if collection contains annotation
@@ -133,147 +457,216 @@ class AnnotationStore(object):
             raise AnnotationError(message="Collection already contains this annotation")
         # check that user is allowed to see annotation
         self.get_from_index_if_allowed(annotation_id,
-                                       username=params["username"],
+                                       username=context.username,
                                        action="see",
                                        annotation_type="Annotation")
         # add annotation
         collection.add_annotation(annotation_id)
         # add permissions for access (see) and update (edit)
-        permissions.add_permissions(collection, params)
+        permissions.add_permissions(collection, context)
         self.update_in_index(collection.to_json(), "AnnotationCollection")
-        # set index needs refresh before next GET
-        self.set_index_needs_refresh()
+        self.record_change("Update", collection)
         # return collection metadata
-        return collection.to_clean_json(params)
+        return collection.to_clean_json(context)
 
     def get_annotation_es(self, annotation_id, params):
-        if "action" not in params:
-            params["action"] = "see"
-        if "username" not in params:
-            params["username"] = None
+        context = RequestContext(params, action="see")
         # get annotation from index
         annotation = self.get_from_index_if_allowed(annotation_id,
-                                                    username=params["username"],
-                                                    action=params["action"],
+                                                    username=context.username,
+                                                    action=context.action,
                                                     annotation_type="Annotation")
-        return annotation.to_clean_json(params)
+        return annotation.to_clean_json(context)
 
     def get_annotations_es(self, params):
-        # check index is up to date, refresh if needed
-        self.check_index_is_fresh()
         response = self.get_from_index_by_filters(params, annotation_type="Annotation")
-        annotations = [Annotation(hit["_source"]) for hit in response["hits"]["hits"]]
-        if isinstance(response['hits']['total'], dict):
-            # For Elasticsearch version 6 and higher
-            total = response['hits']['total']['value']
-        else:
-            # For Elasticsearch version 5 and lower
-            total = response['hits']['total']
+        annotations = [Annotation.from_store(hit["_source"]) for hit in response["hits"]["hits"]]
+        total = get_hits_total(response)
         return {
             "total": total,
             "annotations": [annotation.to_clean_json(params) for annotation in annotations]
         }
 
+    def get_annotations_page_es(self, params, page_num, page_size):
+        """Fetch a single page of the annotations matching params. Containers use this as callback,
+        so only the page they show is fetched."""
+        return self.get_annotations_es(dict(params, page=page_num, page_size=page_size))["annotations"]
+
+    def get_annotations_by_targets_es(self, target_ids, params):
+        """Get the annotations on any of the target ids, grouped per target id. Target id lists
+        larger than the max_terms_count setting of the index are queried in chunks."""
+        context = RequestContext(params)
+        max_terms_count = self.es_config["max_terms_count"] if "max_terms_count" in self.es_config else 65536
+        target_ids = list(dict.fromkeys(target_ids))
+        annotations = {}
+        for target_ids_chunk in query_helper.chunk_terms(target_ids, max_terms_count):
+            filter_queries = query_helper.make_param_filter_queries({}, annotation_type="Annotation")
+            filter_queries += [query_helper.make_target_list_query({"id": target_ids_chunk}),
+                               query_helper.make_permission_see_query(context)]
+            query = {"query": query_helper.bool_filter(filter_queries)}
+            routing = self.get_read_routing(target_ids_chunk)
+            # an annotation on targets in different chunks is only kept once
+            for hit in scan(self.es, index=self.es_index, query=query, routing=routing):
+                annotations[hit["_id"]] = Annotation.from_store(hit["_source"])
+        targets = {target_id: [] for target_id in target_ids}
+        for annotation in annotations.values():
+            annotation_json = annotation.to_clean_json(context)
+            for target_id in {target["id"] for target in annotation.target_list}:
+                if target_id in targets:
+                    targets[target_id].append(annotation_json)
+        return {
+            "total": len(annotations),
+            "targets": targets
+        }
+
+    def search_annotations_es(self, query_text, params):
+        """Full-text search of annotation bodies, with highlighted snippets per annotation. Pages
+        follow each other through the cursor, which is None after the last page."""
+        context = RequestContext(params)
+        params = self.resolve_hierarchy_filter(params)
+        page_size = get_page_size(params, self.es_config)
+        query = query_helper.make_body_text_search(query_text, params, page_size)
+        response = self.es.search(index=self.es_index, body=query)
+        hits = response["hits"]["hits"]
+        annotations = [Annotation.from_store(hit["_source"]) for hit in hits]
+        highlights = {hit["_id"]: get_highlights(hit) for hit in hits}
+        return {
+            "total": get_hits_total(response),
+            "items": [{"annotation": annotation.to_clean_json(context), "highlights": highlights[annotation.id]}
+                      for annotation in annotations],
+            "cursor": hits[-1]["sort"] if len(hits) == page_size else None
+        }
+
+    def get_annotations_by_target_page_es(self, target_id, params):
+        """Get a page of the annotations on a target that the user can see. Pages follow each other
+        through the cursor, which is None after the last page."""
+        context = RequestContext(params)
+        page_size = get_page_size(params, self.es_config)
+        query = query_helper.make_target_page_search(target_id, params, page_size)
+        routing = self.get_read_routing([target_id])
+        response = self.search_index(query, routing=routing)
+        hits = response["hits"]["hits"]
+        return {
+            "total": get_hits_total(response),
+            "annotations": [Annotation.from_store(hit["_source"]).to_clean_json(context) for hit in hits],
+            "cursor": hits[-1]["sort"] if len(hits) == page_size else None
+        }
+
+    def get_body_texts_by_prefix_es(self, prefix, params, size):
+        """Get the body text of the annotations with a word starting with the prefix, to complete
+        search terms from."""
+        params = self.resolve_hierarchy_filter(params)
+        query = query_helper.make_body_text_prefix_search(prefix, params, size)
+        response = self.es.search(index=self.es_index, body=query)
+        return [hit["_source"]["body_text"] for hit in response["hits"]["hits"] if "body_text" in hit["_source"]]
+
+    def count_annotations_es(self, params):
+        params = self.resolve_hierarchy_filter(params)
+        query = query_helper.make_count_query(params)
+        routing = self.get_read_routing(get_filter_target_ids(params))
+        return self.es.count(index=self.es_index, body=query, routing=routing)["count"]
+
     def get_annotations_by_id_es(self, annotation_ids, params):
-        # check index is up to date, refresh if needed
-        self.check_index_is_fresh()
+        if self.target_routing and annotation_ids:
+            # the shards of the annotations come from the routing index, unknown ones are searched for
+            lookups = self.es.mget(index=self.routing_index, doc_type="Routing", body={"ids": annotation_ids})
+            docs, unknown_ids = make_routing_lookup_docs(annotation_ids, lookups["docs"])
+            sources = {}
+            if docs:
+                response = self.es.mget(index=self.es_index, doc_type="Annotation", body={"docs": docs})
+                sources = {doc["_id"]: doc["_source"] for doc in response["docs"] if doc.get("found")}
+            if unknown_ids:
+                query = {"size": len(unknown_ids), "query": query_helper.make_ids_query(unknown_ids)}
+                hits = self.es.search(index=self.es_index, body=query)["hits"]["hits"]
+                sources.update({hit["_id"]: hit["_source"] for hit in hits})
+            return [sources[annotation_id] for annotation_id in annotation_ids if annotation_id in sources]
         response = self.es.mget(index=self.es_index, doc_type="Annotation", body={"ids": annotation_ids})
         return [hit["_source"] for hit in response["docs"]]
 
     def get_collection_es(self, collection_id, params):
-        if "action" not in params:
-            params["action"] = "see"
-        if "username" not in params:
-            params["username"] = None
+        context = RequestContext(params, action="see")
         # get collection from index
         collection = self.get_from_index_if_allowed(collection_id,
-                                                    username=params["username"],
-                                                    action=params["action"],
+                                                    username=context.username,
+                                                    action=context.action,
                                                     annotation_type="AnnotationCollection")
-        return collection.to_clean_json(params)
+        return collection.to_clean_json(context)
 
     def get_collections_es(self, params):
-        # check index is up to date, refresh if needed
-        self.check_index_is_fresh()
         response = self.get_from_index_by_filters(params, annotation_type="AnnotationCollection")
         collections = [AnnotationCollection(hit["_source"]) for hit in response["hits"]["hits"]]
-        if isinstance(response['hits']['total'], dict):
-            # For Elasticsearch version 6 and higher
-            total = response['hits']['total']['value']
-        else:
-            # For Elasticsearch version 5 and lower
-            total = response['hits']['total']
+        total = get_hits_total(response)
         return {
             "total": total,
             "collections": [collection.to_clean_json(params) for collection in collections]
         }
 
-    def update_annotation_es(self, updated_annotation_json, params):
-        if "action" not in params:
-            params["action"] = "edit"
+    def get_stats_es(self, params):
+        response = self.es.search(index=self.es_index, body=query_helper.make_stats_search(params))
+        return get_stats_from_response(response)
+
+    def update_annotation_es(self, updated_annotation_json, params, refresh=None):
+        context = RequestContext(params, action="edit")
         annotation = self.get_from_index_if_allowed(updated_annotation_json["id"],
-                                                    username=params["username"],
-                                                    action=params["action"],
+                                                    username=context.username,
+                                                    action=context.action,
                                                     annotation_type="Annotation")
         # get copy of original target list
         old_target_list = copy.copy(annotation.to_json()["target_list"])
         # update annotation with new data
         annotation.update(updated_annotation_json)
         # update permissions if given
-        permissions.add_permissions(annotation, params)
-        # update target_list
-        self.add_target_list(annotation)
-        # index updated annotation
-        self.update_in_index(annotation.to_json(), annotation.type)
+        permissions.add_permissions(annotation, context)
+        # update target_list and the other fields derived from the annotation
+        self.add_index_fields(annotation)
+        # index updated annotation, the annotation is no longer on targets it is moved away from
+        self.update_in_index(annotation.to_json(), annotation.type, old_target_list=old_target_list, refresh=refresh)
+        self.record_change("Update", annotation)
         # if target list has changed, annotations targeting this annotation should also be updated
         if target_list_changed(annotation.to_json()["target_list"], old_target_list):
             # updates annotations that target this updated annotation
-            self.update_chained_annotations(annotation.id)
-        # set index needs refresh before next GET
-        self.set_index_needs_refresh()
+            self.update_chained_annotations(annotation.id, refresh=refresh)
         # return annotation to caller
-        return annotation.to_clean_json(params)
+        return annotation.to_clean_json(context)
 
-    def update_chained_annotations(self, annotation_id):
-        # first refresh the index
-        self.es.indices.refresh(index=self.es_index)
+    def update_chained_annotations(self, annotation_id, refresh=None):
+        """Update the target lists of the annotations on an annotation, and of the annotations on
+        those. The updates don't wait for a refresh each, the whole chain is refreshed once."""
         chain_annotations = self.get_from_index_by_target({"id": annotation_id})
         for chain_annotation in chain_annotations:
             if chain_annotation["id"] == annotation_id:
                 raise AnnotationError(message="Annotation cannot target itself")
-            chain_annotation["target_list"] = self.get_target_list(Annotation(chain_annotation))
+            chain_annotation["target_list"] = self.get_target_list(Annotation.from_store(chain_annotation))
             # don't use permission parameters for chained annotations
-            self.update_annotation_es(chain_annotation, params={"username": None, "action": "traverse"})
+            self.update_annotation_es(chain_annotation, params={"username": None, "action": "traverse"},
+                                      refresh="false")
+        if chain_annotations and (refresh or self.write_refresh) != "false":
+            self.index_refresh()
 
     def update_collection_es(self, collection_json):
-        self.should_exist(collection_json["id"], "AnnotationCollection")
         collection = AnnotationCollection(self.get_from_index_by_id(collection_json["id"], "AnnotationCollection"))
         collection.update(collection_json)
         self.update_in_index(collection.to_json(), "AnnotationCollection")
-        # set index needs refresh before next GET
-        self.set_index_needs_refresh()
+        self.record_change("Update", collection)
         return collection.to_json()
 
     def remove_annotation_es(self, annotation_id, params):
-        if params and "action" not in params:
-            params["action"] = "edit"
+        context = RequestContext(params, action="edit")
         # remove annotation from index
-        self.remove_from_index_if_allowed(annotation_id, params, annotation_type="Annotation")
+        annotation = self.remove_from_index_if_allowed(annotation_id, context, annotation_type="Annotation")
         # replace with deleted annotation with same id
-        deleted_annotation = {
-            "id": annotation_id,
-            "type": "Annotation",
-            "status": "deleted"
-        }
+        deleted_annotation = make_tombstone(annotation_id, "Annotation")
         self.add_to_index(deleted_annotation, "Annotation")
+        self.record_change("Delete", annotation)
         # updates annotations that target this deleted annotation
         self.update_chained_annotations(annotation_id)
         return deleted_annotation
 
     def remove_annotation_from_collection_es(self, annotation_id, collection_id, params):
+        context = RequestContext(params)
         # check that user is allowed to edit collection
         collection = self.get_from_index_if_allowed(collection_id,
-                                                    username=params["username"],
+                                                    username=context.username,
                                                     action="edit",
                                                     annotation_type="AnnotationCollection")
         # check if collection contains annotation
@@ -281,36 +674,131 @@ class AnnotationStore(object):
             raise AnnotationError(message="Collection doesn't contain this annotation")
         # check that user is allowed to see annotation
         self.get_from_index_if_allowed(annotation_id,
-                                       username=params["username"],
+                                       username=context.username,
                                        action="see",
                                        annotation_type="Annotation")
         # remove annotation
         collection.remove_annotation(annotation_id)
         self.update_in_index(collection.to_json(), "AnnotationCollection")
+        self.record_change("Update", collection)
         # return collection metadata
         return collection.to_json()
 
     def remove_collection_es(self, collection_id, params):
+        context = RequestContext(params)
         # check that user is allowed to edit collection
-        self.get_from_index_if_allowed(collection_id,
-                                       username=params["username"],
-                                       action="edit",
-                                       annotation_type="AnnotationCollection")
-        # check index is up to date, refresh if needed
-        self.check_index_is_fresh()
-        # check if collection already exists
-        self.should_exist(collection_id, "AnnotationCollection")
+        collection = self.get_from_index_if_allowed(collection_id,
+                                                    username=context.username,
+                                                    action="edit",
+                                                    annotation_type="AnnotationCollection")
         # remove collection from index
         self.remove_from_index(collection_id, "AnnotationCollection")
         # replace with deleted collection with same id
-        deleted_collection = {
-            "id": collection_id,
-            "type": "AnnotationCollection",
-            "status": "deleted"
-        }
+        deleted_collection = make_tombstone(collection_id, "AnnotationCollection")
         self.add_to_index(deleted_collection, "AnnotationCollection")
+        self.record_change("Delete", collection)
         return deleted_collection
 
+    def purge_tombstones_es(self, retention_days=None, include_undated=False, dry_run=False):
+        """Delete the tombstones of annotations and collections that were deleted longer than the
+        retention period ago, in a single delete-by-query. After purging, their ids can be reused.
+        Returns the number of purged (or, for a dry run, purgeable) tombstones."""
+        if retention_days is None:
+            retention_days = self.es_config["tombstone_retention_days"] \
+                if "tombstone_retention_days" in self.es_config else default_tombstone_retention_days
+        deleted_before = datetime.datetime.now(pytz.utc) - datetime.timedelta(days=retention_days)
+        query = {"query": query_helper.make_tombstone_query(deleted_before.isoformat(), include_undated)}
+        if dry_run:
+            return self.es.count(index=self.es_index, body=query)["count"]
+        # tombstones aren't written after deletion, so conflicts only come from concurrent purges
+        response = self.es.delete_by_query(index=self.es_index, body=query, conflicts="proceed", refresh=True)
+        return response["deleted"]
+
+    def get_index_versions(self):
+        """Get the versioned indices of the annotation index, oldest first."""
+        indices = self.es.indices.get(index=self.es_index + "_v*")
+        return sorted(indices.keys(), key=lambda index: int(index.rsplit("_v", 1)[1]))
+
+    def get_aliased_indices(self):
+        """Get the indices behind the annotation index alias. Before the first reindex, the
+        annotation index is a concrete index without alias."""
+        if not self.es.indices.exists_alias(name=self.es_index):
+            return []
+        return list(self.es.indices.get_alias(name=self.es_index).keys())
+
+    def create_index_version(self):
+        """Create the next version of the annotation index, with the mapping and shard settings of
+        the current configuration."""
+        versions = self.get_index_versions()
+        version = int(versions[-1].rsplit("_v", 1)[1]) + 1 if versions else 1
+        new_index = "%s_v%d" % (self.es_index, version)
+        self.put_index_template()
+        self.es.indices.create(index=new_index)
+        return new_index
+
+    def start_dual_write(self, new_index):
+        self.es.indices.put_alias(index=new_index, name=self.es_index + "_next")
+
+    def start_reindex(self, new_index, slices="auto"):
+        """Copy the annotation index into the new index in parallel slices, as a background task.
+        Documents that are already in the new index through dual writes are newer, so they are not
+        overwritten. Returns the task id."""
+        body = {
+            "conflicts": "proceed",
+            "source": {"index": self.es_index},
+            "dest": {"index": new_index, "op_type": "create"}
+        }
+        response = self.es.reindex(body=body, slices=slices, wait_for_completion=False, refresh=True)
+        return response["task"]
+
+    def copy_to_index(self, new_index, slices=4):
+        """Copy the annotation index into the new index with sliced scrolls in parallel, routing
+        each annotation by the current configuration instead of keeping its stored routing. Returns
+        the number of copied documents."""
+        def copy_slice(slice_id):
+            query = {"slice": {"id": slice_id, "max": slices}, "query": {"match_all": {}}}
+            hits = scan(self.es, index=self.es_index, query=query)
+            actions = (action for hit in hits for action in self.make_copy_actions(new_index, hit))
+            results = streaming_bulk(self.es, actions, raise_on_error=False)
+            return sum(1 for ok, item in results if ok and "create" in item)
+
+        with ThreadPoolExecutor(max_workers=slices) as executor:
+            copied = sum(executor.map(copy_slice, range(slices)))
+        self.es.indices.refresh(index=new_index)
+        return copied
+
+    def make_copy_actions(self, new_index, hit):
+        actions = [self.make_create_action(new_index, hit["_source"], hit["_type"])]
+        if self.target_routing:
+            # reads of annotations that are not in the new index yet fall back to a search
+            actions += self.make_routing_actions(hit["_source"])
+        return actions
+
+    def get_reindex_task(self, task_id):
+        # the status has the progress, the response the failures once the task is completed
+        return self.es.tasks.get(task_id=task_id)
+
+    def switch_alias(self, new_index, delete_original=False):
+        """Point the annotation index alias to the new index and stop dual writes, in one atomic
+        update. If the annotation index is still a concrete index, the alias can only take its name
+        by deleting it, which can't be rolled back, so that needs delete_original."""
+        actions = [{"add": {"index": new_index, "alias": self.es_index}}]
+        aliased_indices = self.get_aliased_indices()
+        if aliased_indices:
+            actions += [{"remove": {"index": index, "alias": self.es_index}}
+                        for index in aliased_indices if index != new_index]
+        elif self.es.indices.exists(index=self.es_index):
+            if not delete_original:
+                raise RuntimeError("%s is a concrete index, which the alias replaces by deleting it, "
+                                   "confirm with --delete-original" % self.es_index)
+            actions += [{"remove_index": {"index": self.es_index}}]
+        next_alias = self.es_index + "_next"
+        if self.es.indices.exists_alias(name=next_alias):
+            actions += [{"remove": {"index": index, "alias": next_alias}}
+                        for index in self.es.indices.get_alias(name=next_alias)]
+        self.es.indices.update_aliases(body={"actions": actions})
+        return aliased_indices
+
     ####################
     # Helper functions #
     ####################
@@ -326,7 +814,7 @@ class AnnotationStore(object):
                     continue
                 target_annotation = self.get_annotation_es(target['id'],
                                                            params={"username": None, "action": "traverse"})
-                deeper_targets += self.get_target_list(Annotation(target_annotation))
+                deeper_targets += self.get_target_list(Annotation.from_store(target_annotation))
         target_ids = [target["id"] for target in target_list]
         for target in deeper_targets:
             if target not in target_ids:
@@ -334,9 +822,46 @@ class AnnotationStore(object):
                 target_ids += [target["id"]]
         return target_list
 
+    def add_index_fields(self, annotation):
+        # create target_list for easy target-based retrieval
+        self.add_target_list(annotation)
+        # store target ancestors for hierarchy-based retrieval
+        self.add_target_hierarchy(annotation)
+        # store bounding boxes of image regions and text and time ranges for overlap-based retrieval
+        self.add_target_regions(annotation)
+        self.add_target_ranges(annotation)
+        # store body text per language for full-text search
+        self.add_body_text(annotation)
+
     def add_target_list(self, annotation):
         annotation.target_list = self.get_target_list(annotation)
 
+    def add_target_hierarchy(self, annotation):
+        annotation.target_hierarchy = annotation.get_target_hierarchy()
+
+    def add_target_regions(self, annotation):
+        annotation.target_regions = annotation.get_target_regions()
+
+    def add_target_ranges(self, annotation):
+        annotation.target_ranges = annotation.get_target_ranges()
+
+    def add_body_text(self, annotation):
+        annotation.body_text = get_body_text(annotation)
+
+    def get_target_ancestors(self, target_id):
+        """Look up the ancestors of a resource in the target hierarchy of any annotation on or inside it."""
+        response = self.es.search(index=self.es_index, body=query_helper.make_hierarchy_lookup_search(target_id))
+        return get_ancestors_from_response(response, target_id)
+
+    def resolve_hierarchy_filter(self, params):
+        """Replace the ancestors_of filter with the ancestor ids it refers to, which have to be looked up."""
+        resource_ids = get_ancestors_of(params)
+        if resource_ids is None:
+            return params
+        ancestor_ids = [ancestor_id for target_id in resource_ids
+                        for ancestor_id in self.get_target_ancestors(target_id)]
+        return add_ancestor_ids(params, ancestor_ids)
+
     ###################
     # ES interactions #
     ###################
@@ -345,92 +870,306 @@ class AnnotationStore(object):
         should_have_target_list(annotation)
         should_have_permissions(annotation)
         self.should_not_exist(annotation['id'], annotation_type)
-        return self.es.index(index=self.es_index, doc_type=annotation_type, id=annotation['id'], body=annotation)
+        self.store_routing(annotation)
+        # by default, wait until the change is visible to search, so no request needs to track pending refreshes
+        response = self.es.index(index=self.es_index, doc_type=annotation_type, id=annotation['id'], body=annotation,
+                                 routing=self.get_write_routing(annotation), refresh=self.write_refresh)
+        dual_write_index = self.get_dual_write_index()
+        if dual_write_index:
+            self.dual_write(self.es.index, index=dual_write_index, doc_type=annotation_type, id=annotation['id'],
+                            body=annotation, routing=self.get_write_routing(annotation))
+        self.bump_write_generation()
+        self.notify_write(annotation.get("target_list"))
+        return response
+
+    def dual_write(self, write, **kwargs):
+        """Repeat a write in the index that a reindex copies to. The write to the annotation index
+        already succeeded, so a failure here is logged instead of failing the request. The new index
+        then misses the change and the reindex has to be repeated before switching to it."""
+        try:
+            write(**kwargs)
+        except TransportError as error:
+            logger.error("dual write of %s to %s failed: %s", kwargs["id"], kwargs["index"], error)
+
+    def get_write_routing(self, annotation):
+        return get_routing(annotation) if self.target_routing else None
+
+    def store_routing(self, annotation):
+        if self.target_routing:
+            bulk(self.es, self.make_routing_actions(annotation))
+
+    def make_routing_actions(self, annotation):
+        """Keep the routing of an annotation by its id, and add it to the routing entries of its other
+        targets, so routed queries on those targets also search its shard."""
+        routing = self.get_write_routing(annotation)
+        actions = [{
+            "_index": self.routing_index,
+            "_type": "Routing",
+            "_id": annotation["id"],
+            "_source": {"routing": routing}
+        }]
+        target_ids = {target["id"] for target in annotation.get("target_list") or []}
+        for target_id in sorted(target_ids):
+            if make_routing_key(target_id) != routing:
+                actions += [{
+                    "_op_type": "update",
+                    "_index": self.routing_index,
+                    "_type": "Routing",
+                    "_id": make_target_routing_id(target_id),
+                    "_retry_on_conflict": 3,
+                    "script": {"source": add_routing_script, "params": {"routing": routing}},
+                    "upsert": {"routing": [routing]}
+                }]
+        return actions
+
+    def get_read_routing(self, target_ids):
+        lookup_ids = make_target_routing_lookup_ids(target_ids) if self.target_routing else None
+        if not lookup_ids:
+            return None
+        lookups = self.es.mget(index=self.routing_index, doc_type="Routing", body={"ids": lookup_ids})
+        return make_read_routing(target_ids, lookups["docs"])
+
+    def get_document(self, annotation_id, annotation_type="_all", source_includes=None):
+        """Get a document by id, or None if it doesn't exist. With target routing, the shard of a
+        document isn't known from its id, so its routing is taken from the routing index first.
+        Documents without routing entry, e.g. indexed before the routing index existed, are looked
+        up with a search on all shards."""
+        routing = None
+        if self.target_routing:
+            lookup = self.es.get(index=self.routing_index, doc_type="Routing", id=annotation_id, ignore=404)
+            if not lookup.get("found"):
+                return self.search_document(annotation_id, annotation_type, source_includes)
+            routing = lookup["_source"]["routing"]
+        response = self.es.get(index=self.es_index, doc_type=annotation_type, id=annotation_id, routing=routing,
+                               _source_includes=source_includes, ignore=404)
+        if response.get("found"):
+            return response
+        # a reroute may have moved the document before its routing entry was updated
+        return self.search_document(annotation_id, annotation_type, source_includes) if self.target_routing else None
+
+    def search_document(self, annotation_id, annotation_type="_all", source_includes=None):
+        query = query_helper.make_document_search(annotation_id, annotation_type, source_includes)
+        hits = self.es.search(index=self.es_index, body=query)["hits"]["hits"]
+        return hits[0] if hits else None
+
+    def next_change_sequence(self, count=1):
+        """Take the next count numbers of the change log sequence and return the last one. The
+        counter is updated by a script, so concurrent writers in any server process get distinct,
+        increasing numbers."""
+        script = {"source": "ctx._source.value += params.count", "params": {"count": count}}
+        response = self.es.update(index=self.changes_index, doc_type="Change", id="sequence",
+                                  body={"script": script, "upsert": {"value": count}},
+                                  retry_on_conflict=100, _source="value")
+        return response["get"]["_source"]["value"]
+
+    def record_change(self, activity_type, annotation):
+        self.record_changes(activity_type, [annotation])
+
+    def record_changes(self, activity_type, annotations):
+        """Log the changes of annotations with one block of sequence numbers and one bulk request."""
+        if not annotations:
+            return
+        first_seq = self.next_change_sequence(count=len(annotations)) - len(annotations) + 1
+        changes = [make_change(first_seq + offset, activity_type, annotation)
+                   for offset, annotation in enumerate(annotations)]
+        actions = [{"_index": self.changes_index, "_type": "Change", "_id": change["seq"], "_source": change}
+                   for change in changes]
+        # not waiting for a refresh, readers of the log hold back changes for the settle time anyway
+        bulk(self.es, actions)
+
+    def get_changes_es(self, since, params, until=None, target_ids=None):
+        """Get the changes after sequence number since, in order, of annotations and collections
+        the user can see."""
+        query = make_changes_query(since, params, self.es_config, until=until, target_ids=target_ids)
+        response = self.es.search(index=self.changes_index, body=query)
+        return [hit["_source"] for hit in response["hits"]["hits"]]
+
+    def get_missed_changes_es(self, since, until, target_ids, params):
+        """Get all changes on the targets after sequence number since, up to until, page by page,
+        for an event subscriber that reconnects."""
+        changes = []
+        while since < until:
+            page = self.get_changes_es(since, params, until=until, target_ids=target_ids)
+            changes += page
+            if len(page) < get_page_size(params, self.es_config):
+                break
+            since = page[-1]["seq"]
+        return changes
+
+    def get_all_changes_es(self, since, size):
+        """Get the changes after sequence number since, in order and without permission filter, for
+        dispatching them to subscribers."""
+        query = {
+            "size": size,
+            "query": query_helper.bool_filter([{"range": {"seq": {"gt": since}}}]),
+            "sort": [{"seq": "asc"}]
+        }
+        response = self.es.search(index=self.changes_index, body=query)
+        return [hit["_source"] for hit in response["hits"]["hits"]]
+
+    def get_last_change_sequence(self):
+        if not self.es.exists(index=self.changes_index, doc_type="Change", id="sequence"):
+            return 0
+        return self.es.get(index=self.changes_index, doc_type="Change", id="sequence")["_source"]["value"]
 
     def add_bulk_to_index(self, annotations, annotation_type):
-        raise ValueError("Function not yet implemented")
+        """Index annotations in one request. Returns the number of indexed annotations and the
+        errors of the others."""
+        for annotation in annotations:
+            should_have_target_list(annotation)
+            should_have_permissions(annotation)
+        actions = [self.make_create_action(self.es_index, annotation, annotation_type) for annotation in annotations]
+        result = bulk(self.es, actions, refresh=self.write_refresh, raise_on_error=False)
+        failed_ids = {error["create"]["_id"] for error in result[1]}
+        if self.target_routing:
+            bulk(self.es, [action for annotation in annotations if annotation["id"] not in failed_ids
+                           for action in self.make_routing_actions(annotation)])
+        dual_write_index = self.get_dual_write_index()
+        if dual_write_index:
+            # only new ids are created, so the copy succeeds for the annotations indexed above
+            actions = [self.make_create_action(dual_write_index, annotation, annotation_type)
+                       for annotation in annotations if annotation["id"] not in failed_ids]
+            for error in bulk(self.es, actions, raise_on_error=False)[1]:
+                # a conflict means the reindex already copied the annotation
+                if error["create"]["status"] != 409:
+                    logger.error("dual write of %s to %s failed: %s", error["create"]["_id"], dual_write_index,
+                                 error["create"].get("error"))
+        self.bump_write_generation()
+        for annotation in annotations:
+            self.notify_write(annotation.get("target_list"))
+        return result
+
+    def make_create_action(self, index, annotation, annotation_type):
+        action = {
+            "_op_type": "create",
+            "_index": index,
+            "_type": annotation_type,
+            "_id": annotation["id"],
+            "_source": annotation
+        }
+        routing = self.get_write_routing(annotation)
+        if routing:
+            action["_routing"] = routing
+        return action
 
     def get_from_index_if_allowed(self, annotation_id, username, action, annotation_type="_all"):
-        # check index is up to date, refresh if needed
-        self.check_index_is_fresh()
-        # check that annotation exists (and is not deleted)
-        self.should_exist(annotation_id, annotation_type)
-        # get original annotation json
-        annotation_json = self.get_from_index_by_id(annotation_id, annotation_type)
-        annotation = Annotation(annotation_json) if annotation_json["type"] == "Annotation" else AnnotationCollection(
-            annotation_json)
+        # get original annotation json, if the annotation exists (and is not deleted)
+        annotation = make_annotation_or_collection(self.get_from_index_by_id(annotation_id, annotation_type))
         # check if user has appropriate permissions
-        if not permissions.is_allowed_action(username, action, annotation):
-            raise PermissionError(message="Unauthorized access - no permission to {a} annotation".format(a=action))
+        should_be_allowed(username, action, annotation)
         return annotation
 
     def get_from_index_by_id(self, annotation_id, annotation_type="_all"):
-        self.should_exist(annotation_id, annotation_type)
-        return self.es.get(index=self.es_index, doc_type=annotation_type, id=annotation_id)['_source']
+        return self.get_existing_document(annotation_id, annotation_type)['_source']
+
+    def get_existing_document(self, annotation_id, annotation_type="_all", source_includes=None):
+        """Get a document that exists and is not deleted, so its status and content come from a
+        single fetch."""
+        document = self.get_document(annotation_id, annotation_type, source_includes=source_includes)
+        get_existing_source(annotation_id, document, annotation_type)
+        return document
 
     def get_from_index_by_filters(self, params, annotation_type="_all"):
-        filter_queries = query_helper.make_param_filter_queries(params, annotation_type)
-        filter_queries += [query_helper.make_permission_see_query(params)]
-        query = {
-            "from": params["page"] * self.es_config["page_size"],
-            "size": self.es_config["page_size"],
-            "query": query_helper.bool_must(filter_queries)
-        }
-        return self.es.search(index=self.es_index, body=query)
+        params = self.resolve_hierarchy_filter(params)
+        query = query_helper.make_filters_search(params, get_page_size(params, self.es_config), annotation_type)
+        routing = self.get_read_routing(get_filter_target_ids(params))
+        return self.search_index(query, routing=routing)
 
     def get_from_index_by_target(self, target):
         target_list_query = query_helper.make_target_list_query(target)
-        query = {"query": query_helper.bool_must([target_list_query])}
-        response = self.es.search(index=self.es_index, body=query)
+        query = {"query": query_helper.bool_must([target_list_query, query_helper.make_not_deleted_query()])}
+        response = self.es.search(index=self.es_index, body=query, routing=self.get_read_routing([target["id"]]))
         return [hit["_source"] for hit in response['hits']['hits']]
 
     def get_from_index_by_target_list(self, target, params):
         target_list_query = query_helper.make_target_list_query(target)
         permission_query = query_helper.make_permission_see_query(params)
         query = {"query": query_helper.bool_must([target_list_query, permission_query])}
-        response = self.es.search(index=self.es_index, body=query)
+        routing = self.get_read_routing([target["id"]]) if "id" in target else None
+        response = self.es.search(index=self.es_index, body=query, routing=routing)
         return [hit["_source"] for hit in response['hits']['hits']]
 
-    def update_in_index(self, annotation, annotation_type):
+    def update_in_index(self, annotation, annotation_type, old_target_list=None, refresh=None):
         should_have_target_list(annotation)
         should_have_permissions(annotation)
-        self.should_exist(annotation['id'], annotation_type)
-        return self.es.index(index=self.es_index, doc_type=annotation_type, id=annotation['id'], body=annotation)
+        # the stored document shows both that it exists and which shard it is on
+        document = self.get_existing_document(annotation['id'], annotation_type, source_includes=["status"])
+        routing = self.get_write_routing(annotation)
+        stored_routing = document.get("_routing")
+        dual_write_index = self.get_dual_write_index()
+        target_list = annotation.get("target_list") or []
+        targets_changed = target_list and (old_target_list is None or target_list_changed(old_target_list, target_list))
+        if stored_routing != routing or targets_changed:
+            # a new target needs the routing in its entry, even if the primary target stayed the same
+            self.store_routing(annotation)
+        if stored_routing != routing:
+            # the target changed, indexing with the new routing would leave the old version on its shard, so
+            # the old version is deleted in the same request, and one refresh makes both changes visible
+            document = {"_index": self.es_index, "_type": annotation_type, "_id": annotation['id']}
+            actions = [dict(document, _op_type="delete", _routing=stored_routing),
+                       dict(document, _op_type="index", _routing=routing, _source=annotation)]
+            bulk(self.es, actions, refresh=refresh or self.write_refresh)
+            response = {"_id": annotation['id'], "result": "updated"}
+            if dual_write_index:
+                self.dual_write(self.es.delete, index=dual_write_index, doc_type=annotation_type, id=annotation['id'],
+                                routing=stored_routing, ignore=404)
+        else:
+            response = self.es.index(index=self.es_index, doc_type=annotation_type, id=annotation['id'],
+                                     body=annotation, routing=routing, refresh=refresh or self.write_refresh)
+        if dual_write_index:
+            self.dual_write(self.es.index, index=dual_write_index, doc_type=annotation_type, id=annotation['id'],
+                            body=annotation, routing=routing)
+        self.bump_write_generation()
+        # the targets the annotation was moved away from changed too
+        self.notify_write((old_target_list or []) + (annotation.get("target_list") or []))
+        return response
 
     def remove_from_index(self, annotation_id, annotation_type):
-        self.should_exist(annotation_id, annotation_type)
-        return self.es.delete(index=self.es_index, doc_type=annotation_type, id=annotation_id)
+        document = self.get_existing_document(annotation_id, annotation_type, source_includes=["status"])
+        routing = document.get("_routing")
+        # the tombstone that replaces the document is written with wait_for, which also makes the delete
+        # visible, unless the document is routed to another shard than the tombstone
+        response = self.es.delete(index=self.es_index, doc_type=annotation_type, id=annotation_id, routing=routing,
+                                  refresh=self.write_refresh if routing else "false")
+        dual_write_index = self.get_dual_write_index()
+        if dual_write_index:
+            # the reindex may not have copied the annotation yet
+            self.dual_write(self.es.delete, index=dual_write_index, doc_type=annotation_type, id=annotation_id,
+                            routing=routing, ignore=404)
+        self.bump_write_generation()
+        return response
 
     def remove_from_index_if_allowed(self, annotation_id, params, annotation_type="_all"):
-        if "username" not in params:
-            params["username"] = None
-        # check index is up to date, refresh if needed
-        self.check_index_is_fresh()
-        # check that annotation exists (and is not deleted)
-        self.should_exist(annotation_id, annotation_type)
-        # get original annotation json
+        context = RequestContext(params, action="edit")
+        # get original annotation json, if the annotation exists (and is not deleted)
         annotation_json = self.get_from_index_by_id(annotation_id, annotation_type)
         # check if user has appropriate permissions
-        if not permissions.is_allowed_action(params["username"], "edit", Annotation(annotation_json)):
+        annotation = Annotation.from_store(annotation_json)
+        if not permissions.is_allowed_action(context.username, "edit", annotation):
             raise PermissionError(
-                message="Unauthorized access - no permission to {a} annotation".format(a=params["action"]))
-        return self.remove_from_index(annotation_id, "Annotation")
+                message="Unauthorized access - no permission to {a} annotation".format(a=context.action))
+        self.remove_from_index(annotation_id, "Annotation")
+        self.notify_write(annotation.target_list)
+        return annotation
+
+    def get_status(self, annotation_id, annotation_type="_all"):
+        # a single lookup of only the status field, None if there is no document with this id
+        document = self.get_document(annotation_id, annotation_type, source_includes=["status"])
+        if not document:
+            return None
+        source = document["_source"] if "_source" in document else {}
+        return source["status"] if "status" in source else "active"
 
     def is_deleted(self, annotation_id, annotation_type="_all"):
-        if self.es.exists(index=self.es_index, doc_type=annotation_type, id=annotation_id):
-            res = self.es.get(index=self.es_index, doc_type=annotation_type, id=annotation_id)
-            if "status" in res["_source"] and res["_source"]["status"] == "deleted":
-                return True
-        return False
+        return self.get_status(annotation_id, annotation_type) == "deleted"
 
     def should_exist(self, annotation_id, annotation_type="_all"):
-        if self.es.exists(index=self.es_index, doc_type=annotation_type, id=annotation_id):
-            if not self.is_deleted(annotation_id, annotation_type):
-                return True
+        if self.get_status(annotation_id, annotation_type) not in [None, "deleted"]:
+            return True
         raise AnnotationError(message="Annotation with id %s does not exist" % annotation_id, status_code=404)
 
     def should_not_exist(self, annotation_id, annotation_type="_all"):
-        if self.es.exists(index=self.es_index, doc_type=annotation_type, id=annotation_id):
+        if self.get_status(annotation_id, annotation_type) is not None:
             raise AnnotationError(message="Annotation with id %s already exists" % annotation_id)
         else:
             return True
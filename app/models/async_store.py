@@ -0,0 +1,250 @@
+from typing import Dict, Union
+import asyncio
+from elasticsearch import AIOHttpConnection, AsyncElasticsearch
+from elasticsearch.exceptions import NotFoundError
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, BadSignature, SignatureExpired
+from models.annotation import Annotation
+from models.annotation_store import add_ancestor_ids, get_ancestors_from_response, get_ancestors_of, \
+    get_changes_index, get_existing_source, get_filter_target_ids, get_hits_total, get_page_size, get_routing_index, \
+    get_stats_from_response, make_annotation_or_collection, make_changes_query, make_read_routing, \
+    make_routing_lookup_docs, make_target_routing_lookup_ids, should_be_allowed, use_target_routing
+from models.backend_calls import AccountingMixin, InstrumentedClient
+from models.error import UserError
+from models.query_cache import QueryCache, SharedGeneration
+from models.request_context import RequestContext
+from models.user import User
+import models.queries as query_helper
+
+
+class AsyncAccountingConnection(AccountingMixin, AIOHttpConnection):
+    pass
+
+
+def make_async_client(es_config: Dict[str, Union[str, int]]) -> InstrumentedClient:
+    # a single client per worker, its connection pool bounds the number of in-flight ES requests
+    maxsize = es_config["async_maxsize"] if "async_maxsize" in es_config else 100
+    return InstrumentedClient(AsyncElasticsearch([{"host": es_config['host'], "port": es_config['port']}],
+                                                 maxsize=maxsize, connection_class=AsyncAccountingConnection),
+                              is_async=True)
+
+
+class AsyncAnnotationStore(object):
+    """Read-only counterpart of AnnotationStore for the ASGI server. Writes keep going through
+    the WSGI app, so this store never mutates the index. The queries come from the same builders
+    as those of AnnotationStore. Given the query cache of the AnnotationStore of the process, writes
+    through the WSGI app invalidate the results cached here too."""
+
+    def __init__(self, es_config: Dict[str, Union[str, int]], es: Union[None, InstrumentedClient] = None,
+                 query_cache: Union[None, QueryCache] = None):
+        self.es_config = es_config
+        self.es_index = es_config['annotation_index']
+        self.changes_index = get_changes_index(es_config)
+        self.routing_index = get_routing_index(es_config)
+        self.target_routing = use_target_routing(es_config)
+        self.es = es if es else make_async_client(es_config)
+        self.query_cache = query_cache
+
+    async def close(self):
+        await self.es.close()
+
+    async def get_annotation_es(self, annotation_id, params):
+        context = RequestContext(params, action="see")
+        annotation = await self.get_from_index_if_allowed(annotation_id,
+                                                          username=context.username,
+                                                          action=context.action,
+                                                          annotation_type="Annotation")
+        return annotation.to_clean_json(context)
+
+    async def get_annotations_es(self, params):
+        response = await self.get_from_index_by_filters(params, annotation_type="Annotation")
+        annotations = [Annotation.from_store(hit["_source"]) for hit in response["hits"]["hits"]]
+        return {
+            "total": get_hits_total(response),
+            "annotations": [annotation.to_clean_json(params) for annotation in annotations]
+        }
+
+    async def count_annotations_es(self, params):
+        params = await self.resolve_hierarchy_filter(params)
+        query = query_helper.make_count_query(params)
+        routing = await self.get_read_routing(get_filter_target_ids(params))
+        response = await self.es.count(index=self.es_index, body=query, routing=routing)
+        return response["count"]
+
+    async def get_annotations_by_id_es(self, annotation_ids, params):
+        if not annotation_ids:
+            return []
+        if self.target_routing:
+            lookups = await self.es.mget(index=self.routing_index, body={"ids": annotation_ids})
+            docs, unknown_ids = make_routing_lookup_docs(annotation_ids, lookups["docs"])
+            sources = {}
+            if docs:
+                response = await self.es.mget(index=self.es_index, body={"docs": docs})
+                sources = {doc["_id"]: doc["_source"] for doc in response["docs"] if doc.get("found")}
+            if unknown_ids:
+                query = {"size": len(unknown_ids), "query": query_helper.make_ids_query(unknown_ids)}
+                response = await self.es.search(index=self.es_index, body=query)
+                sources.update({hit["_id"]: hit["_source"] for hit in response["hits"]["hits"]})
+            return [sources[annotation_id] for annotation_id in annotation_ids if annotation_id in sources]
+        response = await self.es.mget(index=self.es_index, body={"ids": annotation_ids})
+        return [doc["_source"] for doc in response["docs"] if doc["found"]]
+
+    async def get_collection_es(self, collection_id, params):
+        context = RequestContext(params, action="see")
+        collection = await self.get_from_index_if_allowed(collection_id,
+                                                          username=context.username,
+                                                          action=context.action,
+                                                          annotation_type="AnnotationCollection")
+        return collection.to_clean_json(context)
+
+    async def get_stats_es(self, params):
+        response = await self.es.search(index=self.es_index, body=query_helper.make_stats_search(params))
+        return get_stats_from_response(response)
+
+    async def get_changes_es(self, since, params, until=None, target_ids=None):
+        query = make_changes_query(since, params, self.es_config, until=until, target_ids=target_ids)
+        response = await self.es.search(index=self.changes_index, body=query)
+        return [hit["_source"] for hit in response["hits"]["hits"]]
+
+    async def get_missed_changes_es(self, since, until, target_ids, params):
+        changes = []
+        while since < until:
+            page = await self.get_changes_es(since, params, until=until, target_ids=target_ids)
+            changes += page
+            if len(page) < get_page_size(params, self.es_config):
+                break
+            since = page[-1]["seq"]
+        return changes
+
+    ###################
+    # ES interactions #
+    ###################
+
+    async def get_from_index_if_allowed(self, annotation_id, username, action, annotation_type):
+        document = await self.get_document(annotation_id)
+        annotation = make_annotation_or_collection(get_existing_source(annotation_id, document, annotation_type))
+        should_be_allowed(username, action, annotation)
+        return annotation
+
+    async def get_document(self, annotation_id):
+        routing = None
+        if self.target_routing:
+            # the shard of a routed document comes from the routing index
+            try:
+                routing = (await self.es.get(index=self.routing_index, id=annotation_id))["_source"]["routing"]
+            except NotFoundError:
+                return await self.search_document(annotation_id)
+        try:
+            return await self.es.get(index=self.es_index, id=annotation_id, routing=routing)
+        except NotFoundError:
+            # a reroute may have moved the document before its routing entry was updated
+            return await self.search_document(annotation_id) if self.target_routing else None
+
+    async def get_read_routing(self, target_ids):
+        lookup_ids = make_target_routing_lookup_ids(target_ids) if self.target_routing else None
+        if not lookup_ids:
+            return None
+        lookups = await self.es.mget(index=self.routing_index, body={"ids": lookup_ids})
+        return make_read_routing(target_ids, lookups["docs"])
+
+    async def search_document(self, annotation_id):
+        query = query_helper.make_document_search(annotation_id)
+        response = await self.es.search(index=self.es_index, body=query)
+        hits = response["hits"]["hits"]
+        return hits[0] if hits else None
+
+    async def get_target_ancestors(self, target_id):
+        response = await self.es.search(index=self.es_index, body=query_helper.make_hierarchy_lookup_search(target_id))
+        return get_ancestors_from_response(response, target_id)
+
+    async def resolve_hierarchy_filter(self, params):
+        resource_ids = get_ancestors_of(params)
+        if resource_ids is None:
+            return params
+        ancestor_ids = [ancestor_id for target_id in resource_ids
+                        for ancestor_id in await self.get_target_ancestors(target_id)]
+        return add_ancestor_ids(params, ancestor_ids)
+
+    async def get_from_index_by_filters(self, params, annotation_type="_all"):
+        params = await self.resolve_hierarchy_filter(params)
+        query = query_helper.make_filters_search(params, get_page_size(params, self.es_config), annotation_type)
+        routing = await self.get_read_routing(get_filter_target_ids(params))
+        return await self.search_index(query, routing=routing)
+
+    async def search_index(self, query, routing=None):
+        """Search through the query cache, like AnnotationStore.search_index, but with the
+        generation of other processes read by this store, so the event loop isn't blocked."""
+        if not self.query_cache:
+            return await self.es.search(index=self.es_index, body=query, routing=routing)
+        if await self.follow_shared_generation(self.query_cache.shared_generation):
+            self.query_cache.invalidate()
+        key = self.query_cache.make_key(self.es_index, query, routing)
+        response = self.query_cache.get(key)
+        if response is None:
+            response = await self.es.search(index=self.es_index, body=query, routing=routing)
+            self.query_cache.set(key, response)
+        return response
+
+    async def follow_shared_generation(self, shared_generation: Union[None, SharedGeneration]) -> bool:
+        """Whether writes through other processes changed the shared generation of a cache."""
+        if not shared_generation or not shared_generation.is_due():
+            return False
+        return shared_generation.update(await self.get_last_change_sequence())
+
+    async def get_last_change_sequence(self):
+        try:
+            response = await self.es.get(index=self.changes_index, id="sequence")
+        except NotFoundError:
+            return 0
+        return response["_source"]["value"]
+
+    def get_query_cache_metrics(self):
+        return self.query_cache.get_metrics() if self.query_cache else None
+
+
+class AsyncUserStore(object):
+    """Authentication lookups of UserStore on the async client. Password hashing is CPU bound,
+    so it runs in the default executor to keep the event loop free."""
+
+    def __init__(self, es_config: Dict[str, Union[str, int]], es: Union[None, InstrumentedClient] = None):
+        self.secret_key = "some combination of key words"
+        if "secret_key" in es_config:
+            self.secret_key = es_config["secret_key"]
+        self.es_config = es_config
+        self.es_index = es_config['user_index']
+        self.es = es if es else make_async_client(es_config)
+
+    async def close(self):
+        await self.es.close()
+
+    async def get_user_from_index(self, username=None, user_id=None):
+        if not username and not user_id:
+            return None
+        if user_id:
+            try:
+                response = await self.es.get(index=self.es_index, id=user_id)
+            except NotFoundError:
+                raise UserError("User {u} doesn't exist".format(u=user_id))
+            return User(response["_source"])
+        response = await self.es.search(index=self.es_index, body={"query": {"match": {"username": username}}})
+        if get_hits_total(response) == 0:
+            raise UserError("User {u} doesn't exist".format(u=username))
+        return User(response["hits"]["hits"][0]["_source"])
+
+    async def verify_user(self, username, password):
+        user = await self.get_user_from_index(username=username)
+        if not user:
+            return None
+        loop = asyncio.get_event_loop()
+        if await loop.run_in_executor(None, user.verify_password, password):
+            return user
+        return None
+
+    async def verify_auth_token(self, token):
+        s = Serializer(self.secret_key)
+        try:
+            data = s.loads(token)
+        except SignatureExpired:
+            return None
+        except BadSignature:
+            return None
+        return await self.get_user_from_index(user_id=data["user_id"])
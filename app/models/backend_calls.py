@@ -0,0 +1,184 @@
+import json
+import logging
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Union
+
+from elasticsearch.connection import Urllib3HttpConnection
+
+"""--------------- Accounting of backend calls per request ------------------"""
+
+logger = logging.getLogger(__name__)
+
+# calls with a query in their body, which the slow request log shows
+query_calls = ["search", "count", "mget", "delete_by_query", "update_by_query"]
+
+# the calls of the request that is handled in the current thread or task, None outside requests
+current_calls = ContextVar("backend_calls", default=None)
+
+
+class BackendCalls(object):
+    """The number, duration and size of the Elasticsearch calls made while handling a request.
+    With record_queries, each call is kept with its query, for the slow request log."""
+
+    def __init__(self, record_queries: bool = False):
+        self.start = time.perf_counter()
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_call = None
+        self.slowest_time = 0.0
+        self.bytes = 0
+        self.record_queries = record_queries
+        self.calls = []
+
+    def add_call(self, name: str, duration: float, kwargs: dict) -> None:
+        self.count += 1
+        self.total_time += duration
+        if duration >= self.slowest_time:
+            self.slowest_call = name
+            self.slowest_time = duration
+        if self.record_queries:
+            call = {"call": name, "ms": round(duration * 1000, 2)}
+            if "index" in kwargs:
+                call["index"] = kwargs["index"]
+            if name in query_calls and "body" in kwargs:
+                call["body"] = kwargs["body"]
+            self.calls.append(call)
+
+    def add_bytes(self, num_bytes: int) -> None:
+        self.bytes += num_bytes
+
+    def get_duration(self) -> float:
+        return time.perf_counter() - self.start
+
+    def get_server_timing(self) -> str:
+        """Server-Timing header value, browser developer tools show it with the request."""
+        metrics = ['es;desc="%d calls, %d bytes";dur=%.2f' % (self.count, self.bytes, self.total_time * 1000)]
+        if self.slowest_call:
+            metrics.append('es-slowest;desc="%s";dur=%.2f' % (self.slowest_call, self.slowest_time * 1000))
+        metrics.append("total;dur=%.2f" % (self.get_duration() * 1000))
+        return ", ".join(metrics)
+
+    def to_json(self) -> Dict[str, Union[None, int, float, str]]:
+        return {
+            "duration_ms": round(self.get_duration() * 1000, 2),
+            "es_calls": self.count,
+            "es_time_ms": round(self.total_time * 1000, 2),
+            "es_slowest_call": self.slowest_call,
+            "es_slowest_ms": round(self.slowest_time * 1000, 2),
+            "es_bytes": self.bytes
+        }
+
+
+def start_request(record_queries: bool = False):
+    """Start accounting the calls of a request, returns the token to end it with."""
+    return current_calls.set(BackendCalls(record_queries=record_queries))
+
+
+def end_request(token) -> None:
+    current_calls.reset(token)
+
+
+def get_current_calls() -> Union[None, BackendCalls]:
+    return current_calls.get()
+
+
+def log_request(method: str, path: str, status_code: int, calls: BackendCalls,
+                slow_request_threshold: Union[None, float] = None, streamed: bool = False,
+                query_cache: Union[None, dict] = None) -> None:
+    """Log a JSON line with the backend calls of a request. Requests that take more than
+    slow_request_threshold milliseconds are logged as warning instead, with the queries of their calls.
+    Streamed responses are logged once their body is sent, with the calls made while producing it.
+    The query cache metrics of the process, if given, show how well the cache works over time."""
+    entry = dict(calls.to_json(), method=method, path=path, status=status_code)
+    if streamed:
+        entry["streamed"] = True
+    if query_cache:
+        entry["query_cache"] = query_cache
+    if slow_request_threshold and entry["duration_ms"] > slow_request_threshold:
+        logger.warning(json.dumps(dict(entry, slow_request=True, calls=calls.calls), default=str))
+    else:
+        logger.info(json.dumps(entry))
+
+
+class InstrumentedClient(object):
+    """Proxy of an Elasticsearch client that accounts each call to the request it is made for.
+    Namespaces like indices are proxied too. Calls outside requests, e.g. by background threads,
+    are passed on as they are. The calls of an async client are accounted when they are awaited."""
+
+    namespaces = ["indices", "tasks", "cluster"]
+
+    def __init__(self, client, prefix: str = "", is_async: bool = False):
+        self._client = client
+        self._prefix = prefix
+        self._is_async = is_async
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._client, name)
+        if name in self.namespaces:
+            wrapped = InstrumentedClient(attribute, prefix=name + ".", is_async=self._is_async)
+        elif callable(attribute) and not name.startswith("_"):
+            make_call = make_accounted_async_call if self._is_async else make_accounted_call
+            wrapped = make_call(attribute, self._prefix + name)
+        else:
+            return attribute
+        # later lookups find the wrapped method without going through __getattr__
+        setattr(self, name, wrapped)
+        return wrapped
+
+
+def make_accounted_call(method, name: str):
+    @wraps(method)
+    def call(*args, **kwargs):
+        calls = current_calls.get()
+        if calls is None:
+            return method(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            calls.add_call(name, time.perf_counter() - start, kwargs)
+    return call
+
+
+def make_accounted_async_call(method, name: str):
+    @wraps(method)
+    async def call(*args, **kwargs):
+        calls = current_calls.get()
+        if calls is None:
+            return await method(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            calls.add_call(name, time.perf_counter() - start, kwargs)
+    return call
+
+
+def get_size(data: Union[None, str, bytes]) -> int:
+    # responses are decoded text, their length in characters is close enough to their size
+    return len(data) if data else 0
+
+
+class AccountingMixin(object):
+    """Adds the size of the requests and responses of a connection to the calls of the current
+    request."""
+
+    def log_request_success(self, method, full_url, path, body, status_code, response, duration):
+        calls = current_calls.get()
+        if calls is not None:
+            calls.add_bytes(get_size(body) + get_size(response))
+        super().log_request_success(method, full_url, path, body, status_code, response, duration)
+
+    def log_request_fail(self, method, full_url, path, body, duration, status_code=None, response=None,
+                         exception=None):
+        calls = current_calls.get()
+        if calls is not None:
+            calls.add_bytes(get_size(body) + get_size(response))
+        super().log_request_fail(method, full_url, path, body, duration, status_code=status_code,
+                                 response=response, exception=exception)
+
+
+class AccountingConnection(AccountingMixin, Urllib3HttpConnection):
+    pass
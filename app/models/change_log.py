@@ -0,0 +1,53 @@
+import datetime
+import time
+from typing import Callable, List, Union
+import pytz
+
+"""--------------- Change log of annotations and collections ------------------"""
+
+activity_context = "https://www.w3.org/ns/activitystreams"
+activity_types = ["Create", "Update", "Delete"]
+
+# a change becomes visible after its sequence number is taken, so the most recent changes are held
+# back until writes that took an earlier sequence number are indexed too
+default_settle_time = 5
+
+
+def make_change(seq: int, activity_type: str, annotation: any) -> dict:
+    """Make the log entry of a change to an annotation or collection. The entry carries the
+    permissions and targets of the annotation, so the log can be filtered like annotations."""
+    if activity_type not in activity_types:
+        raise ValueError("activity type must be one of %s" % ", ".join(activity_types))
+    target_list = annotation.target_list if hasattr(annotation, "target_list") and annotation.target_list else []
+    return {
+        "seq": seq,
+        "type": activity_type,
+        "object": {"id": annotation.id, "type": annotation.type},
+        "target_ids": list(dict.fromkeys(target["id"] for target in target_list)),
+        "permissions": annotation.permissions,
+        "timestamp": time.time()
+    }
+
+
+def make_activity(change: dict, make_object_id: Callable[[str, str], str]) -> dict:
+    published = datetime.datetime.fromtimestamp(change["timestamp"], pytz.utc)
+    return {
+        "type": change["type"],
+        "published": published.isoformat(),
+        "object": {"id": make_object_id(change["object"]["id"], change["object"]["type"]),
+                   "type": change["object"]["type"]}
+    }
+
+
+def make_change_page(page_id: str, collection_id: str, changes: List[dict],
+                     make_object_id: Callable[[str, str], str], next_page_id: Union[None, str] = None) -> dict:
+    page = {
+        "@context": activity_context,
+        "id": page_id,
+        "type": "OrderedCollectionPage",
+        "partOf": {"id": collection_id, "type": "OrderedCollection"},
+        "orderedItems": [make_activity(change, make_object_id) for change in changes]
+    }
+    if next_page_id:
+        page["next"] = next_page_id
+    return page
@@ -0,0 +1,117 @@
+import base64
+import binascii
+import re
+from collections import Counter
+from typing import Dict, List, Union
+from urllib.parse import urlencode
+from models.error import InvalidUsage
+
+"""--------------- IIIF Content Search API 2.0 responses ------------------"""
+
+search_context = "http://iiif.io/api/search/2/context.json"
+
+# number of matching annotations that autocomplete terms are collected from
+autocomplete_sample_size = 1000
+autocomplete_max_terms = 20
+
+highlight_pattern = re.compile(r'^(.*?)<em>(.*?)</em>(.*)$', re.DOTALL)
+word_pattern = re.compile(r'\w+')
+
+
+def make_scope_id(resource_id: str) -> str:
+    """Encode the IRI of a manifest or canvas as a single URL path segment."""
+    return base64.urlsafe_b64encode(resource_id.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def parse_scope_id(scope_id: str) -> str:
+    try:
+        padding = "=" * (-len(scope_id) % 4)
+        return base64.urlsafe_b64decode((scope_id + padding).encode("ascii")).decode("utf-8")
+    except (ValueError, UnicodeError, binascii.Error):
+        raise InvalidUsage("search scope should be the encoded id of a manifest or canvas")
+
+
+def make_search_service(search_url: str, autocomplete_url: str) -> List[Dict[str, any]]:
+    """Return the service block that announces the search services in a manifest."""
+    return [{
+        "id": search_url,
+        "type": "SearchService2",
+        "service": [{"id": autocomplete_url, "type": "AutoCompleteService2"}]
+    }]
+
+
+def get_highlight_quote(snippet: str) -> Union[None, Dict[str, str]]:
+    """Turn a highlighted snippet into the prefix, exact and suffix of a TextQuoteSelector. Only
+    the first highlighted part is used, the tags of later parts are removed."""
+    match = highlight_pattern.match(snippet)
+    if not match:
+        return None
+    prefix, exact, suffix = match.groups()
+    return {"prefix": prefix, "exact": exact, "suffix": suffix.replace("<em>", "").replace("</em>", "")}
+
+
+def make_hit_annotations(annotation_id: str, snippets: List[str]) -> List[Dict[str, any]]:
+    """Return highlighting annotations that point out where the matching annotation matched."""
+    hits = []
+    for index, snippet in enumerate(snippets):
+        quote = get_highlight_quote(snippet)
+        if not quote:
+            continue
+        hits += [{
+            "id": "{a}#hit{i}".format(a=annotation_id, i=index + 1),
+            "type": "Annotation",
+            "motivation": "highlighting",
+            "target": {
+                "type": "SpecificResource",
+                "source": annotation_id,
+                "selector": [dict(quote, type="TextQuoteSelector")]
+            }
+        }]
+    return hits
+
+
+def make_search_page(page_id: str, items: List[Dict[str, any]], next_url: Union[None, str] = None) -> dict:
+    """Return the AnnotationPage of a search response. The items are search results with an
+    annotation and its highlighted snippets."""
+    page = {
+        "@context": search_context,
+        "id": page_id,
+        "type": "AnnotationPage",
+        "items": [item["annotation"] for item in items],
+        "annotations": [{
+            "type": "AnnotationPage",
+            "items": [hit for item in items
+                      for hit in make_hit_annotations(item["annotation"]["id"], item["highlights"])]
+        }]
+    }
+    if next_url:
+        page["next"] = next_url
+    return page
+
+
+def count_matching_terms(body_texts: List[Dict[str, List[str]]], prefix: str) -> Counter:
+    """Count for each word starting with the last word of the prefix the number of annotations it
+    occurs in. Earlier words of the prefix are kept in front of the completed term."""
+    words = word_pattern.findall(prefix.lower())
+    if not words:
+        return Counter()
+    head = prefix[:prefix.lower().rfind(words[-1])]
+    counts = Counter()
+    for body_text in body_texts:
+        terms = {word.lower() for values in body_text.values() for value in values
+                 for word in word_pattern.findall(value) if word.lower().startswith(words[-1])}
+        counts.update(head + term for term in terms)
+    return counts
+
+
+def make_term_page(page_id: str, counts: Counter, search_url: str) -> dict:
+    return {
+        "@context": search_context,
+        "id": page_id,
+        "type": "TermPage",
+        "items": [{
+            "value": term,
+            "total": total,
+            "service": [{"id": "{s}?{q}".format(s=search_url, q=urlencode({"q": term})), "type": "SearchService2"}]
+        } for term, total in counts.most_common(autocomplete_max_terms)]
+    }
@@ -32,3 +32,83 @@ user_mapping = {
         }
     }
 }
+
+# built-in Elasticsearch analyzers for the languages of annotation bodies, keyed by language subtag
+body_text_analyzers = {
+    "en": "english",
+    "nl": "dutch",
+    "de": "german",
+    "fr": "french",
+    "es": "spanish",
+    "it": "italian",
+    "default": "standard"
+}
+
+# each region and range is a nested document, so a query matches the bounds of one region or range
+# and not those of different regions or ranges of the same annotation
+target_regions_mapping = {
+    "type": "nested",
+    "properties": {
+        "source": {"type": "keyword"},
+        "x_min": {"type": "double"},
+        "y_min": {"type": "double"},
+        "x_max": {"type": "double"},
+        "y_max": {"type": "double"}
+    }
+}
+
+target_ranges_mapping = {
+    "type": "nested",
+    "properties": {
+        "source": {"type": "keyword"},
+        "dimension": {"type": "keyword"},
+        "start": {"type": "double"},
+        "end": {"type": "double"}
+    }
+}
+
+annotation_mapping = {
+    "Annotation": {
+        "properties": {
+            "body_text": {
+                "properties": {
+                    language: {"type": "text", "analyzer": analyzer}
+                    for language, analyzer in body_text_analyzers.items()
+                }
+            },
+            "target_regions": target_regions_mapping,
+            "target_ranges": target_ranges_mapping
+        }
+    }
+}
+
+# the timestamp is in seconds with fractions, which a dynamically mapped float rounds to minutes
+change_mapping = {
+    "Change": {
+        "properties": {
+            "seq": {"type": "long"},
+            "type": {"type": "keyword"},
+            "target_ids": {"type": "keyword"},
+            "timestamp": {"type": "double"}
+        }
+    }
+}
+
+# the routing of each annotation by id, only fetched by id
+routing_mapping = {
+    "Routing": {
+        "dynamic": False,
+        "properties": {
+            "routing": {"type": "keyword", "index": False}
+        }
+    }
+}
+
+
+def make_index_template(index_patterns, number_of_shards, number_of_replicas):
+    # with target routing, the queries on a resource go to one shard, so the index can have many
+    return {
+        "index_patterns": index_patterns,
+        "settings": {"number_of_shards": number_of_shards, "number_of_replicas": number_of_replicas},
+        "mappings": annotation_mapping
+    }
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Iterable, List, Union
+from elasticsearch.exceptions import ConnectionError, TransportError
+import models.permissions as permissions
+from models.change_log import default_settle_time
+
+"""--------------- Dispatch of change events to subscribers ------------------"""
+
+logger = logging.getLogger(__name__)
+
+# events that are waiting for a slow subscriber before it is dropped
+default_queue_size = 1000
+
+
+def can_see_change(username: Union[None, str], change: dict) -> bool:
+    if not change.get("permissions"):
+        return False
+    return permissions.is_allowed_to_see(username, SimpleNamespace(permissions=change["permissions"]))
+
+
+class Subscription(object):
+
+    def __init__(self, target_ids: Iterable[str], username: Union[None, str], queue_size: int = default_queue_size):
+        self.target_ids = set(target_ids)
+        self.username = username
+        self.events = queue.Queue(maxsize=queue_size)
+        # set when events were dropped because the subscriber didn't keep up
+        self.overflowed = False
+        # the changes up to this sequence number were dispatched before the subscription existed
+        self.start_seq = None
+
+    def matches(self, change: dict) -> bool:
+        if not self.target_ids.intersection(change["target_ids"]):
+            return False
+        return can_see_change(self.username, change)
+
+    def put(self, change: dict) -> None:
+        try:
+            self.events.put_nowait(change)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout: float) -> Union[None, dict]:
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription(Subscription):
+    """Subscription that is read from an event loop. The dispatcher thread hands the changes to the
+    loop, so a waiting subscriber doesn't hold a thread."""
+
+    def __init__(self, target_ids: Iterable[str], username: Union[None, str], loop: asyncio.AbstractEventLoop,
+                 queue_size: int = default_queue_size):
+        super().__init__(target_ids, username, queue_size=queue_size)
+        self.loop = loop
+        self.events = asyncio.Queue(maxsize=queue_size)
+
+    def put(self, change: dict) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self.put_in_loop, change)
+        except RuntimeError:
+            # the loop is closed, the subscriber is gone
+            pass
+
+    def put_in_loop(self, change: dict) -> None:
+        try:
+            self.events.put_nowait(change)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout: float) -> Union[None, dict]:
+        try:
+            return await asyncio.wait_for(self.events.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventDispatcher(object):
+    """Follows the change log and hands each change to the subscribers of its targets. Each server
+    process has one dispatcher, so the log is polled once per process instead of once per
+    subscriber. Changes through any process are seen, as they all go through the log."""
+
+    def __init__(self, get_changes: Callable[[int, int], List[dict]], get_last_sequence: Callable[[], int],
+                 poll_interval: float = 1.0, settle_time: float = default_settle_time, batch_size: int = 1000):
+        self.get_changes = get_changes
+        self.get_last_sequence = get_last_sequence
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.batch_size = batch_size
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.has_subscriptions = threading.Event()
+        self.thread = None
+        self.last_seq = None
+
+    def subscribe(self, target_ids: Iterable[str], username: Union[None, str]) -> Subscription:
+        return self.add_subscription(Subscription(target_ids, username))
+
+    def subscribe_async(self, target_ids: Iterable[str], username: Union[None, str]) -> AsyncSubscription:
+        """Subscribe from a coroutine, the changes are read from its event loop."""
+        return self.add_subscription(AsyncSubscription(target_ids, username, asyncio.get_running_loop()))
+
+    def add_subscription(self, subscription: Subscription) -> Subscription:
+        with self.lock:
+            self.subscriptions.add(subscription)
+            self.has_subscriptions.set()
+            # started on first use, so a server that forks its workers starts one thread in each worker
+            if self.thread is None:
+                self.last_seq = self.get_last_sequence()
+                self.thread = threading.Thread(target=self.run, name="event-dispatcher", daemon=True)
+                self.thread.start()
+            # dispatch sets last_seq before it copies the subscriptions, so later changes reach this one
+            subscription.start_seq = self.last_seq
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            self.subscriptions.discard(subscription)
+            if not self.subscriptions:
+                self.has_subscriptions.clear()
+
+    def run(self) -> None:
+        while True:
+            self.has_subscriptions.wait()
+            try:
+                self.poll()
+            except (ConnectionError, TransportError) as error:
+                # the log is unavailable for now, try again at the next poll
+                logger.warning("change log unavailable: %s", error)
+            except Exception:
+                # keep the thread running for the other subscribers
+                logger.exception("dispatching changes failed")
+            time.sleep(self.poll_interval)
+
+    def poll(self) -> None:
+        changes = self.get_changes(self.last_seq, self.batch_size)
+        while changes:
+            if not self.dispatch(changes) or len(changes) < self.batch_size:
+                return
+            changes = self.get_changes(self.last_seq, self.batch_size)
+
+    def dispatch(self, changes: List[dict]) -> bool:
+        """Hand out changes in sequence. A missing sequence number is a change that isn't indexed
+        yet, so dispatching waits for it, unless it is missing for longer than the settle time.
+        Returns whether all changes were dispatched."""
+        now = time.time()
+        for change in changes:
+            if change["seq"] > self.last_seq + 1 and now - change["timestamp"] < self.settle_time:
+                return False
+            self.last_seq = change["seq"]
+            self.publish(change)
+        return True
+
+    def publish(self, change: dict) -> None:
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(change):
+                subscription.put(change)
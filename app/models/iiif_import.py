@@ -0,0 +1,106 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import BinaryIO, Callable, Iterable, Iterator, List
+import ijson
+from models.annotation import Annotation, AnnotationError
+from models.error import InvalidUsage
+
+"""--------------- Streaming import of IIIF manifest annotations ------------------"""
+
+# annotations of the manifest and of its canvases, as ijson prefixes
+annotation_prefixes = {
+    "annotations.item.items.item",
+    "items.item.annotations.item.items.item"
+}
+
+default_batch_size = 500
+
+
+def iter_manifest_annotations(stream: BinaryIO) -> Iterator[dict]:
+    """Parse the annotations of a manifest one at a time from a stream. Only the annotation that is
+    being parsed is kept in memory, not the manifest or its canvases."""
+    builder = None
+    annotation_prefix = None
+    try:
+        for prefix, event, value in ijson.parse(stream, use_float=True):
+            if builder is None:
+                if event == "start_map" and prefix in annotation_prefixes:
+                    builder = ijson.ObjectBuilder()
+                    annotation_prefix = prefix
+                    builder.event(event, value)
+                continue
+            builder.event(event, value)
+            # maps nested in the annotation have longer prefixes
+            if event == "end_map" and prefix == annotation_prefix:
+                yield builder.value
+                builder = None
+    except ijson.JSONError:
+        raise InvalidUsage("manifest is not valid JSON")
+
+
+def iter_batches(items: Iterable[any], batch_size: int) -> Iterator[List[any]]:
+    items = iter(items)
+    batch = list(islice(items, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(items, batch_size))
+
+
+def validate_batch(annotations: List[dict], offset: int, errors: List[dict]) -> List[Annotation]:
+    """Validate a batch of annotations. Invalid annotations are left out and added to errors with
+    their position in the manifest."""
+    valid = []
+    for index, annotation_json in enumerate(annotations):
+        try:
+            valid += [Annotation(annotation_json)]
+        except (AnnotationError, KeyError, TypeError) as error:
+            message = error.message if isinstance(error, AnnotationError) else "invalid annotation: %s" % error
+            errors += [{"index": offset + index, "message": message}]
+    return valid
+
+
+def iter_valid_batches(stream: BinaryIO, errors: List[dict],
+                       batch_size: int = default_batch_size) -> Iterator[List[Annotation]]:
+    offset = 0
+    for batch in iter_batches(iter_manifest_annotations(stream), batch_size):
+        yield validate_batch(batch, offset, errors)
+        offset += len(batch)
+
+
+def import_manifest_annotations(stream: BinaryIO, store_batch: Callable[[List[Annotation]], dict],
+                                batch_size: int = default_batch_size) -> dict:
+    """Parse, validate and store the annotations of a manifest in batches. Parsing and validation
+    run one batch at a time in the calling thread. Only the bulk write is handed to a single
+    worker, so the write of a batch overlaps with the validation of the next one. At most one write
+    is pending, so memory stays bounded by two batches."""
+    errors = []
+    total, indexed = 0, 0
+    pending = None
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for batch in iter_valid_batches(stream, errors, batch_size):
+            total += len(batch)
+            if pending:
+                indexed += collect_write(pending.result(), errors)
+            pending = executor.submit(store_batch, batch) if batch else None
+        if pending:
+            indexed += collect_write(pending.result(), errors)
+    return {"total": total, "indexed": indexed, "errors": errors}
+
+
+def collect_write(result: dict, errors: List[dict]) -> int:
+    errors += result["errors"]
+    return result["indexed"]
+
+
+def stream_validated_annotations(stream: BinaryIO, batch_size: int = default_batch_size) -> Iterator[str]:
+    """Serialize the valid annotations of a manifest as they are parsed, followed by the errors of
+    the invalid ones."""
+    errors = []
+    yield '{"items": ['
+    separator = ''
+    for batch in iter_valid_batches(stream, errors, batch_size):
+        for annotation in batch:
+            yield separator + json.dumps(annotation.to_clean_json(None))
+            separator = ', '
+    yield '], "errors": ' + json.dumps(errors) + '}'
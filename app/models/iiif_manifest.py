@@ -1,9 +1,13 @@
 import json
-from collections import defaultdict
-from typing import Dict, List, Union
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, Iterator, List, Union
 
 from models.annotation import Annotation
 from models.annotation_container import AnnotationPage
+from models.query_cache import CacheBackend, LocalCacheBackend, SharedGeneration
+
+presentation_context = 'http://iiif.io/api/presentation/3/context.json'
 
 
 def check_canvas_items(canvas_items: List[dict]):
@@ -68,7 +72,7 @@ class Manifest(object):
 
     def __init__(self, manifest_uri: Union[str, None] = None, manifest_json: Union[dict, None] = None):
         if manifest_uri:
-            self.context = 'http://iiif.io/api/presentation/3/context.json'
+            self.context = presentation_context
             self.type = 'Manifest'
             self.id = manifest_uri
             self.label = ''
@@ -187,12 +191,16 @@ def sort_web_annos_by_target(annotations: List[Union[Annotation, dict]]) -> Dict
     manifest_annotations = defaultdict(list)
     for annotation in annotations:
         if isinstance(annotation, dict):
-            annotation = Annotation(annotation)
+            # stored annotations have a target list and were validated when they were stored
+            annotation = Annotation.from_store(annotation) if 'target_list' in annotation else Annotation(annotation)
         elif not isinstance(annotation, Annotation):
             raise TypeError('annotations must be of type Annotation of be JSON objects with type property "Annotation"')
         if annotation.motivation == 'painting':
             raise ValueError('Manifest annotations MUST NOT have motivation "painting"')
-        target_ids = set(annotation.get_target_ids())
+        if annotation.target_list:
+            target_ids = {target['id'] for target in annotation.target_list}
+        else:
+            target_ids = set(annotation.get_target_ids())
         for target_id in target_ids:
             manifest_annotations[target_id] += [annotation]
     return manifest_annotations
@@ -214,6 +222,95 @@ def web_anno_to_manifest(annotations: Union[Annotation, dict, List[Union[Annotat
         return manifests
 
 
+def make_target_annotation_page(page_id: str, target_id: str, total: int,
+                                next_page_id: Union[None, str] = None) -> dict:
+    """Return an AnnotationPage of the annotations on a target, without its items. The page is
+    part of a collection of all the annotations on the target."""
+    page = {
+        '@context': presentation_context,
+        'id': page_id,
+        'type': 'AnnotationPage',
+        'partOf': {'id': target_id, 'type': 'AnnotationCollection', 'total': total}
+    }
+    if next_page_id:
+        page['next'] = next_page_id
+    return page
+
+
+def stream_annotation_page(page: dict, items: Iterable[dict]) -> Iterator[str]:
+    """Serialize an AnnotationPage one item at a time, so large pages are sent while they are
+    serialized instead of after."""
+    yield json.dumps(page)[:-1] + ', "items": ['
+    for index, item in enumerate(items):
+        yield (', ' if index > 0 else '') + json.dumps(item)
+    yield ']}'
+
+
+def make_target_manifest(target_id: str, annotations: List[Annotation]) -> Manifest:
+    """Make the manifest of a target from annotations that are known to be on the target."""
+    manifest = Manifest(target_id)
+    manifest.add_annotations(manifest.id + '/page/1', annotations)
+    return manifest
+
+
+class ManifestCache(object):
+    """Generated manifest JSON per target and permission scope, kept in a cache backend. Writing an
+    annotation on a target bumps the generation of the target, and entries stored before that are
+    no longer returned. The targets of writes through other server processes are not known, so when
+    the shared generation changes, all entries are dropped."""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 60, backend: Union[None, CacheBackend] = None,
+                 shared_generation: Union[None, SharedGeneration] = None):
+        self.backend = backend if backend else LocalCacheBackend(max_size=max_size, ttl=ttl)
+        self.max_size = max_size
+        self.shared_generation = shared_generation
+        # generation of the last write per target, the oldest are dropped beyond max_size
+        self.target_generations = OrderedDict()
+        self.generation = 0
+        # entries from before a dropped target generation can't be checked, so they are not returned
+        self.min_generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, target_id: str, scope: tuple) -> Union[None, dict]:
+        if self.shared_generation and self.shared_generation.has_changed():
+            self.invalidate_all()
+        value = self.backend.get(make_manifest_key(target_id, scope))
+        if value is None:
+            return None
+        generation, manifest_json = json.loads(value)
+        with self.lock:
+            valid_generation = max(self.min_generation, self.target_generations.get(target_id, 0))
+        return manifest_json if generation >= valid_generation else None
+
+    def get_generation(self) -> int:
+        """The generation to set a manifest with, taken before it is made, so a write while making
+        it invalidates it."""
+        with self.lock:
+            return self.generation
+
+    def set(self, target_id: str, scope: tuple, manifest_json: dict, generation: int) -> None:
+        self.backend.set(make_manifest_key(target_id, scope), json.dumps([generation, manifest_json]))
+
+    def invalidate(self, target_ids: Iterable[str]) -> None:
+        with self.lock:
+            self.generation += 1
+            for target_id in target_ids:
+                self.target_generations[target_id] = self.generation
+                self.target_generations.move_to_end(target_id)
+            while len(self.target_generations) > self.max_size:
+                _, generation = self.target_generations.popitem(last=False)
+                self.min_generation = max(self.min_generation, generation)
+
+    def invalidate_all(self) -> None:
+        with self.lock:
+            self.generation += 1
+            self.min_generation = self.generation
+
+
+def make_manifest_key(target_id: str, scope: tuple) -> str:
+    return json.dumps([target_id, scope])
+
+
 def web_anno_from_manifest(manifest: Union[Manifest, dict]) -> List[Union[Annotation, dict]]:
     """Annotations in a manifest are organised in a list of AnnotationPage elements"""
     annotations = []
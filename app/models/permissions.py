@@ -1,3 +1,4 @@
+import copy
 from models.error import PermissionError, InvalidUsage
 
 
@@ -83,7 +84,7 @@ def update_permissions_of_existing_annotation(annotation, params):
     # update of existing annotation
     if params["access_status"] is not None:
         # set new access status
-        annotation.permissions["access_status"] = params["access_status"]
+        annotation.permissions["access_status"] = copy.copy(params["access_status"])
 
 
 def add_permissions_to_new_annotation(annotation, params):
@@ -93,12 +94,13 @@ def add_permissions_to_new_annotation(annotation, params):
     if "username" not in params or not params["username"]:
         # new annotation must be submitted by a known user
         raise PermissionError("Cannot add annotation as unknown user")
-    if not params["access_status"]:
+    access_status = params["access_status"]
+    if not access_status:
         # new annotation, no explicit acces_status, use private as default
-        params["access_status"] = ["private"]
-    # new annotation, set access_status
+        access_status = ["private"]
+    # new annotation, set access_status, copy lists so params are never shared with the annotation
     annotation.permissions = {
-        "access_status": params["access_status"],
+        "access_status": copy.copy(access_status),
         "owner": params["username"]
     }
 
@@ -111,11 +113,11 @@ def add_share_permissions(annotation, params):
     if "can_see" in params:
         if not isinstance(params["can_see"], list):
             raise PermissionError("can_see parameter must have a list as value")
-        annotation.permissions["can_see"] = params["can_see"]
+        annotation.permissions["can_see"] = copy.copy(params["can_see"])
     if "can_edit" in params:
         if not isinstance(params["can_edit"], list):
             raise PermissionError("can_edit parameter must have a list as value")
-        annotation.permissions["can_edit"] = params["can_edit"]
+        annotation.permissions["can_edit"] = copy.copy(params["can_edit"])
         # make sure users who can edit are also in can_see list
         for user in params["can_edit"]:
             if user not in annotation.permissions["can_see"]:
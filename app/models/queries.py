@@ -13,8 +13,15 @@ def bool_should(queries):
     return {"bool": {"should": queries}}
 
 
+def bool_filter(queries):
+    if not isinstance(queries, list):
+        raise TypeError("queries parameter must be a list of queries")
+    # filter context skips scoring, which is useless for exact matches on identifiers
+    return {"bool": {"filter": queries}}
+
+
 def make_param_filter_queries(params, annotation_type: str = "_all") -> List[Dict[str, any]]:
-    filter_queries = []
+    filter_queries = [make_not_deleted_query()]
     if annotation_type != "_all":
         filter_queries += [{"match": {"type": annotation_type}}]
     if "filter" not in params:
@@ -23,9 +30,59 @@ def make_param_filter_queries(params, annotation_type: str = "_all") -> List[Dic
         filter_queries += [make_target_list_query({"id": params["filter"]["target_id"]})]
     elif "target_type" in params["filter"]:
         filter_queries += [make_target_list_query({"type": params["filter"]["target_type"]})]
+    if "descendants_of" in params["filter"]:
+        filter_queries += [make_descendants_query(params["filter"]["descendants_of"])]
+    if "scope" in params["filter"]:
+        filter_queries += [make_scope_query(params["filter"]["scope"])]
+    if "ancestor_ids" in params["filter"]:
+        filter_queries += [make_ancestors_query(params["filter"]["ancestor_ids"])]
+    sources = params["filter"]["target_id"] if "target_id" in params["filter"] else None
+    if "region" in params["filter"]:
+        filter_queries += [make_region_query(params["filter"]["region"], sources)]
+    if "text_range" in params["filter"]:
+        filter_queries += [make_range_query("text", params["filter"]["text_range"], sources)]
+    if "time_range" in params["filter"]:
+        filter_queries += [make_range_query("time", params["filter"]["time_range"], sources)]
     return filter_queries
 
 
+def make_ids_query(ids: List[str], annotation_type: str = "_all") -> Dict[str, any]:
+    filter_queries = [{"ids": {"values": ids}}]
+    if annotation_type != "_all":
+        filter_queries += [{"term": {"_type": annotation_type}}]
+    return bool_filter(filter_queries)
+
+
+def make_document_search(annotation_id: str, annotation_type: str = "_all",
+                         source_includes: List[str] = None) -> Dict[str, any]:
+    query = {"size": 1, "query": make_ids_query([annotation_id], annotation_type)}
+    if source_includes:
+        query["_source"] = source_includes
+    return query
+
+
+def make_not_deleted_query() -> Dict[str, any]:
+    # tombstones of deleted annotations and collections have no permissions, but are excluded explicitly
+    # so queries without a permission filter don't return them either
+    return {"bool": {"must_not": [{"term": {"status.keyword": "deleted"}}]}}
+
+
+def make_tombstone_query(deleted_before: str, include_undated: bool = False) -> Dict[str, any]:
+    """Match the tombstones of annotations and collections deleted before the ISO timestamp.
+    Tombstones without deletion time are older than the retention policy and are only included
+    on request."""
+    deleted_range = {"range": {"deleted": {"lt": deleted_before}}}
+    if include_undated:
+        deleted_range = bool_should([deleted_range, {"bool": {"must_not": [{"exists": {"field": "deleted"}}]}}])
+    return bool_filter([{"term": {"status.keyword": "deleted"}}, deleted_range])
+
+
+def make_param_permission_query(params, annotation_type: str = "_all") -> Dict[str, any]:
+    filter_queries = make_param_filter_queries(params, annotation_type)
+    filter_queries += [make_permission_see_query(params)]
+    return bool_must(filter_queries)
+
+
 def permission_match(field, value):
     field = "permissions.{f}".format(f=field)
     return {"match": {field, value}}
@@ -101,4 +158,149 @@ def make_target_list_query(target):
     if type(target[target_field]) == str:
         return {"match": {list_field: target[target_field]}}
     elif type(target[target_field]) == list:
-        return bool_should([{"match": {list_field: target_item}} for target_item in target[target_field]])
+        # a single terms query instead of a scored match clause per target
+        return {"terms": {list_field: target[target_field]}}
+
+
+def chunk_terms(terms: List[str], max_terms_count: int) -> List[List[str]]:
+    """Split terms into lists that don't exceed the max_terms_count setting of the index."""
+    return [terms[start: start + max_terms_count] for start in range(0, len(terms), max_terms_count)]
+
+
+def make_descendants_query(resource_ids: List[str]) -> Dict[str, any]:
+    # annotations on resources that have one of the resources as ancestor
+    return {"terms": {"target_hierarchy.ancestors.keyword": resource_ids}}
+
+
+def make_ancestors_query(ancestor_ids: List[str]) -> Dict[str, any]:
+    # annotations on the ancestors themselves, an empty list matches nothing
+    return {"terms": {"target_hierarchy.id.keyword": ancestor_ids}}
+
+
+def make_scope_query(resource_ids: List[str]) -> Dict[str, any]:
+    # annotations on the resources themselves or on resources inside them, like the canvases of a manifest
+    return bool_should([make_target_list_query({"id": resource_ids}), make_descendants_query(resource_ids)])
+
+
+def make_nested_query(path: str, query: Dict[str, any]) -> Dict[str, any]:
+    return {"nested": {"path": path, "query": query}}
+
+
+def make_region_query(region: List[float], sources: List[str] = None) -> Dict[str, any]:
+    """Match annotations with a target region overlapping the region [x, y, w, h]. Regions are
+    nested documents, so all bounds are compared with those of the same region."""
+    x, y, w, h = region
+    filter_queries = [
+        {"range": {"target_regions.x_min": {"lte": x + w}}},
+        {"range": {"target_regions.x_max": {"gte": x}}},
+        {"range": {"target_regions.y_min": {"lte": y + h}}},
+        {"range": {"target_regions.y_max": {"gte": y}}}
+    ]
+    if sources:
+        filter_queries += [{"terms": {"target_regions.source": sources}}]
+    return make_nested_query("target_regions", bool_filter(filter_queries))
+
+
+def make_range_query(dimension: str, query_range: List[float], sources: List[str] = None) -> Dict[str, any]:
+    """Match annotations with a text or time range overlapping [start, end). Like regions, ranges
+    are nested documents."""
+    start, end = query_range
+    filter_queries = [
+        {"term": {"target_ranges.dimension": dimension}},
+        {"range": {"target_ranges.start": {"lt": end}}},
+        {"range": {"target_ranges.end": {"gt": start}}}
+    ]
+    if sources:
+        filter_queries += [{"terms": {"target_ranges.source": sources}}]
+    return make_nested_query("target_ranges", bool_filter(filter_queries))
+
+
+def make_body_text_query(query_text: str) -> Dict[str, any]:
+    # each language field is analyzed with its own analyzer, so the text is matched in every language
+    return {"multi_match": {"query": query_text, "fields": ["body_text.*"]}}
+
+
+def make_body_text_search(query_text: str, params, page_size: int) -> Dict[str, any]:
+    """Search annotation bodies ordered by relevance. Filters and permissions don't affect the
+    score, and the annotation id breaks ties, so the cursor of the next page is the sort values of
+    the last hit."""
+    filter_queries = make_param_filter_queries(params, annotation_type="Annotation")
+    filter_queries += [make_permission_see_query(params)]
+    query = {
+        "size": page_size,
+        "query": {"bool": {"must": [make_body_text_query(query_text)], "filter": filter_queries}},
+        "highlight": {"fields": {"body_text.*": {}}},
+        "sort": [{"_score": "desc"}, {"id.keyword": "asc"}]
+    }
+    if "cursor" in params:
+        query["search_after"] = params["cursor"]
+    return query
+
+
+def make_target_page_search(target_id: str, params, page_size: int) -> Dict[str, any]:
+    """Page through the annotations on a target in order of id. Unlike from/size paging, the cursor
+    of search_after doesn't get slower for pages deep into the result set."""
+    filter_queries = make_param_filter_queries(params, annotation_type="Annotation")
+    filter_queries += [make_target_list_query({"id": target_id}), make_permission_see_query(params)]
+    query = {
+        "size": page_size,
+        "query": bool_filter(filter_queries),
+        "sort": [{"id.keyword": "asc"}]
+    }
+    if "cursor" in params:
+        query["search_after"] = params["cursor"]
+    return query
+
+
+def make_filters_search(params, page_size: int, annotation_type: str = "_all") -> Dict[str, any]:
+    return {
+        "from": params["page"] * page_size,
+        "size": page_size,
+        "query": make_param_permission_query(params, annotation_type)
+    }
+
+
+def make_count_query(params) -> Dict[str, any]:
+    return {"query": make_param_permission_query(params, annotation_type="Annotation")}
+
+
+def make_body_text_prefix_search(prefix: str, params, size: int) -> Dict[str, any]:
+    filter_queries = make_param_filter_queries(params, annotation_type="Annotation")
+    filter_queries += [make_permission_see_query(params)]
+    text_query = {"multi_match": {"query": prefix, "type": "phrase_prefix", "fields": ["body_text.*"]}}
+    return {
+        "size": size,
+        "_source": ["body_text"],
+        "query": {"bool": {"must": [text_query], "filter": filter_queries}}
+    }
+
+
+def make_hierarchy_lookup_query(resource_id: str) -> Dict[str, any]:
+    return bool_should([
+        {"term": {"target_hierarchy.id.keyword": resource_id}},
+        {"term": {"target_hierarchy.ancestors.keyword": resource_id}}
+    ])
+
+
+def make_hierarchy_lookup_search(resource_id: str) -> Dict[str, any]:
+    # any annotation on or inside the resource has its ancestors in its target hierarchy
+    return {
+        "size": 1,
+        "_source": ["target_hierarchy"],
+        "query": make_hierarchy_lookup_query(resource_id)
+    }
+
+
+def make_stats_search(params) -> Dict[str, any]:
+    return {
+        "size": 0,
+        "query": make_permission_see_query(params),
+        "aggs": make_stats_aggregations()
+    }
+
+
+def make_stats_aggregations():
+    return {
+        "types": {"terms": {"field": "type.keyword"}},
+        "access_status": {"terms": {"field": "permissions.access_status.keyword"}}
+    }
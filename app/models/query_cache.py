@@ -0,0 +1,173 @@
+import abc
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Union
+
+"""--------------- Cache of search results ------------------"""
+
+
+class CacheBackend(abc.ABC):
+    """Storage of a QueryCache or PublicResponseCache. A backend shared by all server processes,
+    e.g. on Redis or memcached, also shares its entries and write generation. Values are serialized
+    results or responses, so they can be stored anywhere."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Union[None, str, bytes]:
+        pass
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Union[str, bytes]) -> None:
+        pass
+
+    @abc.abstractmethod
+    def get_generation(self) -> int:
+        pass
+
+    @abc.abstractmethod
+    def bump_generation(self) -> int:
+        pass
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        pass
+
+
+class LocalCacheBackend(CacheBackend):
+    """In-process backend, the least recently used entries are evicted beyond max_size. Entries
+    also expire after ttl seconds."""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Union[None, str, bytes]:
+        with self.lock:
+            if key not in self.entries:
+                return None
+            expires, value = self.entries[key]
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Union[str, bytes]) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def get_generation(self) -> int:
+        return self.generation
+
+    def bump_generation(self) -> int:
+        with self.lock:
+            self.generation += 1
+            # entries of earlier generations can't be hit anymore
+            self.entries.clear()
+            return self.generation
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class SharedGeneration(object):
+    """Write generation of all server processes, read from a shared source like the sequence number
+    of the change log. It is read at most every check_interval seconds, which bounds how long a
+    cache keeps results from before a write through another process."""
+
+    def __init__(self, get_generation: Callable[[], int], check_interval: float = 1):
+        self.get_generation = get_generation
+        self.check_interval = check_interval
+        self.generation = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def has_changed(self) -> bool:
+        """Whether the generation changed since the last check."""
+        return self.is_due() and self.update(self.get_generation())
+
+    def is_due(self) -> bool:
+        """Whether check_interval passed since the last check, which starts a new check. Async
+        callers read the generation themselves and pass it to update."""
+        with self.lock:
+            if time.monotonic() - self.checked < self.check_interval:
+                return False
+            self.checked = time.monotonic()
+            return True
+
+    def update(self, generation: int) -> bool:
+        with self.lock:
+            changed = self.generation is not None and generation != self.generation
+            self.generation = generation
+        return changed
+
+
+def make_query_key(index: str, query: dict, routing: Union[None, str] = None) -> str:
+    # the permission filters are part of the query, so users with the same permission scope share entries
+    normalized = json.dumps([index, query, routing], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class QueryCache(object):
+    """Search results keyed by the normalized query and the write generation of the store. Every
+    write to the store bumps the generation, so results from before the write are never returned.
+    Writes through other processes bump it once the shared generation is seen to change."""
+
+    def __init__(self, backend: CacheBackend, shared_generation: SharedGeneration = None):
+        self.backend = backend
+        self.shared_generation = shared_generation
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def search(self, index: str, query: dict, routing: Union[None, str], do_search: Callable[[], dict]) -> dict:
+        if self.shared_generation and self.shared_generation.has_changed():
+            self.invalidate()
+        key = self.make_key(index, query, routing)
+        response = self.get(key)
+        if response is None:
+            response = do_search()
+            self.set(key, response)
+        return response
+
+    def make_key(self, index: str, query: dict, routing: Union[None, str]) -> str:
+        return "%d:%s" % (self.backend.get_generation(), make_query_key(index, query, routing))
+
+    def get(self, key: str) -> Union[None, dict]:
+        value = self.backend.get(key)
+        self.count(hit=value is not None)
+        # a new copy for each caller, as results are modified while turning them into annotations
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, response: dict) -> None:
+        # a result of an older generation is stored under its old key, so it is never returned
+        self.backend.set(key, json.dumps(response))
+
+    def invalidate(self) -> None:
+        self.backend.bump_generation()
+
+    def count(self, hit: bool) -> None:
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_metrics(self) -> Dict[str, Union[int, float]]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self.backend),
+                "generation": self.backend.get_generation()
+            }
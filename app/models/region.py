@@ -0,0 +1,156 @@
+import math
+import re
+import xml.etree.ElementTree as ET
+from typing import List, Union
+
+"""--------------- Image regions of annotation targets ------------------"""
+
+xywh_pattern = re.compile(r'^xywh=(?:(pixel|percent):)?(-?[\d.]+),(-?[\d.]+),([\d.]+),([\d.]+)$')
+number_pattern = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+path_command_pattern = re.compile(r'([MmLlHhVvCcSsQqTtAaZz])([^MmLlHhVvCcSsQqTtAaZz]*)')
+
+# number of parameters per SVG path command
+path_command_size = {"m": 2, "l": 2, "h": 1, "v": 1, "c": 6, "s": 4, "q": 4, "t": 2, "a": 7, "z": 0}
+
+
+def make_region(source: str, x_min: float, y_min: float, x_max: float, y_max: float) -> dict:
+    return {"source": source, "x_min": x_min, "y_min": y_min, "x_max": x_max, "y_max": y_max}
+
+
+def parse_xywh(fragment: str) -> Union[None, List[float]]:
+    """Parse a media fragment 'xywh=x,y,w,h' into the bounding box [x_min, y_min, x_max, y_max].
+    Percentages can't be compared to pixel regions without the image size, so they are skipped."""
+    match = xywh_pattern.match(fragment.strip())
+    if not match or match.group(1) == "percent":
+        return None
+    x, y, w, h = [float(value) for value in match.groups()[1:]]
+    return [x, y, x + w, y + h]
+
+
+def get_region_source(target_id: str) -> str:
+    """The IRI of the resource of a target IRI with an 'xywh' fragment. Such a target is a region of
+    the resource, like a target with a FragmentSelector, so both are indexed under the resource."""
+    source, _, fragment = target_id.partition("#")
+    return source if fragment and xywh_pattern.match(fragment.strip()) else target_id
+
+
+def get_bounding_box(points: List[List[float]]) -> Union[None, List[float]]:
+    if not points:
+        return None
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def get_path_points(path: str) -> List[List[float]]:
+    """Return the end and control points of an SVG path. The bounding box of a curve lies within
+    that of its control points, so these give a bounding box that contains the whole path."""
+    points = []
+    x, y = 0.0, 0.0
+    start_x, start_y = 0.0, 0.0
+    for command, arguments in path_command_pattern.findall(path):
+        values = [float(value) for value in number_pattern.findall(arguments)]
+        relative = command.islower()
+        size = path_command_size[command.lower()]
+        if size == 0:
+            x, y = start_x, start_y
+            continue
+        for index in range(0, len(values) - size + 1, size):
+            args = values[index: index + size]
+            if command in "Hh":
+                x = x + args[0] if relative else args[0]
+                points.append([x, y])
+            elif command in "Vv":
+                y = y + args[0] if relative else args[0]
+                points.append([x, y])
+            elif command in "Aa":
+                end_x = x + args[5] if relative else args[5]
+                end_y = y + args[6] if relative else args[6]
+                # an arc stays within its radii of the end points
+                rx, ry = abs(args[0]), abs(args[1])
+                points += [[x - rx, y - ry], [x + rx, y + ry], [end_x - rx, end_y - ry], [end_x + rx, end_y + ry]]
+                x, y = end_x, end_y
+            else:
+                pairs = [[args[i] + x, args[i + 1] + y] if relative else [args[i], args[i + 1]]
+                         for i in range(0, size, 2)]
+                points += pairs
+                x, y = pairs[-1]
+            if command in "Mm" and index == 0:
+                start_x, start_y = x, y
+    return points
+
+
+def get_element_points(element: ET.Element) -> List[List[float]]:
+    tag = element.tag.split("}")[-1]
+    attrib = element.attrib
+    try:
+        if tag == "rect":
+            x, y = float(attrib.get("x", 0)), float(attrib.get("y", 0))
+            return [[x, y], [x + float(attrib["width"]), y + float(attrib["height"])]]
+        if tag in ["circle", "ellipse"]:
+            cx, cy = float(attrib.get("cx", 0)), float(attrib.get("cy", 0))
+            rx = float(attrib["r"]) if tag == "circle" else float(attrib["rx"])
+            ry = float(attrib["r"]) if tag == "circle" else float(attrib["ry"])
+            return [[cx - rx, cy - ry], [cx + rx, cy + ry]]
+        if tag in ["polygon", "polyline"]:
+            values = [float(value) for value in number_pattern.findall(attrib["points"])]
+            return [[values[i], values[i + 1]] for i in range(0, len(values) - 1, 2)]
+        if tag == "line":
+            return [[float(attrib["x1"]), float(attrib["y1"])], [float(attrib["x2"]), float(attrib["y2"])]]
+        if tag == "path":
+            return get_path_points(attrib["d"])
+    except (KeyError, ValueError):
+        return []
+    return []
+
+
+def get_svg_bounding_box(svg: str) -> Union[None, List[float]]:
+    try:
+        root = ET.fromstring(svg)
+    except ET.ParseError:
+        return None
+    # the index only takes finite bounds, SVG attributes like width="inf" parse as floats
+    points = [point for element in root.iter() for point in get_element_points(element)
+              if all(math.isfinite(value) for value in point)]
+    return get_bounding_box(points)
+
+
+def get_selector_bounding_box(selector: dict) -> Union[None, List[float]]:
+    if not isinstance(selector, dict) or "type" not in selector or not isinstance(selector.get("value"), str):
+        return None
+    if selector["type"] == "FragmentSelector":
+        return parse_xywh(selector["value"])
+    if selector["type"] == "SvgSelector":
+        return get_svg_bounding_box(selector["value"])
+    return None
+
+
+def get_target_regions(target: Union[str, dict]) -> List[dict]:
+    """Return the image regions of a target, from a FragmentSelector, an SvgSelector or an
+    'xywh' fragment in the target IRI."""
+    if isinstance(target, str):
+        source, _, fragment = target.partition("#")
+        bounding_box = parse_xywh(fragment) if fragment else None
+        return [make_region(source, *bounding_box)] if bounding_box else []
+    if not isinstance(target, dict) or "source" not in target or "selector" not in target:
+        return []
+    selectors = target["selector"] if isinstance(target["selector"], list) else [target["selector"]]
+    regions = []
+    for selector in selectors:
+        bounding_box = get_selector_bounding_box(selector)
+        if bounding_box:
+            regions += [make_region(target["source"], *bounding_box)]
+    return regions
+
+
+def parse_region(region: str) -> Union[None, List[float]]:
+    """Parse a 'x,y,w,h' region parameter into [x, y, w, h]. Values like 'nan' and 'inf' parse as
+    floats, but can't be compared with the bounds in the index."""
+    try:
+        values = [float(value) for value in region.split(",")]
+    except ValueError:
+        return None
+    if len(values) != 4 or not all(math.isfinite(value) for value in values) or values[2] < 0 or values[3] < 0:
+        return None
+    return values
+
@@ -0,0 +1,24 @@
+from typing import Union
+
+
+class RequestContext(dict):
+    """Request-scoped copy of the request parameters.
+
+    Store methods fill in defaults (such as the action to check permissions for) on a context
+    instead of on the params that were passed in. Callers can reuse a params dict, and concurrent
+    requests sharing a store never see each other's state."""
+
+    def __init__(self, params: Union[None, dict] = None, **defaults):
+        dict.__init__(self, defaults)
+        if params:
+            self.update(params)
+        if "username" not in self:
+            self["username"] = None
+
+    @property
+    def username(self) -> Union[None, str]:
+        return self["username"]
+
+    @property
+    def action(self) -> Union[None, str]:
+        return self["action"] if "action" in self else None
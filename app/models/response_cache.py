@@ -0,0 +1,70 @@
+import gzip
+import hashlib
+import json
+from typing import Callable, Tuple, Union
+
+from models.query_cache import CacheBackend, SharedGeneration
+
+"""--------------- Cache of responses to anonymous requests ------------------"""
+
+# request headers that change the response, besides the URL
+varying_headers = ["Accept-Encoding", "Authorization", "Prefer"]
+
+
+def make_response_key(url: str, args: dict, prefer: Union[None, str]) -> str:
+    normalized = json.dumps([url, sorted(args.items()), prefer], separators=(",", ":"))
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def make_etag(body: bytes) -> str:
+    # from the bytes that are sent, so the gzipped and the plain response have their own ETag
+    return hashlib.sha1(body).hexdigest()
+
+
+class PublicResponseCache(object):
+    """Serialized and gzipped responses to anonymous requests. Anonymous users can only see public
+    annotations, so the response to a URL is the same for all of them, and proxies can cache it
+    too for max_age seconds. Every write to the store bumps the generation of the backend, writes
+    through other processes bump it once the shared generation is seen to change."""
+
+    def __init__(self, backend: CacheBackend, max_age: int = 10, shared_generation: SharedGeneration = None):
+        self.backend = backend
+        self.max_age = max_age
+        self.shared_generation = shared_generation
+
+    def make_key(self, url: str, args: dict, prefer: Union[None, str]) -> str:
+        if self.shared_generation and self.shared_generation.has_changed():
+            self.invalidate()
+        return self.make_current_key(url, args, prefer)
+
+    def make_current_key(self, url: str, args: dict, prefer: Union[None, str]) -> str:
+        # the key in the current generation, for async callers that follow the shared generation themselves
+        return "%d:%s" % (self.backend.get_generation(), make_response_key(url, args, prefer))
+
+    def get(self, key: str) -> Union[None, bytes]:
+        return self.backend.get(key)
+
+    def set(self, key: str, data: Union[dict, list]) -> bytes:
+        # without a timestamp in the gzip header, the same data always gives the same bytes and ETag
+        body = gzip.compress(json.dumps(data).encode("utf-8"), mtime=0)
+        self.backend.set(key, body)
+        return body
+
+    def invalidate(self, *args) -> None:
+        # called as write listener of the store, with the ids of the written targets
+        self.backend.bump_generation()
+
+    def get_or_make(self, key: str, make_data: Callable[[], Union[dict, list]]) -> Tuple[bytes, bool]:
+        """Get the gzipped body of the response, making and storing it if it isn't cached. Also
+        returns whether the body came from the cache."""
+        body = self.get(key)
+        if body is not None:
+            return body, True
+        return self.set(key, make_data()), False
+
+    def get_headers(self, etag: str) -> dict:
+        return {
+            "Cache-Control": "public, max-age=%d" % self.max_age,
+            "Vary": ", ".join(varying_headers),
+            "ETag": '"%s"' % etag
+        }
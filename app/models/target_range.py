@@ -0,0 +1,101 @@
+import math
+import re
+from typing import List, Union
+
+"""--------------- Text and time ranges of annotation targets ------------------"""
+
+# end of ranges that run to the end of the media, kept within the float range of the index
+open_end = 3.0e38
+
+time_fragment_pattern = re.compile(r'^t=(?:npt:)?([\d:.]*)(?:,([\d:.]+))?$')
+char_fragment_pattern = re.compile(r'^char=(\d*)(?:,(\d+))?$')
+
+
+def make_range(source: str, dimension: str, start: float, end: float) -> dict:
+    return {"source": source, "dimension": dimension, "start": float(start), "end": float(end)}
+
+
+def parse_npt_time(value: str) -> Union[None, float]:
+    """Parse a normal play time as seconds, hours:minutes:seconds or minutes:seconds."""
+    try:
+        parts = [float(part) for part in value.split(":")]
+    except ValueError:
+        return None
+    if len(parts) > 3:
+        return None
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+
+def parse_time_fragment(fragment: str) -> Union[None, List[float]]:
+    """Parse a media fragment 't=start,end' into [start, end]. A missing start is the beginning of
+    the media, a missing end is the end of the media."""
+    match = time_fragment_pattern.match(fragment.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    start = parse_npt_time(match.group(1)) if match.group(1) else 0.0
+    end = parse_npt_time(match.group(2)) if match.group(2) else open_end
+    if start is None or end is None or end < start:
+        return None
+    return [start, end]
+
+
+def parse_char_fragment(fragment: str) -> Union[None, List[float]]:
+    """Parse a text fragment 'char=start,end' (RFC 5147) into [start, end]."""
+    match = char_fragment_pattern.match(fragment.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    start = float(match.group(1)) if match.group(1) else 0.0
+    end = float(match.group(2)) if match.group(2) else open_end
+    return [start, end] if end >= start else None
+
+
+def get_fragment_range(source: str, fragment: str) -> Union[None, dict]:
+    time_range = parse_time_fragment(fragment)
+    if time_range:
+        return make_range(source, "time", *time_range)
+    char_range = parse_char_fragment(fragment)
+    if char_range:
+        return make_range(source, "text", *char_range)
+    return None
+
+
+def get_selector_range(source: str, selector: dict) -> Union[None, dict]:
+    if not isinstance(selector, dict) or "type" not in selector:
+        return None
+    if selector["type"] == "TextPositionSelector":
+        if not isinstance(selector.get("start"), int) or not isinstance(selector.get("end"), int):
+            return None
+        return make_range(source, "text", selector["start"], selector["end"])
+    if selector["type"] == "FragmentSelector" and isinstance(selector.get("value"), str):
+        return get_fragment_range(source, selector["value"])
+    return None
+
+
+def get_target_ranges(target: Union[str, dict]) -> List[dict]:
+    """Return the text and time ranges of a target, from a TextPositionSelector, a media fragment
+    ('t=' or 'char=') in a FragmentSelector, or a fragment in the target IRI."""
+    if isinstance(target, str):
+        source, _, fragment = target.partition("#")
+        target_range = get_fragment_range(source, fragment) if fragment else None
+        return [target_range] if target_range else []
+    if not isinstance(target, dict) or "source" not in target or "selector" not in target:
+        return []
+    selectors = target["selector"] if isinstance(target["selector"], list) else [target["selector"]]
+    ranges = [get_selector_range(target["source"], selector) for selector in selectors]
+    return [target_range for target_range in ranges if target_range]
+
+
+def parse_range(value: str) -> Union[None, List[float]]:
+    """Parse a 'start,end' range parameter into [start, end]. Values like 'nan' and 'inf' parse as
+    floats, but can't be compared with the ranges in the index."""
+    try:
+        values = [float(part) for part in value.split(",")]
+    except ValueError:
+        return None
+    if len(values) != 2 or not all(math.isfinite(part) for part in values) or values[1] < values[0]:
+        return None
+    return values
+
@@ -1,6 +1,7 @@
 from typing import Dict, Union
 from models.user import User
 from models.error import UserError
+from models.backend_calls import AccountingConnection, InstrumentedClient
 from elasticsearch import Elasticsearch
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, BadSignature, SignatureExpired
 
@@ -15,33 +16,21 @@ class UserStore(object):
         # initialise ES
         self.es_config = es_config
         self.es_index = es_config['user_index']
-        self.es = Elasticsearch([{"host": es_config['host'], "port": es_config['port']}])
+        self.es = InstrumentedClient(Elasticsearch([{"host": es_config['host'], "port": es_config['port']}],
+                                                  connection_class=AccountingConnection))
         if not self.es.indices.exists(index=self.es_index):
             self.es.indices.create(index=self.es_index)
-        self.needs_refresh = False
 
     def configure(self, es_config: Dict[str, Union[str, int]]) -> None:
         self.es_config = es_config
         self.es_index = es_config['user_index']
-        self.es = Elasticsearch([{"host": es_config['host'], "port": es_config['port']}])
+        self.es = InstrumentedClient(Elasticsearch([{"host": es_config['host'], "port": es_config['port']}],
+                                                  connection_class=AccountingConnection))
         if not self.es.indices.exists(index=self.es_index):
             self.es.indices.create(index=self.es_index)
-        self.needs_refresh = False
-
-    def index_needs_refresh(self):
-        return self.needs_refresh
 
     def index_refresh(self):
         self.es.indices.refresh(index=self.es_index)
-        self.needs_refresh = False
-
-    def set_index_needs_refresh(self):
-        self.needs_refresh = True
-
-    def check_index_is_fresh(self):
-        # check index is up to date, refresh if needed
-        if self.index_needs_refresh():
-            self.index_refresh()
 
     def register_user(self, username, password):
         if not self.username_available(username):
@@ -1,13 +1,29 @@
+import base64
+import binascii
+import json
 from flask import g
 from models.error import InvalidUsage, PermissionError
+from models.region import parse_region
+from models.target_range import parse_range
+from settings import server_config
 
 """--------------- Parse Request Headers and Parameters ------------------"""
 
 
 def get_params(request, anon_allowed=True):
+    try:
+        username = g.user.username
+    except AttributeError:
+        username = None
+    return get_request_params(request, username, anon_allowed=anon_allowed)
+
+
+def get_request_params(request, username, anon_allowed=True):
+    """Parse headers and parameters of a request that has 'headers' and 'args' attributes. The
+    username is passed explicitly, so this also works outside of a Flask request context."""
     params = {}
     # print("params initialized")
-    interpret_header(request.headers, params, anon_allowed)
+    interpret_header(request.headers, params, anon_allowed, username)
     # print("header params parsed")
     determine_access(request, params)
     # print("access params parsed")
@@ -23,16 +39,14 @@ def get_params(request, anon_allowed=True):
 """--------------- Parse Request Headers ------------------"""
 
 
-def interpret_header(headers, params, anon_allowed):
+def interpret_header(headers, params, anon_allowed, username=None):
     params["view"] = determine_view_preference(headers)
     # print("\n", headers)
-    try:
-        # if g.get('user') and g.user.__getattribute__('username'):
-        params["username"] = g.user.username
-    except AttributeError:
+    if not username:
         if not anon_allowed:
             raise PermissionError(message="Anonymous access with this method is not allowed")
-        params["username"] = None  # anonymous requests for accessing public annotations
+        username = None  # anonymous requests for accessing public annotations
+    params["username"] = username
     return params
 
 
@@ -85,8 +99,11 @@ def determine_page_view(request, params):
     params["page"] = 0
     page = request.args.get("page")
     if page is not None:
-        params["page "] = int(page)
+        params["page"] = get_non_negative_int(page, "page")
         params["view"] = "PreferContainedIRIs"
+    page_size = request.args.get("page_size")
+    if page_size is not None:
+        params["page_size"] = get_page_size(page_size)
     iris = request.args.get("iris")
     if iris is not None:
         params["iris"] = int(iris)
@@ -94,6 +111,25 @@ def determine_page_view(request, params):
             params["view"] = "PreferContainedDescriptions"
 
 
+def get_non_negative_int(value, name):
+    try:
+        number = int(value)
+    except ValueError:
+        raise InvalidUsage("'{n}' parameter should be a non-negative integer".format(n=name))
+    if number < 0:
+        raise InvalidUsage("'{n}' parameter should be a non-negative integer".format(n=name))
+    return number
+
+
+def get_page_size(page_size):
+    # pages are fetched from the index in a single request, so they can't be larger than its page size
+    max_page_size = server_config["Elasticsearch"]["page_size"]
+    page_size = get_non_negative_int(page_size, "page_size")
+    if page_size == 0:
+        raise InvalidUsage("'page_size' parameter should be a positive integer")
+    return min(page_size, max_page_size)
+
+
 def determine_annotation_type(request, params):
     annotation_type = request.args.get("type")
     if annotation_type is not None:
@@ -107,8 +143,48 @@ def determine_representation(request, params):
         params["include_permissions"] = True
 
 
+def encode_cursor(sort_values):
+    """Encode the sort values of the last hit of a page as an opaque cursor for the next page."""
+    return base64.urlsafe_b64encode(json.dumps(sort_values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        sort_values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except (ValueError, UnicodeError, binascii.Error):
+        raise InvalidUsage("'cursor' parameter should be a cursor from a previous search response")
+    if not isinstance(sort_values, list):
+        raise InvalidUsage("'cursor' parameter should be a cursor from a previous search response")
+    return sort_values
+
+
 def parse_search_parameters(request, params):
+    if request.args.get("q"):
+        params["q"] = request.args.get("q")
+    if request.args.get("cursor"):
+        params["cursor"] = decode_cursor(request.args.get("cursor"))
     if request.args.get("target_id"):
         params["filter"] = {"target_id": request.args.get("target_id").split(",")}
     if request.args.get("target_type"):
         params["filter"] = {"target_type": request.args.get("target_type").split(",")}
+    for hierarchy_filter in ["ancestors_of", "descendants_of"]:
+        if request.args.get(hierarchy_filter):
+            if "filter" not in params:
+                params["filter"] = {}
+            params["filter"][hierarchy_filter] = request.args.get(hierarchy_filter).split(",")
+    if request.args.get("region"):
+        region = parse_region(request.args.get("region"))
+        if not region:
+            raise InvalidUsage("'region' parameter should be 'x,y,w,h' with finite numbers and non-negative width and height")
+        if "filter" not in params:
+            params["filter"] = {}
+        params["filter"]["region"] = region
+    for range_filter in ["text_range", "time_range"]:
+        if request.args.get(range_filter):
+            query_range = parse_range(request.args.get(range_filter))
+            if not query_range:
+                raise InvalidUsage("'{f}' parameter should be 'start,end' with finite numbers and end not before start".format(
+                    f=range_filter))
+            if "filter" not in params:
+                params["filter"] = {}
+            params["filter"][range_filter] = query_range
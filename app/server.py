@@ -1,11 +1,13 @@
+from functools import partial
 from typing import Dict, Union
-from flask import Flask, json
+from flask import Flask, g, json, request
 from flask_cors import CORS
 
 from apis import blueprint as api
 from apis.user import configure_store as configure_user_store
-from apis.annotation import configure_store as configure_annotation_store
+from apis.annotation import annotation_store, configure_store as configure_annotation_store
 from apis.collection import configure_store as configure_collection_store
+import models.backend_calls as backend_calls
 from settings import server_config
 
 app = Flask(__name__, static_url_path='', static_folder='public')
@@ -26,6 +28,43 @@ def configure_stores(config: Dict[str, Union[str, int]]):
     configure_collection_store(config)
 
 
+"""--------------- Backend call accounting ------------------"""
+
+# requests slower than this many milliseconds are logged with their queries, 0 disables the log
+slow_request_threshold = server_config["SWAServer"]["slow_request_threshold"] \
+    if "slow_request_threshold" in server_config["SWAServer"] else 0
+
+
+@app.before_request
+def start_backend_call_accounting():
+    # the queries are only kept when slow requests are logged with them
+    g.backend_calls_token = backend_calls.start_request(record_queries=bool(slow_request_threshold))
+
+
+@app.after_request
+def add_server_timing(response):
+    calls = backend_calls.get_current_calls()
+    if calls is None:
+        return response
+    # the header is sent before a streamed body, so it only has the calls made before streaming
+    response.headers["Server-Timing"] = calls.get_server_timing()
+    log_request = partial(backend_calls.log_request, request.method, request.path, response.status_code, calls,
+                          slow_request_threshold)
+    if response.is_streamed:
+        # the body is produced after this, and its calls are still accounted to the request
+        response.call_on_close(lambda: log_request(streamed=True,
+                                                   query_cache=annotation_store.get_query_cache_metrics()))
+    else:
+        log_request(query_cache=annotation_store.get_query_cache_metrics())
+    return response
+
+
+@app.teardown_request
+def end_backend_call_accounting(_error):
+    if "backend_calls_token" in g:
+        backend_calls.end_request(g.pop("backend_calls_token"))
+
+
 """--------------- Ontology endpoints ------------------"""
 
 
@@ -4,13 +4,38 @@ server_config = {
         "port": 9200,
         "annotation_index": "swa",
         "user_index": "swa_user",
-        "page_size": 1000
+        "page_size": 1000,
+        "async_maxsize": 100,
+        "max_terms_count": 65536,
+        "changes_index": "swa_changes",
+        "routing_index": "swa_routing",
+        "change_settle_time": 5,
+        "tombstone_retention_days": 30,
+        "number_of_shards": 1,
+        "number_of_replicas": 1,
+        "target_routing": False,
+        "write_refresh": "wait_for",
+        "dual_write_check_interval": 5,
+        "query_cache_size": 1000,
+        "query_cache_ttl": 10,
+        "query_cache_check_interval": 1
     },
     "SWAServer": {
         "host": "localhost",
         "port": "3000",
         "url": "http://localhost:3000",
         "api_prefix": "/api/v1",
+        "manifest_cache_size": 1000,
+        "manifest_cache_ttl": 60,
+        "manifest_cache_check_interval": 1,
+        "event_poll_interval": 1,
+        "event_keepalive": 15,
+        "event_stream_timeout": 60,
+        "max_event_streams": 1,
+        "public_cache_size": 1000,
+        "public_cache_max_age": 10,
+        "public_cache_check_interval": 1,
+        "slow_request_threshold": 0
     }
 }
 
@@ -2,7 +2,8 @@ import uuid
 import copy
 import unittest
 from test.annotation_examples import annotations as examples
-from models.annotation import Annotation, WebAnnotationValidator, AnnotationError
+from models.annotation import Annotation, WebAnnotationValidator, AnnotationError, is_valid_iri, \
+    get_ancestors_from_hierarchy
 
 
 class TestAnnotationValidation(unittest.TestCase):
@@ -124,6 +125,28 @@ class TestAnnotationValidation(unittest.TestCase):
         self.assertNotEqual(error, None)
         self.assertTrue('Non-empty collection MUST have "first" property referencing the first AnnotationPage')
 
+    def test_validator_rejects_annotation_with_non_iri_target(self):
+        annotation = copy.deepcopy(examples["vincent"])
+        annotation["target"][0]["id"] = "not an iri"
+        error = None
+        try:
+            self.validator.validate(annotation, "Annotation")
+        except AnnotationError as e:
+            error = e
+        self.assertNotEqual(error, None)
+        self.assertEqual(error.message, 'annotation target id MUST be an IRI')
+
+    def test_validator_caches_validated_target_iris(self):
+        target_id = "urn:vangogh:cachedletter.sender"
+        annotation = copy.deepcopy(examples["vincent"])
+        annotation["target"][0]["id"] = target_id
+        is_valid_iri.cache_clear()
+        self.validator.validate(copy.deepcopy(annotation), "Annotation")
+        self.validator.validate(copy.deepcopy(annotation), "Annotation")
+        cache_info = is_valid_iri.cache_info()
+        self.assertEqual(cache_info.misses, 1)
+        self.assertEqual(cache_info.hits, 1)
+
 
 class TestAnnotation(unittest.TestCase):
 
@@ -138,6 +161,10 @@ class TestAnnotation(unittest.TestCase):
         self.assertTrue('id' in self.annotation.data)
         self.assertEqual(self.annotation.id, self.annotation.data['id'])
 
+    def test_annotations_share_validator(self):
+        other_annotation = Annotation(copy.copy(examples["vincent"]))
+        self.assertTrue(self.annotation.validator is other_annotation.validator)
+
     def test_annotation_has_creation_timestamp(self):
         self.assertTrue('created' in self.annotation.data)
 
@@ -193,6 +220,58 @@ class TestAnnotation(unittest.TestCase):
         for index, resource in enumerate(example_selector):
             self.assertTrue(resource["id"] in targets_info[index]["id"])
 
+    def test_annotation_can_get_subresource_target_hierarchy(self):
+        annotation = Annotation(copy.copy(examples["vincent-subresource"]))
+        target_hierarchy = annotation.get_target_hierarchy()
+        self.assertEqual(target_hierarchy, [{"id": "urn:vangogh:testletter.sender",
+                                             "ancestors": ["urn:vangogh:testletter"]}])
+
+    def test_annotation_can_get_nestedpid_target_hierarchy(self):
+        annotation = Annotation(copy.copy(examples["vincent-nestedpid"]))
+        target_hierarchy = annotation.get_target_hierarchy()
+        self.assertEqual(target_hierarchy[0]["id"], "urn:vangogh:testletter.sender")
+        self.assertEqual(target_hierarchy[0]["ancestors"], ["urn:vangogh:correspondence", "urn:vangogh:testletter"])
+        self.assertEqual(get_ancestors_from_hierarchy(target_hierarchy, "urn:vangogh:testletter"),
+                         ["urn:vangogh:correspondence"])
+
+    def test_annotation_without_selector_has_no_target_ancestors(self):
+        self.assertEqual(self.annotation.get_target_hierarchy(), [{"id": "urn:vangogh:testletter.sender",
+                                                                   "ancestors": []}])
+
+    def test_annotation_can_get_body_values(self):
+        body_values = self.annotation.get_body_values()
+        self.assertEqual(body_values, [{"language": None, "value": "Vincent van Gogh"}])
+
+    def test_annotation_body_values_skip_iri_bodies(self):
+        example = copy.copy(examples["vincent"])
+        example["body"] = ["http://dbpedia.org/resource/Vincent_van_Gogh",
+                           {"type": "TextualBody", "value": "Brief aan Theo", "language": "nl"}]
+        annotation = Annotation(example)
+        self.assertEqual(annotation.get_body_values(), [{"language": "nl", "value": "Brief aan Theo"}])
+
+    def test_annotation_from_store_uses_stored_source(self):
+        stored = self.annotation.to_json()
+        stored["permissions"] = {"owner": "user1", "access_status": ["private"]}
+        stored["target_list"] = [{"id": "urn:vangogh:testletter.sender"}]
+        annotation = Annotation.from_store(stored)
+        self.assertTrue(annotation.data is stored)
+        self.assertEqual(annotation.id, self.annotation.id)
+        self.assertEqual(annotation.data["created"], self.annotation.data["created"])
+        self.assertEqual(annotation.permissions["owner"], "user1")
+        self.assertEqual(annotation.target_list, [{"id": "urn:vangogh:testletter.sender"}])
+        self.assertFalse("permissions" in annotation.data)
+        self.assertFalse("target_list" in annotation.data)
+
+    def test_annotation_from_store_skips_validation(self):
+        stored = {"id": "urn:uuid:1", "type": "Annotation", "target": "not an IRI"}
+        annotation = Annotation.from_store(stored)
+        self.assertEqual(annotation.id, "urn:uuid:1")
+        self.assertEqual(annotation.permissions, None)
+
+    def test_annotation_has_no_instance_dict(self):
+        self.assertFalse(hasattr(self.annotation, "__dict__"))
+
+
 if __name__ == "__main__":
     unittest.main()
 
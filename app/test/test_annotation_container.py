@@ -137,6 +137,64 @@ class TestAnnotationContainer(unittest.TestCase):
         item = view["first"]["items"][0]
         for key in item.keys():
             self.assertTrue(key in anno.data.keys())
-            self.assertEqual(item[key], anno.data[key])
+            if key != "id":
+                self.assertEqual(item[key], anno.data[key])
+        self.assertTrue(item["id"].endswith(anno.id))
+
+    def test_container_pages_do_not_change_source_items(self):
+        annotations_as_json = [copy.deepcopy(anno.data) for anno in self.annotations]
+        original = copy.deepcopy(annotations_as_json)
+        container = AnnotationContainer(self.base_url, annotations_as_json, view="PreferContainedDescriptions",
+                                        page_size=1)
+        container.view()
+        container.view_page(page=1)
+        self.assertEqual(annotations_as_json, original)
+        self.assertEqual(self.annotations[0].data["id"], self.annotations[0].id)
+
+    def test_container_page_beyond_last_has_no_items(self):
+        container = AnnotationContainer(self.base_url, self.annotations, view="PreferContainedIRIs", page_size=1)
+        view = container.view_page(page=5)
+        self.assertEqual(view["items"], [])
+
+    def test_container_fetches_only_shown_pages(self):
+        fetched = []
+
+        def fetch_page(page_num, page_size):
+            fetched.append((page_num, page_size))
+            return [anno.data for anno in self.annotations[page_num * page_size: (page_num + 1) * page_size]]
+
+        container = AnnotationContainer(self.base_url, fetch_page, page_size=1, total=2)
+        self.assertEqual(container.num_pages, 2)
+        self.assertEqual(container.view()["last"], update_url(self.base_url, {"iris": 1, "page": 1}))
+        self.assertEqual(fetched, [])
+        page = container.view_page(page=1)
+        self.assertEqual(len(page["items"]), 1)
+        self.assertEqual(page["prev"], update_url(self.base_url, {"iris": 1, "page": 0}))
+        self.assertEqual(fetched, [(1, 1)])
+        container.view_page(page=1)
+        container.view_page(page=5)
+        self.assertEqual(fetched, [(1, 1)])
+
+    def test_container_computes_pages_from_total(self):
+        container = AnnotationContainer(self.base_url, lambda page_num, page_size: [], page_size=10, total=95)
+        self.assertEqual(container.num_pages, 10)
+        self.assertEqual(container.view()["total"], 95)
+
+    def test_container_with_page_callback_requires_total(self):
+        error = None
+        try:
+            AnnotationContainer(self.base_url, lambda page_num, page_size: [])
+        except AnnotationError as err:
+            error = err
+        self.assertNotEqual(error, None)
+
+    def test_container_rejects_non_annotation_items_on_page(self):
+        container = AnnotationContainer(self.base_url, [{"type": "AnnotationCollection", "id": "1"}])
+        error = None
+        try:
+            container.view_page(page=0)
+        except AnnotationError as err:
+            error = err
+        self.assertNotEqual(error, None)
 
 
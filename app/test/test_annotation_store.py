@@ -4,8 +4,9 @@ import unittest
 
 from test.annotation_examples import annotations as examples, annotation_collections as example_collections
 from models.annotation import Annotation, AnnotationError
-from models.annotation_store import AnnotationStore
+from models.annotation_store import AnnotationStore, make_routing_key
 from models.error import *
+from elasticsearch.exceptions import TransportError
 from models.permissions import add_permissions
 from settings_unittest import server_config
 
@@ -68,6 +69,7 @@ class TestAnnotationStore(unittest.TestCase):
     def tearDown(self):
         # make sure to remove temp index
         self.store.es.indices.delete(self.config["annotation_index"])
+        self.store.es.indices.delete(self.store.changes_index)
 
     def test_temp_index_is_created(self):
         exists = False
@@ -173,6 +175,54 @@ class TestAnnotationStore(unittest.TestCase):
         response = self.store.update_in_index(anno.to_json(), anno.data['type'])
         self.assertEqual(response['result'], "updated")
 
+    def test_store_notifies_old_and_new_targets_after_update(self):
+        annotation = self.store.add_annotation_es(copy.deepcopy(self.example_annotation), self.private_params)
+        old_target_ids = Annotation(annotation).get_target_ids()
+        written = []
+        self.store.add_write_listener(written.append)
+        updated = dict(annotation, target={"id": "urn:moved", "type": "Image"})
+        self.store.update_annotation_es(updated, self.private_params)
+        self.assertEqual(written, [set(old_target_ids) | {"urn:moved"}])
+        # an update that fails to be written notifies nobody
+        def fail_to_write(**_kwargs):
+            raise TransportError(500, "write failed")
+        self.store.es.index = self.store.es.bulk = fail_to_write
+        self.assertRaises(TransportError, self.store.update_annotation_es, dict(updated, target="urn:other"),
+                          self.private_params)
+        self.assertEqual(len(written), 1)
+
+    def test_store_fetches_annotation_once_to_check_permissions(self):
+        annotation = self.store.add_annotation_es(copy.deepcopy(self.example_annotation), self.private_params)
+        get = self.store.es.get
+        gets = []
+        def count_get(**kwargs):
+            gets.append(kwargs["id"])
+            return get(**kwargs)
+        self.store.es.get = count_get
+        self.store.get_annotation_es(annotation["id"], self.private_params)
+        self.assertEqual(gets, [annotation["id"]])
+        self.store.remove_annotation_es(annotation["id"], self.private_params)
+        gets.clear()
+        self.assertRaises(AnnotationError, self.store.get_annotation_es, annotation["id"], self.private_params)
+        self.assertEqual(gets, [annotation["id"]])
+
+    def test_store_refreshes_chained_annotations_once(self):
+        annotation = self.store.add_annotation_es(copy.deepcopy(self.example_annotation), self.private_params)
+        for _ in range(2):
+            reply = copy.deepcopy(self.example_annotation)
+            reply["target"] = {"id": annotation["id"], "type": "Annotation"}
+            self.store.add_annotation_es(reply, self.private_params)
+        index = self.store.es.index
+        refreshes = []
+        def record_refresh(**kwargs):
+            refreshes.append(kwargs.get("refresh"))
+            return index(**kwargs)
+        self.store.es.index = record_refresh
+        self.store.index_refresh = lambda: refreshes.append("refresh")
+        self.store.update_annotation_es(dict(annotation, target={"id": "urn:moved", "type": "Image"}),
+                                        self.private_params)
+        self.assertEqual(refreshes, ["wait_for", "false", "false", "refresh"])
+
     def test_store_raises_error_removing_unknown_annotation_from_index(self):
         anno = Annotation(self.example_annotation)
         error = None
@@ -687,6 +737,203 @@ class TestAnnotationStore(unittest.TestCase):
         self.assertEqual(annotations_data["total"], 1)
         self.assertEqual(annotations_data["annotations"][0]["id"], annotation["id"])
 
+    def test_store_can_get_annotations_grouped_by_targets(self):
+        vincent = self.store.add_annotation_es(copy.copy(examples["vincent"]), self.public_params)
+        theo = self.store.add_annotation_es(copy.copy(examples["theo"]), self.public_params)
+        self.store.add_annotation_es(copy.copy(examples["brothers"]), self.private_params)
+        sender_id = examples["vincent"]["target"][0]["id"]
+        receiver_id = examples["theo"]["target"][0]["id"]
+        annotations_data = self.store.get_annotations_by_targets_es([sender_id, receiver_id, "urn:unknown"],
+                                                                    self.anon_params)
+        self.assertEqual(annotations_data["total"], 2)
+        self.assertEqual([annotation["id"] for annotation in annotations_data["targets"][sender_id]], [vincent["id"]])
+        self.assertEqual([annotation["id"] for annotation in annotations_data["targets"][receiver_id]], [theo["id"]])
+        self.assertEqual(annotations_data["targets"]["urn:unknown"], [])
+
+    def test_store_queries_large_target_sets_in_chunks(self):
+        self.store.es_config = dict(self.config, max_terms_count=1)
+        annotation = self.store.add_annotation_es(copy.copy(examples["vincent"]), self.private_params)
+        target_ids = ["urn:unknown", examples["vincent"]["target"][0]["id"]]
+        annotations_data = self.store.get_annotations_by_targets_es(target_ids, self.private_params)
+        self.assertEqual(annotations_data["total"], 1)
+        self.assertEqual(annotations_data["targets"][target_ids[1]][0]["id"], annotation["id"])
+
+    def test_store_can_get_annotations_inside_resource(self):
+        nested_annotation = self.store.add_annotation_es(copy.copy(examples["vincent-nestedpid"]),
+                                                         self.private_params)
+        self.store.add_annotation_es(copy.copy(self.example_annotation), self.private_params)
+        params = copy.copy(self.private_params)
+        params["filter"] = {"descendants_of": ["urn:vangogh:testletter"]}
+        annotations_data = self.store.get_annotations_es(params)
+        self.assertEqual(annotations_data["total"], 1)
+        self.assertEqual(annotations_data["annotations"][0]["id"], nested_annotation["id"])
+
+    def test_store_can_get_annotations_on_ancestors_of_resource(self):
+        self.store.add_annotation_es(copy.copy(examples["vincent-nestedpid"]), self.private_params)
+        correspondence_annotation = copy.copy(self.example_annotation)
+        correspondence_annotation["target"] = [{"id": "urn:vangogh:correspondence", "type": "Correspondence"}]
+        correspondence_annotation = self.store.add_annotation_es(correspondence_annotation, self.private_params)
+        params = copy.copy(self.private_params)
+        params["filter"] = {"ancestors_of": ["urn:vangogh:testletter.sender"]}
+        annotations_data = self.store.get_annotations_es(params)
+        self.assertEqual(annotations_data["total"], 1)
+        self.assertEqual(annotations_data["annotations"][0]["id"], correspondence_annotation["id"])
+        params["filter"] = {"ancestors_of": ["urn:vangogh:unknown"]}
+        self.assertEqual(self.store.get_annotations_es(params)["total"], 0)
+
+    def test_store_can_get_annotations_overlapping_region(self):
+        canvas = "http://localhost:3000/iiif/canvas/p1"
+        inside = copy.copy(self.example_annotation)
+        inside["target"] = {"source": canvas, "type": "Canvas",
+                            "selector": {"type": "FragmentSelector", "value": "xywh=100,100,50,50"}}
+        inside = self.store.add_annotation_es(inside, self.private_params)
+        outside = copy.copy(self.example_annotation)
+        outside["target"] = {"source": canvas, "type": "Canvas",
+                             "selector": {"type": "FragmentSelector", "value": "xywh=1000,1000,50,50"}}
+        self.store.add_annotation_es(outside, self.private_params)
+        params = copy.copy(self.private_params)
+        params["filter"] = {"region": [0, 0, 200, 200], "target_id": [canvas]}
+        annotations_data = self.store.get_annotations_es(params)
+        self.assertEqual(annotations_data["total"], 1)
+        self.assertEqual(annotations_data["annotations"][0]["id"], inside["id"])
+        # a region in the target IRI is a target of the canvas too
+        fragment = copy.copy(self.example_annotation)
+        fragment["target"] = canvas + "#xywh=120,120,10,10"
+        fragment = self.store.add_annotation_es(fragment, self.private_params)
+        annotations_data = self.store.get_annotations_es(params)
+        self.assertEqual(sorted(annotation["id"] for annotation in annotations_data["annotations"]),
+                         sorted([inside["id"], fragment["id"]]))
+
+    def test_store_can_get_annotations_overlapping_text_range(self):
+        transcript = "http://localhost:3000/texts/transcript1"
+        annotation_ids = []
+        for start, end in [(100, 200), (12500, 12600)]:
+            annotation = copy.copy(self.example_annotation)
+            annotation["target"] = {"source": transcript, "type": "Text",
+                                    "selector": {"type": "TextPositionSelector", "start": start, "end": end}}
+            annotation_ids.append(self.store.add_annotation_es(annotation, self.private_params)["id"])
+        params = copy.copy(self.private_params)
+        params["filter"] = {"text_range": [12000, 13000], "target_id": [transcript]}
+        annotations_data = self.store.get_annotations_es(params)
+        self.assertEqual(annotations_data["total"], 1)
+        self.assertEqual(annotations_data["annotations"][0]["id"], annotation_ids[1])
+
+    def test_store_can_search_annotation_body_text(self):
+        annotation = copy.deepcopy(self.example_annotation)
+        annotation["body"] = [{"type": "TextualBody", "value": "Letters to his brother Theo", "language": "en"}]
+        annotation = self.store.add_annotation_es(annotation, self.private_params)
+        self.store.add_annotation_es(copy.deepcopy(self.example_annotation), self.private_params)
+        params = copy.copy(self.private_params)
+        params["page_size"] = 10
+        search_data = self.store.search_annotations_es("letter", params)
+        self.assertEqual(search_data["total"], 1)
+        self.assertEqual(search_data["items"][0]["annotation"]["id"], annotation["id"])
+        self.assertTrue("<em>Letters</em>" in search_data["items"][0]["highlights"][0])
+        self.assertEqual(search_data["cursor"], None)
+        # public search doesn't show private annotations
+        self.assertEqual(self.store.search_annotations_es("letter", dict(self.anon_params, page_size=10))["total"], 0)
+
+    def test_store_can_page_annotations_by_target(self):
+        target_id = self.example_annotation["target"][0]["id"]
+        annotation_ids = {self.store.add_annotation_es(copy.deepcopy(self.example_annotation),
+                                                       self.private_params)["id"] for _ in range(3)}
+        params = dict(self.private_params, page_size=2)
+        first_page = self.store.get_annotations_by_target_page_es(target_id, params)
+        self.assertEqual(first_page["total"], 3)
+        self.assertEqual(len(first_page["annotations"]), 2)
+        second_page = self.store.get_annotations_by_target_page_es(target_id, dict(params, cursor=first_page["cursor"]))
+        self.assertEqual(len(second_page["annotations"]), 1)
+        self.assertEqual(second_page["cursor"], None)
+        page_ids = {annotation["id"] for annotation in first_page["annotations"] + second_page["annotations"]}
+        self.assertEqual(page_ids, annotation_ids)
+
+    def test_store_logs_changes_in_sequence(self):
+        self.store.es_config = dict(self.store.es_config, change_settle_time=0)
+        since = self.store.next_change_sequence()
+        annotation = self.store.add_annotation_es(copy.deepcopy(self.example_annotation), self.private_params)
+        self.store.remove_annotation_es(annotation["id"], self.private_params)
+        # change log entries are written without waiting for a refresh
+        self.store.es.indices.refresh(index=self.store.changes_index)
+        changes = self.store.get_changes_es(since, dict(self.private_params, page_size=10))
+        self.assertEqual([change["type"] for change in changes], ["Create", "Delete"])
+        self.assertEqual(changes[0]["object"]["id"], annotation["id"])
+        self.assertTrue(changes[0]["seq"] < changes[1]["seq"])
+        # other users don't see changes to private annotations
+        self.assertEqual(self.store.get_changes_es(since, dict(self.anon_params, page_size=10)), [])
+
+    def test_store_gets_missed_changes_of_targets_without_settle_time(self):
+        since = self.store.next_change_sequence()
+        annotations = [self.store.add_annotation_es(copy.deepcopy(self.example_annotation), self.private_params)
+                       for _ in range(3)]
+        self.store.es.indices.refresh(index=self.store.changes_index)
+        until = self.store.get_last_change_sequence()
+        target_ids = Annotation(annotations[0]).get_target_ids()
+        # the changes are recent, but were dispatched already, and come in pages of 2
+        changes = self.store.get_missed_changes_es(since, until, target_ids, dict(self.private_params, page_size=2))
+        self.assertEqual([change["object"]["id"] for change in changes],
+                         [annotation["id"] for annotation in annotations])
+        self.assertEqual(self.store.get_missed_changes_es(since, until, ["urn:other"], self.private_params), [])
+
+    def test_store_purges_old_tombstones(self):
+        annotation = self.store.add_annotation_es(copy.deepcopy(self.example_annotation), self.private_params)
+        self.store.remove_annotation_es(annotation["id"], self.private_params)
+        self.assertTrue(self.store.is_deleted(annotation["id"]))
+        self.assertEqual(self.store.purge_tombstones_es(retention_days=1), 0)
+        self.assertEqual(self.store.purge_tombstones_es(retention_days=0, dry_run=True), 1)
+        self.assertEqual(self.store.purge_tombstones_es(retention_days=0), 1)
+        self.assertFalse(self.store.is_deleted(annotation["id"]))
+        # once purged, the id can be used again
+        self.assertTrue(self.store.should_not_exist(annotation["id"]))
+
+    def test_store_routes_annotations_on_target(self):
+        store = AnnotationStore(dict(self.config, target_routing=True))
+        annotation = store.add_annotation_es(copy.deepcopy(self.example_annotation), self.private_params)
+        document = store.get_document(annotation["id"])
+        target_id = document["_source"]["target_list"][0]["id"]
+        self.assertEqual(document["_routing"], make_routing_key(target_id))
+        self.assertEqual(store.get_annotation_es(annotation["id"], self.private_params)["id"], annotation["id"])
+        target_params = dict(self.private_params, filter={"target_id": target_id})
+        self.assertEqual(store.count_annotations_es(target_params), 1)
+        store.remove_annotation_es(annotation["id"], self.private_params)
+        self.assertTrue(store.is_deleted(annotation["id"]))
+
+    def test_store_finds_routed_annotations_through_each_target(self):
+        store = AnnotationStore(dict(self.config, target_routing=True))
+        annotation = copy.deepcopy(self.example_annotation)
+        annotation["target"] = [{"id": "urn:vangogh:testletter.sender", "type": "Sender"},
+                                {"id": "urn:vangogh:testletter.receiver", "type": "Receiver"}]
+        annotation = store.add_annotation_es(annotation, self.private_params)
+        self.assertEqual(store.get_document(annotation["id"])["_routing"],
+                         make_routing_key("urn:vangogh:testletter.sender"))
+        for target_id in ["urn:vangogh:testletter.sender", "urn:vangogh:testletter.receiver"]:
+            target_params = dict(self.private_params, filter={"target_id": target_id})
+            self.assertEqual(store.count_annotations_es(target_params), 1)
+            self.assertIn(make_routing_key("urn:vangogh:testletter.sender"),
+                          store.get_read_routing([target_id]).split(","))
+
+    def test_store_routes_replies_on_the_resource_of_the_annotation(self):
+        store = AnnotationStore(dict(self.config, target_routing=True))
+        annotation = store.add_annotation_es(copy.deepcopy(self.example_annotation), self.private_params)
+        target_id = store.get_document(annotation["id"])["_source"]["target_list"][0]["id"]
+        reply = copy.deepcopy(self.example_annotation)
+        reply["target"] = {"id": annotation["id"], "type": "Annotation"}
+        reply = store.add_annotation_es(reply, self.private_params)
+        self.assertEqual(store.get_document(reply["id"])["_routing"], make_routing_key(target_id))
+        # queries on the annotation also search the shard of the resource
+        self.assertEqual(store.get_read_routing([annotation["id"]]).split(","),
+                         sorted([make_routing_key(annotation["id"]), make_routing_key(target_id)]))
+        reply_params = dict(self.private_params, filter={"target_id": annotation["id"]})
+        self.assertEqual(store.count_annotations_es(reply_params), 1)
+        self.assertEqual(len(store.get_from_index_by_target_list({"id": annotation["id"]}, self.private_params)), 1)
+
+    def test_store_copies_annotations_into_new_index_version(self):
+        annotation = self.store.add_annotation_es(copy.deepcopy(self.example_annotation), self.private_params)
+        new_index = self.store.create_index_version()
+        self.assertEqual(new_index, self.config["annotation_index"] + "_v1")
+        self.assertEqual(self.store.copy_to_index(new_index, slices=2), 1)
+        self.assertTrue(self.store.es.exists(index=new_index, doc_type="Annotation", id=annotation["id"]))
+        self.store.es.indices.delete(new_index)
+
     def test_store_can_get_private_collections_by_owner(self):
         collection_data = example_collections["empty_collection"]
         self.store.create_collection_es(collection_data, self.private_params)
@@ -0,0 +1,118 @@
+import copy
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from test.annotation_examples import annotations as examples
+from models.annotation_store import AnnotationStore
+from models.error import PermissionError
+from settings_unittest import server_config
+
+NUM_THREADS = 16
+ANNOTATIONS_PER_THREAD = 5
+
+
+class TestAnnotationStoreConcurrency(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Annotation Store concurrency tests")
+
+    def setUp(self):
+        self.config = server_config["Elasticsearch"]
+        # a single store shared by all threads, as the module-level stores are shared by uwsgi threads
+        self.store = AnnotationStore(self.config)
+        self.private_params = {
+            "page": 0,
+            "access_status": None,
+            "username": "user1"
+        }
+        self.shared_params = {
+            "page": 0,
+            "access_status": ["shared"],
+            "username": "user1",
+            "can_see": ["user2"],
+            "can_edit": ["user3"]
+        }
+        self.public_params = {
+            "page": 0,
+            "access_status": ["public"],
+            "username": "user2"
+        }
+        self.original_params = [copy.deepcopy(params) for params in self.all_params()]
+
+    def tearDown(self):
+        # make sure to remove temp index
+        self.store.es.indices.delete(self.config["annotation_index"])
+
+    def all_params(self):
+        return [self.private_params, self.shared_params, self.public_params]
+
+    def add_and_read(self, thread_num):
+        # every thread reuses the same params dicts, the store must not change them
+        params = self.all_params()[thread_num % 3]
+        annotation_ids = []
+        for _ in range(ANNOTATIONS_PER_THREAD):
+            annotation = self.store.add_annotation_es(copy.deepcopy(examples["vincent"]), params)
+            retrieved = self.store.get_annotation_es(annotation["id"], params)
+            if retrieved["id"] != annotation["id"]:
+                raise AssertionError("read back annotation %s as %s" % (annotation["id"], retrieved["id"]))
+            annotation_ids.append(annotation["id"])
+        return params["username"], annotation_ids
+
+    def run_threads(self, target):
+        barrier = threading.Barrier(NUM_THREADS)
+
+        def synchronized(thread_num):
+            # start all threads at once to maximise interleaving
+            barrier.wait()
+            return target(thread_num)
+
+        with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
+            return list(executor.map(synchronized, range(NUM_THREADS)))
+
+    def test_concurrent_writes_and_reads_keep_store_invariants(self):
+        results = self.run_threads(self.add_and_read)
+        all_ids = [annotation_id for _, annotation_ids in results for annotation_id in annotation_ids]
+        # every annotation got a unique id and was stored
+        self.assertEqual(len(all_ids), NUM_THREADS * ANNOTATIONS_PER_THREAD)
+        self.assertEqual(len(set(all_ids)), len(all_ids))
+        # params passed in by callers are never modified
+        self.assertEqual(self.all_params(), self.original_params)
+        # every annotation has the permissions of the params it was created with
+        for thread_num, (username, annotation_ids) in enumerate(results):
+            expected = self.original_params[thread_num % 3]
+            for annotation_id in annotation_ids:
+                annotation = self.store.get_from_index_by_id(annotation_id, "Annotation")
+                self.assertEqual(annotation["permissions"]["owner"], username)
+                self.assertEqual(annotation["permissions"]["access_status"],
+                                 expected["access_status"] if expected["access_status"] else ["private"])
+                if "can_see" in expected:
+                    self.assertEqual(sorted(annotation["permissions"]["can_see"]), ["user2", "user3"])
+
+    def test_concurrent_reads_see_only_permitted_annotations(self):
+        private_annotation = self.store.add_annotation_es(copy.deepcopy(examples["vincent"]), self.private_params)
+        public_annotation = self.store.add_annotation_es(copy.deepcopy(examples["vincent"]), self.public_params)
+        anon_params = {"page": 0, "access_status": None, "username": None}
+
+        def read(thread_num):
+            if thread_num % 2 == 0:
+                data = self.store.get_annotations_es(anon_params)
+                return [annotation["id"] for annotation in data["annotations"]]
+            try:
+                self.store.get_annotation_es(private_annotation["id"], anon_params)
+            except PermissionError:
+                return []
+            return [private_annotation["id"]]
+
+        results = self.run_threads(read)
+        for thread_num, annotation_ids in enumerate(results):
+            if thread_num % 2 == 0:
+                self.assertEqual(annotation_ids, [public_annotation["id"]])
+            else:
+                self.assertEqual(annotation_ids, [])
+        self.assertEqual(anon_params, {"page": 0, "access_status": None, "username": None})
+
+
+if __name__ == "__main__":
+    unittest.main()
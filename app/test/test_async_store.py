@@ -0,0 +1,112 @@
+import asyncio
+import copy
+import unittest
+
+from test.annotation_examples import annotations as examples, annotation_collections as example_collections
+from models.annotation import AnnotationError
+from models.annotation_store import AnnotationStore
+from models.query_cache import LocalCacheBackend, QueryCache
+from models.async_store import AsyncAnnotationStore
+from models.error import PermissionError
+from settings_unittest import server_config
+
+
+class TestAsyncAnnotationStore(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Async Annotation Store tests")
+
+    def setUp(self):
+        self.config = server_config["Elasticsearch"]
+        self.store = AnnotationStore(self.config)
+        # the async client is bound to the loop it first runs on, so use one loop per test
+        self.loop = asyncio.new_event_loop()
+        self.async_store = AsyncAnnotationStore(self.config)
+        self.example_annotation = copy.copy(examples["vincent"])
+        self.private_params = {
+            "page": 0,
+            "access_status": "private",
+            "username": "user1"
+        }
+        self.public_params = {
+            "page": 0,
+            "access_status": "public",
+            "username": "user1"
+        }
+        self.anon_params = {
+            "page": 0,
+            "access_status": "public",
+            "username": None
+        }
+
+    def tearDown(self):
+        self.run_async(self.async_store.close())
+        self.loop.close()
+        # make sure to remove temp index
+        self.store.es.indices.delete(self.config["annotation_index"])
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_async_store_can_get_private_annotation_as_owner(self):
+        stored_annotation = self.store.add_annotation_es(self.example_annotation, self.private_params)
+        retrieved_annotation = self.run_async(self.async_store.get_annotation_es(stored_annotation["id"], self.private_params))
+        self.assertEqual(retrieved_annotation["id"], stored_annotation["id"])
+        self.assertEqual("permissions" in retrieved_annotation, False)
+
+    def test_async_store_cannot_get_private_annotation_as_anonymous_user(self):
+        stored_annotation = self.store.add_annotation_es(self.example_annotation, self.private_params)
+        error = None
+        try:
+            self.run_async(self.async_store.get_annotation_es(stored_annotation["id"], self.anon_params))
+        except PermissionError as err:
+            error = err
+        self.assertNotEqual(error, None)
+
+    def test_async_store_cannot_get_deleted_annotation(self):
+        stored_annotation = self.store.add_annotation_es(self.example_annotation, self.private_params)
+        self.store.remove_annotation_es(stored_annotation["id"], self.private_params)
+        error = None
+        try:
+            self.run_async(self.async_store.get_annotation_es(stored_annotation["id"], self.private_params))
+        except AnnotationError as err:
+            error = err
+        self.assertNotEqual(error, None)
+        self.assertEqual(error.status_code, 404)
+
+    def test_async_store_can_get_public_annotations_by_anonymous_user(self):
+        self.store.add_annotation_es(copy.copy(self.example_annotation), self.private_params)
+        annotation = self.store.add_annotation_es(copy.copy(self.example_annotation), self.public_params)
+        self.store.index_refresh()
+        annotations_data = self.run_async(self.async_store.get_annotations_es(self.anon_params))
+        self.assertEqual(annotations_data["total"], 1)
+        self.assertEqual(annotations_data["annotations"][0]["id"], annotation["id"])
+
+    def test_async_store_caches_searches_in_query_cache(self):
+        self.async_store.query_cache = QueryCache(LocalCacheBackend())
+        self.store.add_annotation_es(copy.copy(self.example_annotation), self.public_params)
+        self.store.index_refresh()
+        for _ in range(2):
+            annotations_data = self.run_async(self.async_store.get_annotations_es(self.anon_params))
+            self.assertEqual(annotations_data["total"], 1)
+        self.assertEqual(self.async_store.get_query_cache_metrics()["hits"], 1)
+
+    def test_async_store_can_get_collection_as_owner(self):
+        collection_data = copy.copy(example_collections["empty_collection"])
+        collection = self.store.create_collection_es(collection_data, self.private_params)
+        retrieved_collection = self.run_async(self.async_store.get_collection_es(collection["id"], self.private_params))
+        self.assertEqual(retrieved_collection["id"], collection["id"])
+        self.assertEqual(retrieved_collection["total"], 0)
+
+    def test_async_store_stats_count_only_visible_documents(self):
+        self.store.add_annotation_es(copy.copy(self.example_annotation), self.private_params)
+        self.store.add_annotation_es(copy.copy(self.example_annotation), self.public_params)
+        self.store.index_refresh()
+        stats = self.run_async(self.async_store.get_stats_es(self.anon_params))
+        self.assertEqual(stats["total"], 1)
+        self.assertEqual(stats["types"]["Annotation"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import unittest
+import models.backend_calls as backend_calls
+from models.backend_calls import AccountingConnection, InstrumentedClient
+
+
+class RecordingIndices(object):
+
+    def exists(self, index):
+        return index == "swa"
+
+
+class RecordingClient(object):
+
+    def __init__(self):
+        self.indices = RecordingIndices()
+        self.searches = []
+
+    def search(self, index, body):
+        self.searches.append(body)
+        return {"hits": {"hits": []}}
+
+
+class RecordingAsyncClient(object):
+
+    def __init__(self):
+        self.searches = []
+
+    async def search(self, index, body):
+        await asyncio.sleep(0.001)
+        self.searches.append(body)
+        return {"hits": {"hits": []}}
+
+
+class TestBackendCalls(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Backend Call Accounting tests")
+
+    def setUp(self):
+        self.client = RecordingClient()
+        self.es = InstrumentedClient(self.client)
+
+    def test_calls_outside_requests_are_passed_on(self):
+        self.assertEqual(self.es.search(index="swa", body={"size": 1}), {"hits": {"hits": []}})
+        self.assertEqual(self.client.searches, [{"size": 1}])
+        self.assertIsNone(backend_calls.get_current_calls())
+
+    def test_calls_are_accounted_to_the_request(self):
+        token = backend_calls.start_request()
+        try:
+            self.es.search(index="swa", body={"size": 1})
+            self.assertTrue(self.es.indices.exists(index="swa"))
+            calls = backend_calls.get_current_calls()
+        finally:
+            backend_calls.end_request(token)
+        self.assertEqual(calls.count, 2)
+        self.assertIn(calls.slowest_call, ["search", "indices.exists"])
+        self.assertEqual(calls.calls, [])
+        self.assertIsNone(backend_calls.get_current_calls())
+
+    def test_async_calls_are_accounted_when_awaited(self):
+        es = InstrumentedClient(RecordingAsyncClient(), is_async=True)
+
+        async def handle_request():
+            token = backend_calls.start_request()
+            try:
+                await es.search(index="swa", body={"size": 1})
+                return backend_calls.get_current_calls()
+            finally:
+                backend_calls.end_request(token)
+
+        calls = asyncio.new_event_loop().run_until_complete(handle_request())
+        self.assertEqual((calls.count, calls.slowest_call), (1, "search"))
+        self.assertGreaterEqual(calls.total_time, 0.001)
+
+    def test_recorded_calls_include_query_bodies(self):
+        token = backend_calls.start_request(record_queries=True)
+        try:
+            self.es.search(index="swa", body={"query": {"match_all": {}}})
+            self.es.indices.exists(index="swa")
+            calls = backend_calls.get_current_calls()
+        finally:
+            backend_calls.end_request(token)
+        self.assertEqual(calls.calls[0]["body"], {"query": {"match_all": {}}})
+        self.assertEqual(calls.calls[1]["call"], "indices.exists")
+        self.assertNotIn("body", calls.calls[1])
+
+    def test_connection_adds_request_and_response_sizes(self):
+        connection = AccountingConnection()
+        token = backend_calls.start_request()
+        try:
+            connection.log_request_success("GET", "http://localhost:9200/swa/_search", "/swa/_search",
+                                           b'{"size":1}', 200, '{"hits":{}}', 0.001)
+            calls = backend_calls.get_current_calls()
+        finally:
+            backend_calls.end_request(token)
+        self.assertEqual(calls.bytes, 21)
+        self.assertIn('es;desc="0 calls, 21 bytes"', calls.get_server_timing())
+
+    def test_streamed_requests_are_marked(self):
+        calls = backend_calls.BackendCalls()
+        calls.add_call("search", 0.002, {})
+        with self.assertLogs("models.backend_calls", level="INFO") as logs:
+            backend_calls.log_request("GET", "/api/v1/iiif/page", 200, calls, streamed=True)
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry["es_calls"], entry["streamed"]), (1, True))
+
+    def test_query_cache_metrics_are_logged(self):
+        calls = backend_calls.BackendCalls()
+        metrics = {"hits": 3, "misses": 1, "hit_ratio": 0.75, "size": 1, "generation": 2}
+        with self.assertLogs("models.backend_calls", level="INFO") as logs:
+            backend_calls.log_request("GET", "/api/v1/annotations/", 200, calls, query_cache=metrics)
+        self.assertEqual(json.loads(logs.records[0].getMessage())["query_cache"], metrics)
+
+
+if __name__ == "__main__":
+    unittest.main()
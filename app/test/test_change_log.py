@@ -0,0 +1,42 @@
+import copy
+import unittest
+from test.annotation_examples import annotations as examples
+from models.annotation import Annotation
+from models.change_log import make_change, make_change_page
+
+
+class TestChangeLog(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Change Log tests")
+
+    def setUp(self):
+        self.annotation = Annotation(copy.deepcopy(examples["vincent"]))
+        self.annotation.permissions = {"access_status": ["public"], "owner": "user1"}
+        self.annotation.target_list = [{"id": "urn:vangogh:testletter.sender"}, {"id": "urn:vangogh:testletter.sender"}]
+
+    def test_change_has_permissions_and_targets_of_annotation(self):
+        change = make_change(7, "Create", self.annotation)
+        self.assertEqual(change["seq"], 7)
+        self.assertEqual(change["object"], {"id": self.annotation.id, "type": "Annotation"})
+        self.assertEqual(change["permissions"]["access_status"], ["public"])
+        self.assertEqual(change["target_ids"], ["urn:vangogh:testletter.sender"])
+
+    def test_change_type_must_be_activity(self):
+        self.assertRaises(ValueError, make_change, 1, "Move", self.annotation)
+
+    def test_change_page_lists_activities_in_order(self):
+        changes = [make_change(1, "Create", self.annotation), make_change(2, "Delete", self.annotation)]
+        page = make_change_page("http://localhost:3000/changes/?since=0", "http://localhost:3000/changes/", changes,
+                                lambda object_id, object_type: "http://localhost:3000/annotations/" + object_id,
+                                "http://localhost:3000/changes/?since=2")
+        self.assertEqual(page["type"], "OrderedCollectionPage")
+        self.assertEqual([activity["type"] for activity in page["orderedItems"]], ["Create", "Delete"])
+        self.assertEqual(page["orderedItems"][0]["object"]["id"],
+                         "http://localhost:3000/annotations/" + self.annotation.id)
+        self.assertEqual(page["next"], "http://localhost:3000/changes/?since=2")
+
+
+if __name__ == "__main__":
+    unittest.main()
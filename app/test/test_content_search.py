@@ -0,0 +1,52 @@
+import unittest
+from models.content_search import count_matching_terms, get_highlight_quote, make_scope_id, make_search_page, \
+    make_term_page, parse_scope_id
+from models.error import InvalidUsage
+
+
+class TestContentSearch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Content Search tests")
+
+    def setUp(self):
+        self.manifest = "http://localhost:3000/iiif/manifest/letter1"
+        self.annotation_id = "http://localhost:3000/api/annotations/a1"
+
+    def test_scope_id_is_a_single_path_segment(self):
+        scope_id = make_scope_id(self.manifest)
+        self.assertFalse("/" in scope_id)
+        self.assertEqual(parse_scope_id(scope_id), self.manifest)
+        self.assertRaises(InvalidUsage, parse_scope_id, "not encoded!")
+
+    def test_highlight_gives_text_quote(self):
+        quote = get_highlight_quote("Letters to his <em>brother</em> Theo and <em>brother</em>")
+        self.assertEqual(quote, {"prefix": "Letters to his ", "exact": "brother", "suffix": " Theo and brother"})
+        self.assertEqual(get_highlight_quote("no highlight"), None)
+
+    def test_search_page_has_hit_annotations(self):
+        items = [{"annotation": {"id": self.annotation_id, "type": "Annotation"},
+                  "highlights": ["his <em>brother</em> Theo"]}]
+        page = make_search_page("http://localhost:3000/search?q=brother", items, "http://localhost:3000/next")
+        self.assertEqual(page["type"], "AnnotationPage")
+        self.assertEqual(page["items"][0]["id"], self.annotation_id)
+        hit = page["annotations"][0]["items"][0]
+        self.assertEqual(hit["motivation"], "highlighting")
+        self.assertEqual(hit["target"]["source"], self.annotation_id)
+        self.assertEqual(hit["target"]["selector"][0]["exact"], "brother")
+        self.assertEqual(page["next"], "http://localhost:3000/next")
+
+    def test_terms_are_counted_per_annotation(self):
+        body_texts = [{"en": ["Brother Theo", "brother"]}, {"nl": ["broer"], "default": ["Vincent"]}]
+        counts = count_matching_terms(body_texts, "Bro")
+        self.assertEqual(counts["brother"], 1)
+        self.assertEqual(counts["broer"], 1)
+        self.assertEqual(count_matching_terms(body_texts, "his bro")["his brother"], 1)
+        term_page = make_term_page("http://localhost:3000/autocomplete?q=bro", counts, "http://localhost:3000/search")
+        self.assertEqual(term_page["type"], "TermPage")
+        self.assertEqual(term_page["items"][0]["service"][0]["id"].split("?")[1], "q=" + term_page["items"][0]["value"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+import unittest
+from models.event_dispatcher import AsyncSubscription, EventDispatcher, Subscription
+
+
+def make_change(seq, target_id, access_status="public", timestamp=None):
+    return {
+        "seq": seq,
+        "type": "Create",
+        "object": {"id": "urn:uuid:%s" % seq, "type": "Annotation"},
+        "target_ids": [target_id],
+        "permissions": {"access_status": [access_status], "owner": "user1"},
+        "timestamp": timestamp if timestamp is not None else time.time()
+    }
+
+
+class TestEventDispatcher(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Event Dispatcher tests")
+
+    def setUp(self):
+        self.dispatcher = EventDispatcher(lambda since, size: [], lambda: 0, poll_interval=60, settle_time=5)
+        self.dispatcher.last_seq = 0
+
+    def test_subscription_gets_changes_of_its_targets_it_can_see(self):
+        subscription = Subscription(["urn:canvas:1"], None)
+        self.assertTrue(subscription.matches(make_change(1, "urn:canvas:1")))
+        self.assertFalse(subscription.matches(make_change(2, "urn:canvas:2")))
+        self.assertFalse(subscription.matches(make_change(3, "urn:canvas:1", access_status="private")))
+        self.assertTrue(Subscription(["urn:canvas:1"], "user1").matches(make_change(3, "urn:canvas:1", "private")))
+
+    def test_dispatcher_publishes_changes_to_subscribers(self):
+        subscription = self.dispatcher.subscribe(["urn:canvas:1"], None)
+        self.assertTrue(self.dispatcher.dispatch([make_change(1, "urn:canvas:1"), make_change(2, "urn:canvas:2")]))
+        self.assertEqual(subscription.get(timeout=0)["seq"], 1)
+        self.assertEqual(subscription.get(timeout=0), None)
+        self.assertEqual(self.dispatcher.last_seq, 2)
+        self.dispatcher.unsubscribe(subscription)
+        self.assertFalse(self.dispatcher.has_subscriptions.is_set())
+
+    def test_subscription_starts_after_dispatched_changes(self):
+        self.dispatcher.subscribe(["urn:canvas:1"], None)
+        self.dispatcher.dispatch([make_change(1, "urn:canvas:1"), make_change(2, "urn:canvas:2")])
+        # the changes so far are missed by a new subscription, a reconnecting client gets them from the log
+        subscription = self.dispatcher.subscribe(["urn:canvas:1"], None)
+        self.assertEqual(subscription.start_seq, 2)
+        self.dispatcher.dispatch([make_change(3, "urn:canvas:1")])
+        self.assertEqual(subscription.get(timeout=0)["seq"], 3)
+
+    def test_dispatcher_waits_for_missing_recent_change(self):
+        self.assertFalse(self.dispatcher.dispatch([make_change(2, "urn:canvas:1")]))
+        self.assertEqual(self.dispatcher.last_seq, 0)
+        # a change that is missing for longer than the settle time is skipped
+        self.assertTrue(self.dispatcher.dispatch([make_change(2, "urn:canvas:1", timestamp=time.time() - 10)]))
+        self.assertEqual(self.dispatcher.last_seq, 2)
+
+    def test_dispatcher_logs_poll_errors_and_keeps_running(self):
+        def get_changes(since, size):
+            self.dispatcher.has_subscriptions.clear()
+            raise ValueError("broken change")
+        self.dispatcher.get_changes = get_changes
+        self.dispatcher.poll_interval = 0
+        self.dispatcher.has_subscriptions.set()
+        thread = threading.Thread(target=self.dispatcher.run, daemon=True)
+        with self.assertLogs("models.event_dispatcher", level="ERROR") as logs:
+            thread.start()
+            thread.join(timeout=0.2)
+        self.assertIn("dispatching changes failed", logs.output[0])
+        self.assertTrue(thread.is_alive())
+
+    def test_async_subscription_gets_changes_from_dispatcher_thread(self):
+        async def subscribe_and_get():
+            subscription = self.dispatcher.subscribe_async(["urn:canvas:1"], None)
+            self.assertIsInstance(subscription, AsyncSubscription)
+            thread = threading.Thread(target=self.dispatcher.dispatch, args=([make_change(1, "urn:canvas:1")],))
+            thread.start()
+            change = await subscription.get(timeout=1)
+            thread.join()
+            self.dispatcher.unsubscribe(subscription)
+            return change, await subscription.get(timeout=0.01)
+        change, no_change = asyncio.run(subscribe_and_get())
+        self.assertEqual(change["seq"], 1)
+        self.assertEqual(no_change, None)
+
+    def test_slow_subscriber_overflows(self):
+        subscription = Subscription(["urn:canvas:1"], None, queue_size=1)
+        subscription.put(make_change(1, "urn:canvas:1"))
+        subscription.put(make_change(2, "urn:canvas:1"))
+        self.assertTrue(subscription.overflowed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import io
+import json
+import unittest
+from models.error import InvalidUsage
+import models.iiif_import as iiif_import
+
+
+def make_annotation(index):
+    return {
+        "@context": "http://www.w3.org/ns/anno.jsonld",
+        "id": "http://localhost:3000/iiif/annotation/%s" % index,
+        "type": "Annotation",
+        "motivation": "commenting",
+        "body": {"type": "TextualBody", "value": "comment %s" % index},
+        "target": {"id": "http://localhost:3000/iiif/canvas/p1", "type": "Canvas"}
+    }
+
+
+class TestIIIFImport(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning IIIF Import tests")
+
+    def setUp(self):
+        canvas_annotation = make_annotation("c1")
+        invalid_annotation = {"id": "http://localhost:3000/iiif/annotation/invalid", "type": "Annotation"}
+        self.manifest = {
+            "@context": "http://iiif.io/api/presentation/3/context.json",
+            "id": "http://localhost:3000/iiif/manifest",
+            "type": "Manifest",
+            "items": [{
+                "id": "http://localhost:3000/iiif/canvas/p1",
+                "type": "Canvas",
+                "annotations": [{"id": "http://localhost:3000/iiif/page/c1", "type": "AnnotationPage",
+                                 "items": [canvas_annotation]}]
+            }],
+            "annotations": [{
+                "id": "http://localhost:3000/iiif/page/1",
+                "type": "AnnotationPage",
+                "items": [make_annotation(1), invalid_annotation, make_annotation(2)]
+            }]
+        }
+
+    def make_stream(self):
+        return io.BytesIO(json.dumps(self.manifest).encode("utf-8"))
+
+    def test_manifest_and_canvas_annotations_are_parsed(self):
+        annotations = list(iiif_import.iter_manifest_annotations(self.make_stream()))
+        self.assertEqual(len(annotations), 4)
+        self.assertEqual(annotations[0]["id"], "http://localhost:3000/iiif/annotation/c1")
+        self.assertEqual(annotations[1]["body"]["value"], "comment 1")
+
+    def test_invalid_annotations_are_reported(self):
+        errors = []
+        batches = list(iiif_import.iter_valid_batches(self.make_stream(), errors, batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        self.assertEqual(errors[0]["index"], 2)
+
+    def test_import_stores_batches(self):
+        stored = []
+
+        def store_batch(batch):
+            stored.append([annotation.id for annotation in batch])
+            return {"indexed": len(batch), "errors": []}
+
+        result = iiif_import.import_manifest_annotations(self.make_stream(), store_batch, batch_size=2)
+        self.assertEqual(result["total"], 3)
+        self.assertEqual(result["indexed"], 3)
+        self.assertEqual(len(result["errors"]), 1)
+        self.assertEqual(len(stored), 2)
+
+    def test_streamed_annotations_are_valid_json(self):
+        response = json.loads("".join(iiif_import.stream_validated_annotations(self.make_stream())))
+        self.assertEqual(len(response["items"]), 3)
+        self.assertEqual(len(response["errors"]), 1)
+
+    def test_invalid_json_is_rejected(self):
+        stream = io.BytesIO(b'{"annotations": [')
+        self.assertRaises(InvalidUsage, list, iiif_import.iter_manifest_annotations(stream))
+
+
+if __name__ == "__main__":
+    unittest.main()
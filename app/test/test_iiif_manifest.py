@@ -4,6 +4,7 @@ import os
 
 from models.iiif_manifest import Manifest
 import models.iiif_manifest as iiif
+from models.query_cache import SharedGeneration
 
 
 def read_vaint_example():
@@ -47,3 +48,59 @@ class TestIIIFManifest(unittest.TestCase):
         except AssertionError as err:
             error = err
         self.assertNotEqual(error, None)
+
+    def test_streamed_annotation_page_is_valid_json(self):
+        page = iiif.make_target_annotation_page('http://localhost:3000/page', 'urn:canvas:1', 3,
+                                                'http://localhost:3000/page?cursor=x')
+        items = [{'id': 'a1', 'type': 'Annotation'}, {'id': 'a2', 'type': 'Annotation'}]
+        page_json = json.loads(''.join(iiif.stream_annotation_page(page, iter(items))))
+        self.assertEqual(page_json['items'], items)
+        self.assertEqual(page_json['partOf']['total'], 3)
+        self.assertEqual(page_json['next'], 'http://localhost:3000/page?cursor=x')
+        empty_page_json = json.loads(''.join(iiif.stream_annotation_page(page, [])))
+        self.assertEqual(empty_page_json['items'], [])
+
+    def test_web_anno_to_manifest_groups_stored_annotations_by_target_list(self):
+        stored = {'id': 'urn:uuid:1', 'type': 'Annotation', 'motivation': 'commenting',
+                  'target': 'not validated again',
+                  'target_list': [{'id': 'urn:canvas:1'}, {'id': 'urn:canvas:2'}]}
+        manifests = iiif.web_anno_to_manifest(stored)
+        self.assertEqual(sorted(manifest.id for manifest in manifests), ['urn:canvas:1', 'urn:canvas:2'])
+
+    def test_manifest_cache_drops_manifests_of_written_targets(self):
+        cache = iiif.ManifestCache(max_size=2)
+        cache.set('urn:canvas:1', ('user1',), {'id': 'urn:canvas:1'}, cache.get_generation())
+        cache.set('urn:canvas:1', (None,), {'id': 'urn:canvas:1'}, cache.get_generation())
+        cache.set('urn:canvas:2', (None,), {'id': 'urn:canvas:2'}, cache.get_generation())
+        # the least recently used manifest is dropped to stay within the maximum size
+        self.assertEqual(cache.get('urn:canvas:1', ('user1',)), None)
+        self.assertEqual(cache.get('urn:canvas:1', (None,)), {'id': 'urn:canvas:1'})
+        cache.invalidate({'urn:canvas:1'})
+        self.assertEqual(cache.get('urn:canvas:1', (None,)), None)
+        self.assertEqual(cache.get('urn:canvas:2', (None,)), {'id': 'urn:canvas:2'})
+
+    def test_manifest_cache_drops_manifests_when_write_generations_are_dropped(self):
+        cache = iiif.ManifestCache(max_size=1)
+        cache.set('urn:canvas:1', (None,), {'id': 'urn:canvas:1'}, cache.get_generation())
+        cache.invalidate({'urn:canvas:1'})
+        # the write on canvas 1 is no longer tracked, so entries from before it can't be trusted
+        cache.invalidate({'urn:canvas:2'})
+        self.assertEqual(cache.get('urn:canvas:1', (None,)), None)
+        cache.set('urn:canvas:1', (None,), {'id': 'urn:canvas:1'}, cache.get_generation())
+        self.assertEqual(cache.get('urn:canvas:1', (None,)), {'id': 'urn:canvas:1'})
+
+    def test_manifest_cache_drops_manifests_made_during_a_write(self):
+        cache = iiif.ManifestCache()
+        generation = cache.get_generation()
+        # the manifest is made from the annotations before the write
+        cache.invalidate({'urn:canvas:1'})
+        cache.set('urn:canvas:1', (None,), {'id': 'urn:canvas:1'}, generation)
+        self.assertEqual(cache.get('urn:canvas:1', (None,)), None)
+
+    def test_manifest_cache_drops_manifests_after_writes_through_other_processes(self):
+        sequence = [1]
+        cache = iiif.ManifestCache(shared_generation=SharedGeneration(lambda: sequence[0], check_interval=0))
+        cache.set('urn:canvas:1', (None,), {'id': 'urn:canvas:1'}, cache.get_generation())
+        self.assertEqual(cache.get('urn:canvas:1', (None,)), {'id': 'urn:canvas:1'})
+        sequence[0] = 2
+        self.assertEqual(cache.get('urn:canvas:1', (None,)), None)
@@ -0,0 +1,40 @@
+import unittest
+import models.annotation_store
+import models.user_store
+from benchmarks import load
+from benchmarks.corpus import make_corpus
+from settings_unittest import server_config
+
+
+class TestLoad(unittest.TestCase):
+    """A tiny load run against the in-memory stand-in of Elasticsearch."""
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Load Test smoke tests")
+        cls.elasticsearch_classes = (models.annotation_store.Elasticsearch, models.user_store.Elasticsearch)
+        load.use_memory_backend()
+        import server
+        cls.server = server
+        # the stores may have been created by an earlier import, configuring them again creates in-memory clients
+        server.configure_stores(load.make_load_config(server_config["Elasticsearch"], "swa_load_test"))
+
+    @classmethod
+    def tearDownClass(cls):
+        # stores configured by later tests connect to Elasticsearch again
+        models.annotation_store.Elasticsearch, models.user_store.Elasticsearch = cls.elasticsearch_classes
+
+    def test_load_run_has_no_errors(self):
+        access_mix = {"private": 1, "shared": 1, "public": 2}
+        corpus = make_corpus(3, 4, 20, 2, 2, 2, 3, access_mix, seed=0)
+        headers = load.seed_corpus(corpus)
+        state = load.LoadState(corpus, headers, server_config["SWAServer"]["api_prefix"], access_mix)
+        mix = {operation: 1 for operation in load.operations}
+        results, elapsed = load.run_load(self.server.app, state, mix, num_requests=40, num_threads=2, seed=0)
+        summary = load.summarize(results, elapsed)
+        self.assertEqual(summary["total"]["requests"], 40)
+        self.assertEqual(summary["total"]["errors"], 0, summary)
+
+
+if __name__ == "__main__":
+    unittest.main()
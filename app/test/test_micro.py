@@ -0,0 +1,38 @@
+import json
+import os
+import unittest
+from benchmarks import micro
+
+
+class TestMicroBenchmarks(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Microbenchmark smoke tests")
+
+    def test_each_benchmark_runs(self):
+        for name, setup in micro.benchmarks.items():
+            with self.subTest(benchmark=name):
+                setup(3)()
+
+    def test_baseline_covers_each_benchmark(self):
+        baseline_file = os.path.join(os.path.dirname(micro.__file__), "baselines", "micro.json")
+        with open(baseline_file, "rt") as fh:
+            baseline = json.load(fh)
+        for name in micro.benchmarks:
+            for size in micro.default_sizes:
+                self.assertIn("%s[%d]" % (name, size), baseline["results"])
+
+    def test_results_are_measured_per_size(self):
+        results = micro.run_benchmarks(["permission_check"], [1, 2], samples=2, min_sample_time=0)
+        self.assertEqual(sorted(results), ["permission_check[1]", "permission_check[2]"])
+        self.assertGreater(results["permission_check[1]"]["median_us"], 0)
+
+    def test_comparison_reports_slower_benchmarks(self):
+        results = {"a[1]": {"median_us": 30.0, "min_us": 30.0}, "b[1]": {"median_us": 10.0, "min_us": 10.0}}
+        baseline = {"a[1]": {"median_us": 10.0, "min_us": 10.0}, "b[1]": {"median_us": 10.0, "min_us": 9.0}}
+        self.assertEqual(micro.compare_results(results, baseline, threshold=1.25), ["a[1]"])
+
+
+if __name__ == "__main__":
+    unittest.main()
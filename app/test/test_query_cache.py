@@ -0,0 +1,85 @@
+import unittest
+from models.query_cache import CacheBackend, LocalCacheBackend, QueryCache, SharedGeneration, make_query_key
+
+
+class TestQueryCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Query Cache tests")
+
+    def setUp(self):
+        self.cache = QueryCache(LocalCacheBackend(max_size=2, ttl=60))
+        self.searches = 0
+
+    def do_search(self):
+        self.searches += 1
+        return {"hits": {"hits": [{"_source": {"id": "urn:uuid:1"}}]}}
+
+    def test_query_key_ignores_key_order(self):
+        self.assertEqual(make_query_key("swa", {"size": 1, "from": 0}), make_query_key("swa", {"from": 0, "size": 1}))
+        self.assertNotEqual(make_query_key("swa", {"size": 1}), make_query_key("swa", {"size": 1}, routing="r"))
+
+    def test_cache_returns_copies_of_results(self):
+        response = self.cache.search("swa", {"size": 1}, None, self.do_search)
+        response["hits"]["hits"][0]["_source"].pop("id")
+        cached = self.cache.search("swa", {"size": 1}, None, self.do_search)
+        self.assertEqual(self.searches, 1)
+        self.assertEqual(cached["hits"]["hits"][0]["_source"]["id"], "urn:uuid:1")
+
+    def test_write_generation_invalidates_results(self):
+        self.cache.search("swa", {"size": 1}, None, self.do_search)
+        self.cache.invalidate()
+        self.cache.search("swa", {"size": 1}, None, self.do_search)
+        self.assertEqual(self.searches, 2)
+        metrics = self.cache.get_metrics()
+        self.assertEqual((metrics["hits"], metrics["misses"], metrics["generation"]), (0, 2, 1))
+
+    def test_cache_evicts_least_recently_used_results(self):
+        for size in [1, 2, 1, 3]:
+            self.cache.search("swa", {"size": size}, None, self.do_search)
+        self.assertEqual(len(self.cache.backend), 2)
+        self.cache.search("swa", {"size": 1}, None, self.do_search)
+        self.cache.search("swa", {"size": 2}, None, self.do_search)
+        self.assertEqual(self.searches, 4)
+        self.assertEqual(self.cache.get_metrics()["hits"], 2)
+
+    def test_backends_implement_all_methods(self):
+        class IncompleteBackend(CacheBackend):
+            def get(self, key):
+                return None
+
+        with self.assertRaises(TypeError):
+            IncompleteBackend()
+
+    def test_shared_generation_invalidates_results(self):
+        sequence = [3]
+        self.cache.shared_generation = SharedGeneration(lambda: sequence[0], check_interval=0)
+        self.cache.search("swa", {"size": 1}, None, self.do_search)
+        self.cache.search("swa", {"size": 1}, None, self.do_search)
+        self.assertEqual(self.searches, 1)
+        # a write through another process
+        sequence[0] = 4
+        self.cache.search("swa", {"size": 1}, None, self.do_search)
+        self.assertEqual(self.searches, 2)
+
+    def test_shared_generation_is_read_once_per_interval(self):
+        reads = []
+        shared_generation = SharedGeneration(lambda: reads.append(1) or len(reads), check_interval=60)
+        self.assertFalse(shared_generation.has_changed())
+        self.assertFalse(shared_generation.has_changed())
+        self.assertEqual(len(reads), 1)
+
+    def test_shared_generation_can_be_read_by_the_caller(self):
+        shared_generation = SharedGeneration(lambda: 0, check_interval=60)
+        self.assertTrue(shared_generation.is_due())
+        self.assertFalse(shared_generation.update(3))
+        # the check started by the caller counts for the interval
+        self.assertFalse(shared_generation.is_due())
+        self.assertFalse(shared_generation.has_changed())
+        shared_generation.checked = 0
+        self.assertTrue(shared_generation.is_due() and shared_generation.update(4))
+
+
+if __name__ == "__main__":
+    unittest.main()
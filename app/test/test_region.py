@@ -0,0 +1,75 @@
+import unittest
+from benchmarks.memory_es import matches
+from models.queries import make_region_query
+from models.region import get_region_source, get_target_regions, get_svg_bounding_box, parse_region, parse_xywh
+
+
+class TestRegion(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Region tests")
+
+    def setUp(self):
+        self.canvas = "http://localhost:3000/iiif/canvas/p1"
+
+    def test_xywh_fragment_is_parsed_to_bounding_box(self):
+        self.assertEqual(parse_xywh("xywh=100,50,300,200"), [100, 50, 400, 250])
+        self.assertEqual(parse_xywh("xywh=pixel:100,50,300,200"), [100, 50, 400, 250])
+
+    def test_percent_and_invalid_fragments_are_skipped(self):
+        self.assertEqual(parse_xywh("xywh=percent:10,10,20,20"), None)
+        self.assertEqual(parse_xywh("t=10,20"), None)
+
+    def test_svg_bounding_box_covers_all_shapes(self):
+        svg = '<svg xmlns="http://www.w3.org/2000/svg"><rect x="10" y="20" width="30" height="40"/>' \
+              '<circle cx="100" cy="100" r="10"/></svg>'
+        self.assertEqual(get_svg_bounding_box(svg), [10, 20, 110, 110])
+
+    def test_svg_path_bounding_box_follows_relative_commands(self):
+        svg = '<svg xmlns="http://www.w3.org/2000/svg"><path d="M10,10 l20,0 v30 h-20 z"/></svg>'
+        self.assertEqual(get_svg_bounding_box(svg), [10, 10, 30, 40])
+
+    def test_svg_bounding_box_skips_non_finite_values(self):
+        svg = '<svg xmlns="http://www.w3.org/2000/svg"><rect x="10" y="20" width="inf" height="40"/>' \
+              '<circle cx="100" cy="100" r="10"/></svg>'
+        self.assertEqual(get_svg_bounding_box(svg), [10, 20, 110, 110])
+
+    def test_target_regions_come_from_selectors_and_fragments(self):
+        target = {
+            "source": self.canvas,
+            "type": "Canvas",
+            "selector": {"type": "FragmentSelector", "value": "xywh=0,0,10,10"}
+        }
+        regions = get_target_regions(target)
+        self.assertEqual(regions, [{"source": self.canvas, "x_min": 0, "y_min": 0, "x_max": 10, "y_max": 10}])
+        regions = get_target_regions(self.canvas + "#xywh=5,5,10,10")
+        self.assertEqual(regions[0]["source"], self.canvas)
+        self.assertEqual(get_target_regions(self.canvas), [])
+
+    def test_region_fragment_is_stripped_from_target_ids(self):
+        self.assertEqual(get_region_source(self.canvas + "#xywh=5,5,10,10"), self.canvas)
+        self.assertEqual(get_region_source(self.canvas + "#page=2"), self.canvas + "#page=2")
+        self.assertEqual(get_region_source(self.canvas), self.canvas)
+
+    def test_region_query_distinguishes_regions_of_one_annotation(self):
+        target_regions = get_target_regions(self.canvas + "#xywh=0,0,10,10") + \
+            get_target_regions(self.canvas + "#xywh=100,100,10,10")
+        doc = {"_id": "a1", "_source": {"target_regions": target_regions}}
+        # the combined bounds overlap this region, but neither region does
+        self.assertFalse(matches(make_region_query([50, 50, 10, 10]), doc))
+        self.assertTrue(matches(make_region_query([105, 0, 10, 200]), doc))
+        self.assertTrue(matches(make_region_query([105, 0, 10, 200], sources=[self.canvas]), doc))
+        self.assertFalse(matches(make_region_query([105, 0, 10, 200], sources=["urn:other"]), doc))
+
+    def test_region_parameter_must_have_four_values(self):
+        self.assertEqual(parse_region("1,2,3,4"), [1, 2, 3, 4])
+        self.assertEqual(parse_region("1,2,3"), None)
+        self.assertEqual(parse_region("1,2,-3,4"), None)
+        self.assertEqual(parse_region("a,b,c,d"), None)
+        self.assertEqual(parse_region("nan,2,3,4"), None)
+        self.assertEqual(parse_region("1,2,inf,4"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import gzip
+import json
+import unittest
+from models.query_cache import LocalCacheBackend, SharedGeneration
+from models.response_cache import PublicResponseCache, make_etag
+
+
+class TestResponseCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Public Response Cache tests")
+
+    def setUp(self):
+        self.cache = PublicResponseCache(LocalCacheBackend(max_size=10, ttl=60), max_age=30)
+        self.made = 0
+
+    def make_data(self):
+        self.made += 1
+        return {"id": "urn:uuid:1", "type": "Annotation"}
+
+    def test_cache_stores_gzipped_json(self):
+        key = self.cache.make_key("http://localhost/annotations/1", {}, None)
+        body, cached = self.cache.get_or_make(key, self.make_data)
+        self.assertFalse(cached)
+        self.assertEqual(json.loads(gzip.decompress(body))["id"], "urn:uuid:1")
+        self.assertEqual(self.cache.get_or_make(key, self.make_data), (body, True))
+        self.assertEqual(self.made, 1)
+
+    def test_key_depends_on_arguments_and_prefer_header(self):
+        url = "http://localhost/annotations/"
+        key = self.cache.make_key(url, {"page": ["0"], "target_id": ["urn:t"]}, None)
+        self.assertEqual(key, self.cache.make_key(url, {"target_id": ["urn:t"], "page": ["0"]}, None))
+        self.assertNotEqual(key, self.cache.make_key(url, {"page": ["1"], "target_id": ["urn:t"]}, None))
+        self.assertNotEqual(key, self.cache.make_key(url, {"page": ["0"], "target_id": ["urn:t"]}, "return=minimal"))
+
+    def test_write_invalidates_responses(self):
+        key = self.cache.make_key("http://localhost/annotations/1", {}, None)
+        self.cache.get_or_make(key, self.make_data)
+        self.cache.invalidate({"urn:t"})
+        key = self.cache.make_key("http://localhost/annotations/1", {}, None)
+        self.assertFalse(self.cache.get_or_make(key, self.make_data)[1])
+        self.assertEqual(self.made, 2)
+
+    def test_write_through_other_process_invalidates_responses(self):
+        sequence = [7]
+        self.cache.shared_generation = SharedGeneration(lambda: sequence[0], check_interval=0)
+        key = self.cache.make_key("http://localhost/annotations/1", {}, None)
+        self.cache.get_or_make(key, self.make_data)
+        sequence[0] = 8
+        key = self.cache.make_key("http://localhost/annotations/1", {}, None)
+        self.assertFalse(self.cache.get_or_make(key, self.make_data)[1])
+
+    def test_etag_changes_with_the_response(self):
+        key = self.cache.make_key("http://localhost/annotations/1", {}, None)
+        body = self.cache.set(key, self.make_data())
+        self.assertEqual(make_etag(body), make_etag(self.cache.set(key, self.make_data())))
+        changed = self.cache.set(key, {"id": "urn:uuid:1", "type": "Annotation", "motivation": "tagging"})
+        self.assertNotEqual(make_etag(body), make_etag(changed))
+        self.assertNotEqual(make_etag(body), make_etag(gzip.decompress(body)))
+
+    def test_headers_let_proxies_cache_responses(self):
+        headers = self.cache.get_headers(etag="abc")
+        self.assertEqual(headers["Cache-Control"], "public, max-age=30")
+        self.assertIn("Authorization", headers["Vary"])
+        self.assertEqual(headers["ETag"], '"abc"')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -187,6 +187,25 @@ class TestAnnotationAPI(unittest.TestCase):
         self.assertEqual(container["total"], 1)
         self.assertEqual(container["first"]["items"][0]["target"][0]["id"], annotation1["target"][0]["id"])
 
+    def test_GET_annotations_page_returns_requested_page(self):
+        self.add_example(access_status="private")
+        self.add_example(access_status="private")
+        self.add_example(access_status="private")
+        server.annotation_store.es.indices.refresh(config["annotation_index"])
+        url_params = {"page": 1, "page_size": 2}
+        response = self.app.get('/api/v1/annotations/', query_string=url_params, headers=self.headers1)
+        page = get_json(response)
+        self.assertEqual(page["type"], "AnnotationPage")
+        self.assertEqual(page["startIndex"], 2)
+        self.assertEqual(page["partOf"]["total"], 3)
+        self.assertEqual(len(page["items"]), 1)
+        self.assertTrue("prev" in page)
+        self.assertFalse("next" in page)
+
+    def test_GET_annotations_with_invalid_page_size_returns_400(self):
+        response = self.app.get('/api/v1/annotations/', query_string={"page_size": 0}, headers=self.headers1)
+        self.assertEqual(response.status_code, 400)
+
     def test_PUT_annotation_returns_modified_annotation(self):
         example = self.add_example()
         example["motivation"] = "linking"
@@ -0,0 +1,69 @@
+import unittest
+from benchmarks.memory_es import matches
+from models.queries import make_range_query
+from models.target_range import get_target_ranges, open_end, parse_range, parse_time_fragment
+
+
+class TestTargetRange(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("\nrunning Target Range tests")
+
+    def setUp(self):
+        self.transcript = "http://localhost:3000/texts/transcript1"
+        self.recording = "http://localhost:3000/media/recording1.mp4"
+
+    def test_time_fragment_is_parsed_to_seconds(self):
+        self.assertEqual(parse_time_fragment("t=10,20"), [10, 20])
+        self.assertEqual(parse_time_fragment("t=npt:1:00,1:30.5"), [60, 90.5])
+        self.assertEqual(parse_time_fragment("t=,20"), [0, 20])
+        self.assertEqual(parse_time_fragment("t=300"), [300, open_end])
+        self.assertEqual(parse_time_fragment("t="), None)
+        self.assertEqual(parse_time_fragment("t=20,10"), None)
+
+    def test_text_position_selector_gives_text_range(self):
+        target = {
+            "source": self.transcript,
+            "type": "Text",
+            "selector": {"type": "TextPositionSelector", "start": 12100, "end": 12200}
+        }
+        self.assertEqual(get_target_ranges(target), [{"source": self.transcript, "dimension": "text",
+                                                      "start": 12100, "end": 12200}])
+
+    def test_media_fragments_give_time_and_text_ranges(self):
+        target = {
+            "source": self.recording,
+            "type": "Video",
+            "selector": {"type": "FragmentSelector", "value": "t=300,330"}
+        }
+        self.assertEqual(get_target_ranges(target)[0]["dimension"], "time")
+        target_range = get_target_ranges(self.transcript + "#char=10,20")[0]
+        self.assertEqual(target_range["dimension"], "text")
+        self.assertEqual(target_range["source"], self.transcript)
+
+    def test_range_query_excludes_range_ends(self):
+        doc = {"_id": "a1", "_source": {"target_ranges": get_target_ranges(self.recording + "#t=300,360")}}
+        self.assertTrue(matches(make_range_query("time", [350, 400]), doc))
+        self.assertFalse(matches(make_range_query("time", [360, 400]), doc))
+        self.assertFalse(matches(make_range_query("text", [350, 400]), doc))
+        self.assertFalse(matches(make_range_query("time", [350, 400], sources=[self.transcript]), doc))
+
+    def test_range_query_distinguishes_ranges_of_one_annotation(self):
+        target_ranges = get_target_ranges(self.transcript + "#char=0,10") + \
+            get_target_ranges(self.recording + "#t=300,360")
+        doc = {"_id": "a1", "_source": {"target_ranges": target_ranges}}
+        # the text dimension with the bounds of the time range would match, but the text range itself does not
+        self.assertFalse(matches(make_range_query("text", [100, 350]), doc))
+        self.assertTrue(matches(make_range_query("time", [100, 350]), doc))
+
+    def test_range_parameter_must_have_start_and_end(self):
+        self.assertEqual(parse_range("12000,13000"), [12000, 13000])
+        self.assertEqual(parse_range("13000,12000"), None)
+        self.assertEqual(parse_range("12000"), None)
+        self.assertEqual(parse_range("0,inf"), None)
+        self.assertEqual(parse_range("nan,10"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()